@@ -0,0 +1,65 @@
+"""
+Display width benchmark.
+
+Compares the table/regex based width helpers in utils with the previous
+per-character ``unicodedata`` implementation on typical book titles.
+
+    python benchmarks/bench_display_width.py
+"""
+import os
+import sys
+import timeit
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import get_display_width, truncate_display
+
+def legacy_width(text: str) -> int:
+    width = 0
+    for char in text:
+        if unicodedata.east_asian_width(char) in ('F', 'W', 'A'):
+            width += 2
+        else:
+            width += 1
+    return width
+
+def legacy_truncate(text: str, max_width: int) -> str:
+    if legacy_width(text) <= max_width:
+        return text
+    result = ""
+    width = 0
+    for ch in text:
+        w = 2 if unicodedata.east_asian_width(ch) in ("F", "W", "A") else 1
+        if width + w > max_width - 3:
+            break
+        result += ch
+        width += w
+    return result + "..."
+
+TITLES = {
+    "pure CJK": "三体死神永生",
+    "CJK + punctuation": "三体Ⅲ：死神永生（典藏版）",
+    "mixed": "Harry Potter 哈利·波特与魔法石 第1卷",
+    "ASCII": "The Pragmatic Programmer 20th Anniversary",
+    "long CJK": "中国古典文学名著全集之红楼梦脂评汇校本上中下三册全本精校版",
+    "emoji": "📚 我的读书笔记 2024",
+}
+
+def bench(fn, *args, number: int = 200000) -> float:
+    return timeit.timeit(lambda: fn(*args), number=number) / number * 1e6
+
+def main():
+    print(f"{'title':<20} {'width old/new (µs)':>22} {'x':>6} {'truncate old/new (µs)':>25} {'x':>6}")
+    for name, title in TITLES.items():
+        assert get_display_width(title) == legacy_width(title), name
+        assert truncate_display(title, 30) == legacy_truncate(title, 30), name
+        w_old, w_new = bench(legacy_width, title), bench(get_display_width, title)
+        t_old, t_new = bench(legacy_truncate, title, 30), bench(truncate_display, title, 30)
+        print(
+            f"{name:<20} {w_old:>10.2f} / {w_new:<9.2f} {w_old / w_new:>6.1f} "
+            f"{t_old:>12.2f} / {t_new:<10.2f} {t_old / t_new:>6.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
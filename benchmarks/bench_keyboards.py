@@ -0,0 +1,64 @@
+"""
+Keyboard rendering benchmark.
+
+Times one search-result render (search keyboard, plus the filter menu and
+settings keyboards) with the memoized factories in keyboards.py against a
+from-scratch InlineKeyboardBuilder rebuild of the same markup, the way
+every render worked before.
+
+    python benchmarks/bench_keyboards.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+import keyboards
+
+def rebuild(markup):
+    """Rebuild ``markup`` button by button, as the uncached factories did."""
+    builder = InlineKeyboardBuilder()
+    sizes = []
+    for row in markup.inline_keyboard:
+        for button in row:
+            builder.button(text=button.text, callback_data=button.callback_data)
+        sizes.append(len(row))
+    builder.adjust(*sizes)
+    return builder.as_markup()
+
+STATES = [
+    # (page, total pages, books, sort, filters)
+    (0, 12, 10, "best", {}),
+    (3, 12, 10, "hot", {"format": "EPUB"}),
+    (11, 12, 4, "new", {"format": "PDF", "size": "<5MB"}),
+]
+
+def render_cached(page, total, books, sort, filters):
+    keyboards.get_search_keyboard(page, total, list(range(1000, 1000 + books)), sort=sort, filters=filters)
+    keyboards.get_filter_menu_keyboard("format", filters)
+    keyboards.get_settings_keyboard({})
+
+def render_uncached(page, total, books, sort, filters, markups):
+    for markup in markups:
+        rebuild(markup)
+
+def main(number: int = 100):
+    print(f"{'state':<28} {'builder (µs)':>14} {'memoized (µs)':>14} {'x':>6}")
+    for state in STATES:
+        page, total, books, sort, filters = state
+        markups = [
+            keyboards.get_search_keyboard(page, total, list(range(1000, 1000 + books)), sort=sort, filters=filters),
+            keyboards.get_filter_menu_keyboard("format", filters),
+            keyboards.get_settings_keyboard({}),
+        ]
+        before = timeit.timeit(lambda: render_uncached(*state, markups), number=number) / number * 1e6
+        # Memoized renders are much cheaper; time more of them for a stable figure
+        after = timeit.timeit(lambda: render_cached(*state), number=number * 20) / (number * 20) * 1e6
+        label = f"p{page + 1}/{total} {sort} {','.join(filters.values()) or '-'}"
+        print(f"{label:<28} {before:>14.1f} {after:>14.1f} {before / after:>6.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import asyncio
+import html
 import logging
 import time
 import json
 import sys
-from typing import Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 # Use uvloop on non-Windows systems for better performance
 if sys.platform != "win32":
@@ -15,17 +16,26 @@ if sys.platform != "win32":
 
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.filters import Command, CommandStart, CommandObject
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineQuery, InlineQueryResultCachedDocument, InlineQueryResultsButton
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
 from config import config
-from services import meili_service, db_service, redis_service
-from utils import format_book_list, format_book_detail, format_size
+from services import meili_service, db_service, redis_service, search_prefetcher, indexing_queue
+from utils import format_book_list, format_book_detail, format_size, build_meili_document, truncate_display, list_item_cache
+from webhook import WebhookServer, run_webhook
+from update_stream import UpdateStreamProducer, run_polling_receiver, read_worker_stats
+from ratelimit import OutboundLimiter, RateLimitMiddleware, low_priority
+from uploads import UploadBatcher
+from inline_search import InlineSearcher
+from query_planner import plan_facets, plan_search, plan_cache_stats
+from query_normalizer import normalize_query, normalizer_stats
 from keyboards import (
     get_search_keyboard,
     get_book_detail_keyboard,
     get_moderation_keyboard,
+    get_batch_moderation_keyboard,
+    drop_moderation_item,
     get_filter_menu_keyboard,
     get_settings_keyboard,
     get_settings_menu_keyboard,
@@ -37,7 +47,15 @@ logger = logging.getLogger(__name__)
 
 # Bot & Dispatcher
 bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+outbound_limiter = OutboundLimiter(
+    global_rate=config.OUTBOUND_GLOBAL_RATE,
+    chat_rate=config.OUTBOUND_CHAT_RATE,
+    group_rate=config.OUTBOUND_GROUP_RATE,
+    chat_burst=config.OUTBOUND_CHAT_BURST,
+)
+bot.session.middleware(RateLimitMiddleware(outbound_limiter, max_retries=config.OUTBOUND_MAX_RETRIES))
 dp = Dispatcher()
+webhook_server: Optional[WebhookServer] = None  # set in webhook mode
 
 # --- Helpers ---
 
@@ -90,73 +108,34 @@ async def search_and_render(
         ctx_key = event.from_user.id if event.from_user else chat_id
         reply_method = event.message.edit_text
 
+    # Any re-render (new query, page, sort or filter) makes the pending prefetch stale;
+    # a prefetch of the page being opened keeps running inside the search singleflight
+    if search_prefetcher is not None:
+        search_prefetcher.cancel(ctx_key)
+
     filters = filters or {}
     if isinstance(event, Message):
         user_settings = await redis_service.get_user_settings(ctx_key)
         if user_settings.get("content_rating") and user_settings.get("content_rating") != "ALL":
             filters.setdefault("rating", user_settings.get("content_rating"))
 
-    def to_filter_expr(filters_dict: dict) -> list[str]:
-        parts: list[str] = []
-        fmt = filters_dict.get("format")
-        if isinstance(fmt, str) and fmt and fmt != "ALL":
-            parts.append(f'ext = "{fmt}"')
-
-        rating = filters_dict.get("rating")
-        rating_map = {"G": 0, "R15": 1, "R18": 2}
-        if isinstance(rating, str) and rating in rating_map:
-            parts.append(f"content_rating <= {rating_map[rating]}")
-
-        size = filters_dict.get("size")
-        size_map = {
-            "<5MB": (None, 5 * 1024 * 1024),
-            "5-20MB": (5 * 1024 * 1024, 20 * 1024 * 1024),
-            "20-50MB": (20 * 1024 * 1024, 50 * 1024 * 1024),
-            ">50MB": (50 * 1024 * 1024, None),
-        }
-        if isinstance(size, str) and size in size_map:
-            lo, hi = size_map[size]
-            if lo is not None:
-                parts.append(f"file_size >= {lo}")
-            if hi is not None:
-                parts.append(f"file_size < {hi}")
-
-        words = filters_dict.get("words")
-        words_map = {
-            "<10万": (None, 100000),
-            "10-50万": (100000, 500000),
-            "50-100万": (500000, 1000000),
-            ">100万": (1000000, None),
-        }
-        if isinstance(words, str) and words in words_map:
-            lo, hi = words_map[words]
-            if lo is not None:
-                parts.append(f"word_count >= {lo}")
-            if hi is not None:
-                parts.append(f"word_count < {hi}")
-        return parts
-
-    meili_filter_parts: list[str] = []
-    if filter_type == "tags":
-        meili_filter_parts.append(f'tags = "{query}"')
-    meili_filter_parts.extend(to_filter_expr(filters))
-    meili_filter = " AND ".join(meili_filter_parts) if meili_filter_parts else None
-
-    meili_sort = None
-    if sort == "hot":
-        meili_sort = ["downloads:desc"]
-    elif sort == "new":
-        meili_sort = ["created_at:desc"]
-    elif sort == "big":
-        meili_sort = ["file_size:desc"]
+    plan = plan_search(query, filter_type, filters, sort)
+    # Tags are matched exactly; keyword searches use the canonical query form
+    search_query = query if filter_type == "tags" else (normalize_query(query) or query.strip())
+    meili_filter = plan.filter
+    meili_sort = plan.sort_list
+    # Filter menu counts don't change across pages, so only the first page asks for them
+    facet_plan = plan_facets(query, filter_type, filters) if page == 0 and keyboard_mode == "default" else None
     
     try:
         search_result = await meili_service.search(
-            query, 
+            search_query, 
             limit=limit, 
             offset=page * limit, 
             filter=meili_filter,
             sort=meili_sort,
+            plan_key=plan.key,
+            facets=facet_plan,
         )
         hits = search_result.get('hits', [])
         total_hits = search_result.get('estimatedTotalHits', 0)
@@ -186,12 +165,24 @@ async def search_and_render(
         )
         keyboard = get_search_keyboard(page, total_pages, book_ids, mode=keyboard_mode, sort=sort, filters=filters)
         
-        existing_ctx = await redis_service.get_search_context(ctx_key)
-        if not existing_ctx or existing_ctx.get("query") != query or existing_ctx.get("filter") != filter_type:
-            await redis_service.cache_search_context(ctx_key, query, filter_type)
-        await redis_service.update_search_context(ctx_key, {"page": page, "sort": sort, "filters": filters})
+        ctx_patch = {"page": page, "sort": sort, "filters": filters}
+        if facet_plan is not None and "facet_counts" in search_result:
+            ctx_patch["facets"] = search_result["facet_counts"]
+            ctx_patch["facets_key"] = facet_plan.key
+        await redis_service.upsert_search_context(ctx_key, query, filter_type, ctx_patch)
         
         await reply_method(text, reply_markup=keyboard, disable_web_page_preview=True)
+
+        if search_prefetcher is not None and keyboard_mode == "default" and page + 1 < total_pages:
+            search_prefetcher.schedule(
+                ctx_key,
+                search_query,
+                limit=limit,
+                offset=(page + 1) * limit,
+                filter=meili_filter,
+                sort=meili_sort,
+                plan_key=plan.key,
+            )
         
     except Exception as e:
         logger.error(f"Search error: {e}")
@@ -268,6 +259,36 @@ async def cmd_settings(message: Message):
     kb = get_settings_keyboard(settings)
     await message.answer(text, reply_markup=kb, disable_web_page_preview=True)
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if not message.from_user or message.from_user.id not in config.ADMIN_IDS:
+        return
+    stats = {
+        "meili": meili_service.stats(),
+        "prefetch": search_prefetcher.stats() if search_prefetcher is not None else None,
+        "user_settings_cache": redis_service.settings_cache.stats(),
+        "book_cache": db_service.book_cache.stats(),
+        "list_item_cache": list_item_cache.stats(),
+        "query_plans": plan_cache_stats(),
+        "query_normalizer": normalizer_stats(),
+        "db": db_service.stats(),
+        "indexing": indexing_queue.stats(),
+        "webhook": webhook_server.stats() if webhook_server is not None else None,
+        "outbound": outbound_limiter.stats(),
+        "uploads": upload_batcher.stats(),
+        "inline": inline_searcher.stats(),
+    }
+    try:
+        stats["sync"] = await redis_service.get_sync_status()
+    except Exception as e:
+        logger.warning(f"Failed to read sync status: {e}")
+    if config.UPDATE_STREAM:
+        try:
+            stats["stream_workers"] = await read_worker_stats(redis_service.redis)
+        except Exception as e:
+            logger.warning(f"Failed to read stream worker stats: {e}")
+    await message.answer(f"📊 <b>运行指标</b>\n<pre>{json.dumps(stats, ensure_ascii=False, indent=2)}</pre>")
+
 @dp.message(Command("s"))
 async def cmd_search_s(message: Message, command: CommandObject):
     if not command.args:
@@ -290,54 +311,177 @@ async def text_search(message: Message):
 
 @dp.message(F.document)
 async def handle_document(message: Message):
-    doc = message.document
-    file_id = doc.file_id
-    file_unique_id = doc.file_unique_id
-    file_name = doc.file_name or "Unknown"
-    file_size = doc.file_size
-    
-    # Deduplication
-    exists = await db_service.get_book_by_file_unique_id(file_unique_id)
-    if exists:
-        await message.reply("⚠️ 该文件已存在于库中。")
-        return
-
-    upload_data = {
-        'file_id': file_id,
-        'file_unique_id': file_unique_id,
-        'file_name': file_name,
-        'file_size': file_size,
-        'uploader_id': message.from_user.id,
-        'username': message.from_user.username if message.from_user.username else "Unknown"
-    }
+    # An album shares a media_group_id; other files from the same user are
+    # grouped by the batch window. Journalled before the update is acked.
+    await upload_batcher.add(message.media_group_id or message.from_user.id, message)
+
+def render_upload_digest(items: List[Dict[str, Any]], uploader_line: str) -> str:
+    lines = [f"📝 <b>新文件待审核</b>（{len(items)} 个）", uploader_line, ""]
+    for i, item in enumerate(items, 1):
+        name = html.escape(truncate_display(item["file_name"], 40))
+        lines.append(f"{i}. {name}（{format_size(item['file_size'])}）")
+    return "\n".join(lines)
 
-    uploader_settings = await redis_service.get_user_settings(message.from_user.id)
-    uploader_line = f"上传者: {message.from_user.full_name} ({message.from_user.id})"
-    if uploader_settings.get("hide_personal_info"):
-        uploader_line = "上传者: 匿名"
-    
-    if not config.ADMIN_IDS:
-        await message.reply("⚠️ 系统未配置管理员，无法审核上传。")
-        return
-        
-    # Create session with short ID
-    short_id = await redis_service.create_upload_session(upload_data)
-    
-    for admin_id in config.ADMIN_IDS:
+async def notify_admins(text: str, kb: types.InlineKeyboardMarkup):
+    async def notify_admin(admin_id: int):
         try:
-            text = (
-                f"📝 <b>新文件待审核</b>\n"
-                f"文件名: {file_name}\n"
-                f"大小: {format_size(file_size)}\n"
-                f"{uploader_line}"
-            )
-            kb = get_moderation_keyboard(short_id)
             await bot.send_message(admin_id, text, reply_markup=kb)
         except Exception as e:
             logger.error(f"Failed to notify admin {admin_id}: {e}")
 
+    # Notifications yield to interactive replies in the outbound limiter
+    with low_priority():
+        await asyncio.gather(*(notify_admin(admin_id) for admin_id in config.ADMIN_IDS))
+
+async def process_upload_batch(key: Union[int, str], messages: List[Message]):
+    last = messages[-1]
+    user = last.from_user
+
+    # One lookup for the whole batch; repeated files inside it count once
+    by_unique_id: Dict[str, Message] = {}
+    for m in messages:
+        by_unique_id.setdefault(m.document.file_unique_id, m)
+    existing = await db_service.get_existing_file_unique_ids(list(by_unique_id))
+    fresh = [m for unique_id, m in by_unique_id.items() if unique_id not in existing]
+    duplicates = len(messages) - len(fresh)
+
+    if not fresh:
+        if len(messages) == 1:
+            await last.reply("⚠️ 该文件已存在于库中。")
+        else:
+            await last.reply(f"⚠️ 这 {len(messages)} 个文件均已存在于库中。")
+        return
+
+    if not config.ADMIN_IDS:
+        await last.reply("⚠️ 系统未配置管理员，无法审核上传。")
+        return
+
+    uploader_settings = await redis_service.get_user_settings(user.id)
+    uploader_line = f"上传者: {user.full_name} ({user.id})"
+    if uploader_settings.get("hide_personal_info"):
+        uploader_line = "上传者: 匿名"
+
+    items = [
+        {
+            'file_id': m.document.file_id,
+            'file_unique_id': m.document.file_unique_id,
+            'file_name': m.document.file_name or "Unknown",
+            'file_size': m.document.file_size,
+            'uploader_id': user.id,
+            'username': user.username if user.username else "Unknown",
+        }
+        for m in fresh
+    ]
+
+    if len(items) == 1:
+        item = items[0]
+        short_id = await redis_service.create_upload_session(item)
+        text = (
+            f"📝 <b>新文件待审核</b>\n"
+            f"文件名: {item['file_name']}\n"
+            f"大小: {format_size(item['file_size'])}\n"
+            f"{uploader_line}"
+        )
+        await notify_admins(text, get_moderation_keyboard(short_id))
+    else:
+        for i in range(0, len(items), config.UPLOAD_DIGEST_SIZE):
+            chunk = items[i:i + config.UPLOAD_DIGEST_SIZE]
+            batch_id, short_ids = await redis_service.create_upload_batch(chunk)
+            await notify_admins(
+                render_upload_digest(chunk, uploader_line),
+                get_batch_moderation_keyboard(batch_id, short_ids),
+            )
+
     if not uploader_settings.get("mute_upload_feedback"):
-        await message.reply("✅ 文件已提交审核，感谢您的贡献！")
+        if len(messages) == 1:
+            await last.reply("✅ 文件已提交审核，感谢您的贡献！")
+        else:
+            skipped = f"，{duplicates} 个已存在于库中" if duplicates else ""
+            await last.reply(f"✅ 已提交 {len(items)} 个文件审核{skipped}，感谢您的贡献！")
+
+async def journal_upload(key: Union[int, str], message: Message):
+    await redis_service.journal_upload(key, message.model_dump_json(exclude_none=True))
+
+async def recover_uploads() -> List[tuple]:
+    claimed = await redis_service.claim_stale_uploads(config.UPLOAD_RECOVER_AFTER)
+    return [
+        (key, [Message.model_validate_json(payload).as_(bot) for payload in payloads])
+        for key, payloads in claimed
+    ]
+
+upload_batcher = UploadBatcher(
+    process_upload_batch,
+    window=config.UPLOAD_BATCH_WINDOW,
+    max_wait=config.UPLOAD_BATCH_MAX_WAIT,
+    persist=journal_upload,
+    release=redis_service.release_uploads,
+    recover=recover_uploads,
+    recover_interval=config.UPLOAD_RECOVER_AFTER / 4,
+)
+
+# --- Inline mode ---
+
+async def _inline_backend_search(query: str, limit: int, offset: int, filter: Optional[str], plan_key: Optional[str]):
+    return await meili_service.search(query, limit=limit, offset=offset, filter=filter, plan_key=plan_key)
+
+inline_searcher = InlineSearcher(
+    _inline_backend_search,
+    page_size=config.INLINE_PAGE_SIZE,
+    debounce=config.INLINE_DEBOUNCE,
+    budget=config.INLINE_BUDGET,
+    cache_ttl=config.INLINE_CACHE_TTL,
+)
+
+def build_inline_result(hit: Dict[str, Any]) -> InlineQueryResultCachedDocument:
+    title = truncate_display(str(hit.get("title") or hit.get("file_name") or "Unknown"), 60)
+    author = str(hit.get("author") or "佚名")
+    return InlineQueryResultCachedDocument(
+        id=str(hit["id"]),
+        title=title,
+        document_file_id=hit["file_id"],
+        description=f"{truncate_display(author, 30)} · {hit.get('ext') or 'FILE'} · {format_size(hit.get('file_size', 0))}",
+    )
+
+@dp.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    text = inline_query.query.strip()
+    if not text:
+        await inline_query.answer([], cache_time=config.INLINE_CACHE_TIME)
+        return
+    filters: Dict[str, Any] = {}
+
+    async def plan_inline():
+        # Resolved after the debounce, so superseded keystrokes cost no lookup
+        user_settings = await redis_service.get_user_settings(inline_query.from_user.id)
+        if user_settings.get("content_rating") and user_settings.get("content_rating") != "ALL":
+            filters["rating"] = user_settings.get("content_rating")
+        plan = plan_search(text, filters=filters)
+        return plan.filter, plan.key
+
+    page = await inline_searcher.query(inline_query.from_user.id, text, inline_query.offset, plan_inline)
+    if page is None:
+        # Superseded by a newer keystroke; Telegram only shows the latest answer
+        return
+    try:
+        if page.timed_out:
+            # Clients do not retry an empty answer; say so instead of showing nothing
+            await inline_query.answer(
+                [],
+                cache_time=0,
+                is_personal=True,
+                button=InlineQueryResultsButton(text="⏳ 搜索较慢，请稍后再输入一次", start_parameter="inline"),
+            )
+            return
+        results = [build_inline_result(hit) for hit in page.hits if hit.get("file_id")]
+        await inline_query.answer(
+            results,
+            cache_time=config.INLINE_CACHE_TIME,
+            is_personal=bool(filters),
+            next_offset=page.next_offset,
+        )
+    except Exception as e:
+        # The query expires after a few seconds; nothing left to answer
+        logger.warning(f"Failed to answer inline query: {e}")
 
 # --- Callbacks ---
 
@@ -458,7 +602,12 @@ async def on_filter_menu(callback: CallbackQuery):
     if not ctx:
         await callback.answer("⚠️ 搜索会话已过期，请重新搜索。", show_alert=True)
         return
-    kb = get_filter_menu_keyboard(key, selected=ctx.get("filters", {}) or {})
+    filters = ctx.get("filters", {}) or {}
+    # Counts cached with the results, valid only while the filters are unchanged
+    counts = None
+    if ctx.get("facets_key") == plan_facets(ctx.get("query") or "", ctx.get("filter"), filters).key:
+        counts = ctx.get("facets", {}).get(key) or None
+    kb = get_filter_menu_keyboard(key, selected=filters, counts=counts)
     await callback.message.edit_reply_markup(reply_markup=kb)
     await callback.answer()
 
@@ -523,6 +672,9 @@ async def on_select_book(callback: CallbackQuery):
     book_id = int(book_id_str)
 
     user_id = callback.from_user.id if callback.from_user else callback.message.chat.id
+    # Leaving the result list: the next page is no longer needed
+    if search_prefetcher is not None:
+        search_prefetcher.cancel(user_id)
     settings = await redis_service.get_user_settings(user_id)
     if settings.get("search_button_mode") == "download":
         book = await db_service.get_book(book_id)
@@ -532,7 +684,7 @@ async def on_select_book(callback: CallbackQuery):
         book = dict(book)
         try:
             await bot.send_document(callback.message.chat.id, book["file_id"])
-            asyncio.create_task(db_service.increment_download(book_id))
+            db_service.record_download(book_id)
             await callback.answer()
         except Exception as e:
             logger.error(f"Send document failed: {e}")
@@ -560,60 +712,107 @@ async def on_download(callback: CallbackQuery):
     try:
         await bot.send_document(callback.message.chat.id, book["file_id"])
         await callback.answer()
-        # Async increment
-        asyncio.create_task(db_service.increment_download(book_id))
+        # Buffered, flushed in batches by the download flusher
+        db_service.record_download(book_id)
     except Exception as e:
         logger.error(f"Send document failed: {e}")
         await callback.answer("❌ 发送失败，文件可能已失效")
 
+async def approve_uploads(short_ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Approve pending upload sessions, returning those that were still pending.
+
+    Sessions whose file was already in the library are marked ``duplicate``.
+    """
+    sessions = await redis_service.get_and_delete_upload_sessions(short_ids)
+    approved = [data for data in sessions if data]
+    if not approved:
+        return []
+    for data in approved:
+        data['title'] = data['file_name'].rsplit('.', 1)[0]
+        data['author'] = "Unknown"
+
+    books, skipped = await db_service.add_books(approved)
+    for data in skipped:
+        data['duplicate'] = True
+    # Indexed in the background by the batching queue
+    indexing_queue.enqueue([build_meili_document(book) for book in books])
+    return approved
+
+async def notify_uploaders(approved: List[Dict[str, Any]]):
+    """Tell each uploader once about their approved files."""
+    by_uploader: Dict[int, List[str]] = {}
+    for data in approved:
+        if data.get('uploader_id') and not data.get('duplicate'):
+            by_uploader.setdefault(data['uploader_id'], []).append(data['file_name'])
+
+    async def notify(uploader_id: int, names: List[str]):
+        if len(names) == 1:
+            text = f"✅ 您的文件 {names[0]} 已通过审核！"
+        else:
+            text = f"✅ 您的 {len(names)} 个文件已通过审核！"
+        try:
+            await bot.send_message(uploader_id, text)
+        except Exception:
+            pass # User might have blocked bot
+
+    with low_priority():
+        await asyncio.gather(*(notify(uploader_id, names) for uploader_id, names in by_uploader.items()))
+
+def approval_summary(approved: List[Dict[str, Any]]) -> str:
+    duplicates = sum(1 for data in approved if data.get('duplicate'))
+    summary = f"✅ 已通过 {len(approved) - duplicates} 个"
+    if duplicates:
+        summary += f"，{duplicates} 个已存在于库中"
+    return summary
+
+@dp.message(Command("approve_all"))
+async def cmd_approve_all(message: Message):
+    if not message.from_user or message.from_user.id not in config.ADMIN_IDS:
+        return
+    started = time.monotonic()
+    approved: List[Dict[str, Any]] = []
+    chunk: List[str] = []
+    try:
+        async for short_id in redis_service.iter_upload_session_ids():
+            chunk.append(short_id)
+            if len(chunk) >= config.BULK_APPROVE_CHUNK:
+                approved.extend(await approve_uploads(chunk))
+                chunk = []
+        approved.extend(await approve_uploads(chunk))
+        await message.answer(f"{approval_summary(approved)}，用时 {time.monotonic() - started:.1f} 秒")
+    except Exception as e:
+        logger.error(f"Bulk approval error: {e}")
+        await message.answer(f"❌ 批量审核中断，已通过 {len(approved)} 个")
+    await notify_uploaders(approved)
+
 @dp.callback_query(F.data.startswith("mod_approve:"))
 async def on_approve(callback: CallbackQuery):
     _, _, short_id = callback.data.partition(":")
     if not short_id:
         await callback.answer("无效的审核请求")
         return
-    
-    # Atomic get and delete
-    data = await redis_service.get_and_delete_upload_session(short_id)
-    
-    if not data:
-        await callback.answer("⚠️ 该请求已被处理或已过期")
-        # Update message to reflect status
-        await callback.message.edit_text(f"{callback.message.text}\n\n[已处理/过期]")
-        return
-        
+
     try:
-        title = data['file_name'].rsplit('.', 1)[0]
-        data['title'] = title
-        data['author'] = "Unknown"
-        
-        book_id = await db_service.add_book(data)
-        
-        book = await db_service.get_book(book_id)
-        if book:
-            meili_doc = dict(book)
-            file_name = str(meili_doc.get("file_name") or "")
-            meili_doc["ext"] = (file_name.split(".")[-1].upper() if "." in file_name else "FILE")
-            meili_doc["word_count"] = int(meili_doc.get("word_count") or 0) if "word_count" in meili_doc else 0
-            meili_doc["content_rating"] = int(meili_doc.get("content_rating") or 0) if "content_rating" in meili_doc else 0
-            created_at = meili_doc.get("created_at")
-            if created_at is not None and hasattr(created_at, "isoformat"):
-                meili_doc["created_at"] = created_at.isoformat()
-            await meili_service.add_documents([meili_doc])
-        
-        await callback.message.edit_text(f"✅ 已通过: {data['file_name']}")
-        await callback.answer("审核通过")
-        
-        # Notify uploader (if we had stored their ID properly and bot can initiate)
-        # data['uploader_id'] is available.
-        try:
-            await bot.send_message(data['uploader_id'], f"✅ 您的文件 {data['file_name']} 已通过审核！")
-        except:
-            pass # User might have blocked bot
-            
+        approved = await approve_uploads([short_id])
     except Exception as e:
         logger.error(f"Approval error: {e}")
         await callback.answer("❌ 处理失败")
+        return
+
+    if not approved:
+        await callback.answer("⚠️ 该请求已被处理或已过期")
+        # Update message to reflect status
+        await callback.message.edit_text(f"{callback.message.text}\n\n[已处理/过期]")
+        return
+
+    if approved[0].get('duplicate'):
+        await callback.message.edit_text(f"⚠️ 已存在于库中: {approved[0]['file_name']}")
+        await callback.answer("文件已存在")
+        return
+    await callback.message.edit_text(f"✅ 已通过: {approved[0]['file_name']}")
+    await callback.answer("审核通过")
+    await notify_uploaders(approved)
 
 @dp.callback_query(F.data.startswith("mod_reject:"))
 async def on_reject(callback: CallbackQuery):
@@ -627,6 +826,72 @@ async def on_reject(callback: CallbackQuery):
     await callback.message.edit_text("❌ 已拒绝")
     await callback.answer("已拒绝")
 
+@dp.callback_query(F.data.startswith("mod_item:"))
+async def on_moderate_item(callback: CallbackQuery):
+    parts = callback.data.split(":")
+    if len(parts) != 3 or parts[1] not in ("a", "r") or not parts[2]:
+        await callback.answer("无效的审核请求")
+        return
+    action, short_id = parts[1], parts[2]
+
+    approved: List[Dict[str, Any]] = []
+    try:
+        if action == "a":
+            approved = await approve_uploads([short_id])
+            handled = bool(approved)
+        else:
+            handled = bool(await redis_service.delete_upload_sessions([short_id]))
+    except Exception as e:
+        logger.error(f"Moderation error: {e}")
+        await callback.answer("❌ 处理失败")
+        return
+
+    # Drop the item's buttons; the digest text stays as the record
+    markup = drop_moderation_item(callback.message.reply_markup, short_id)
+    if markup is None:
+        await callback.message.edit_text(f"{callback.message.html_text}\n\n[已全部处理]")
+    else:
+        await callback.message.edit_reply_markup(reply_markup=markup)
+
+    if not handled:
+        await callback.answer("⚠️ 该请求已被处理或已过期")
+    elif action == "a":
+        await callback.answer("文件已存在" if approved[0].get('duplicate') else "审核通过")
+        await notify_uploaders(approved)
+    else:
+        await callback.answer("已拒绝")
+
+@dp.callback_query(F.data.startswith("mod_all:"))
+async def on_moderate_batch(callback: CallbackQuery):
+    parts = callback.data.split(":")
+    if len(parts) != 3 or parts[1] not in ("a", "r") or not parts[2]:
+        await callback.answer("无效的审核请求")
+        return
+    action, batch_id = parts[1], parts[2]
+
+    short_ids = await redis_service.pop_upload_batch(batch_id)
+    if not short_ids:
+        await callback.answer("⚠️ 该请求已被处理或已过期")
+        await callback.message.edit_text(f"{callback.message.html_text}\n\n[已处理/过期]")
+        return
+
+    approved: List[Dict[str, Any]] = []
+    try:
+        if action == "a":
+            approved = await approve_uploads(short_ids)
+            summary = approval_summary(approved)
+        else:
+            rejected = await redis_service.delete_upload_sessions(short_ids)
+            summary = f"❌ 已拒绝 {rejected} 个"
+    except Exception as e:
+        logger.error(f"Batch moderation error: {e}")
+        await callback.answer("❌ 处理失败")
+        return
+
+    await callback.message.edit_text(f"{callback.message.html_text}\n\n{summary}")
+    await callback.answer(summary)
+    await notify_uploaders(approved)
+
 @dp.callback_query(F.data == "settings")
 async def on_settings(callback: CallbackQuery):
     user_id = callback.from_user.id if callback.from_user else callback.message.chat.id
@@ -714,6 +979,8 @@ async def on_rel(callback: CallbackQuery):
 
 @dp.callback_query(F.data == "close")
 async def on_close(callback: CallbackQuery):
+    if search_prefetcher is not None and callback.from_user:
+        search_prefetcher.cancel(callback.from_user.id)
     await callback.message.delete()
 
 @dp.callback_query(F.data == "noop")
@@ -722,10 +989,7 @@ async def on_noop(callback: CallbackQuery):
 
 # --- Startup/Shutdown ---
 
-async def on_startup():
-    await db_service.connect()
-    await meili_service.init_index()
-    
+async def detect_bot_username():
     # Auto-detect bot username for deep linking
     try:
         me = await bot.get_me()
@@ -735,6 +999,7 @@ async def on_startup():
     except Exception as e:
         logger.error(f"Failed to get bot info: {e}")
 
+async def register_bot_commands():
     try:
         await bot.set_my_commands(
             [
@@ -748,17 +1013,75 @@ async def on_startup():
     except Exception as e:
         logger.error(f"Failed to set bot commands: {e}")
 
-    logger.info("Bot started")
+async def on_startup():
+    started = time.time()
+    redis_service.start_invalidation_listener()
+    # Independent steps run concurrently; index settings are only diffed
+    # here, the resulting Meilisearch task is awaited in the background.
+    await asyncio.gather(
+        db_service.connect(),
+        meili_service.init_index(),
+        detect_bot_username(),
+        register_bot_commands(),
+    )
+    db_service.start_download_flusher()
+    indexing_queue.start()
+    upload_batcher.start()
+
+    logger.info(f"Bot started in {time.time() - started:.2f}s")
 
 async def on_shutdown():
+    await upload_batcher.close()
+    await indexing_queue.close()
     await db_service.close()
     await redis_service.close()
+    await meili_service.close()
     await bot.session.close()
     logger.info("Bot stopped")
 
+async def run_stream_receiver():
+    """Only forward updates to the Redis stream; update_stream.py workers handle them."""
+    global webhook_server
+    producer = UpdateStreamProducer(redis_service.redis, config.UPDATE_STREAM_SHARDS, config.UPDATE_STREAM_MAXLEN)
+    await producer.ensure_groups()
+    try:
+        if config.BOT_MODE == "webhook":
+            webhook_server = WebhookServer(
+                dp,
+                bot,
+                path=config.WEBHOOK_PATH,
+                secret=config.WEBHOOK_SECRET,
+                queue_size=config.WEBHOOK_QUEUE_SIZE,
+                workers=config.WEBHOOK_WORKERS,
+                sink=producer.publish,
+            )
+            await run_webhook(webhook_server, config.WEBHOOK_URL, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+        else:
+            await run_polling_receiver(bot, producer, dp.resolve_used_update_types())
+    finally:
+        await redis_service.close()
+        await bot.session.close()
+
 async def main():
+    global webhook_server
+    if config.UPDATE_STREAM:
+        await run_stream_receiver()
+        return
+
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
+
+    if config.BOT_MODE == "webhook":
+        webhook_server = WebhookServer(
+            dp,
+            bot,
+            path=config.WEBHOOK_PATH,
+            secret=config.WEBHOOK_SECRET,
+            queue_size=config.WEBHOOK_QUEUE_SIZE,
+            workers=config.WEBHOOK_WORKERS,
+        )
+        await run_webhook(webhook_server, config.WEBHOOK_URL, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+        return
     
     # 自动删除可能存在的 Webhook，防止冲突
     logger.info("Deleting webhook to enable polling mode...")
@@ -0,0 +1,192 @@
+"""
+Bulk catalog import.
+
+Streams an NDJSON or CSV manifest into Postgres (COPY per batch) and pushes
+the resulting documents to Meilisearch in large batches, waiting on the
+indexing tasks. Progress is checkpointed so an interrupted run can resume.
+
+    python import_books.py books.ndjson --checkpoint books.ckpt
+
+Each record needs `file_id` and `file_unique_id`; `file_name`, `file_size`,
+`title`, `author`, `tags` (list, or "|"-separated in CSV) and `uploader_id`
+are optional.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from services import meili_service, db_service, redis_service, MeilisearchError
+from utils import build_meili_document
+
+logger = logging.getLogger("import_books")
+
+def iter_manifest(path: str, fmt: str, skip: int = 0) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    Yield manifest records, skipping the first ``skip`` ones without parsing
+    them. A line that is not a JSON object yields None, so positions stay
+    aligned with the checkpoint.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for i, row in enumerate(reader):
+                if i >= skip:
+                    yield row
+            return
+        index = 0
+        for line in f:
+            if not line.strip():
+                continue
+            if index >= skip:
+                try:
+                    raw = json.loads(line)
+                except ValueError:
+                    raw = None
+                yield raw if isinstance(raw, dict) else None
+            index += 1
+
+def to_record(raw: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+    """Normalize a manifest entry into a tuple matching ``IMPORT_COLUMNS``."""
+    file_id = str(raw.get("file_id") or "").strip()
+    file_unique_id = str(raw.get("file_unique_id") or "").strip()
+    if not file_id or not file_unique_id:
+        return None
+    file_name = str(raw.get("file_name") or "Unknown")
+    try:
+        file_size = int(raw.get("file_size") or 0)
+    except (TypeError, ValueError):
+        file_size = 0
+    tags = raw.get("tags") or []
+    if isinstance(tags, str):
+        tags = [t.strip() for t in tags.split("|") if t.strip()]
+    uploader_id = raw.get("uploader_id")
+    try:
+        uploader_id = int(uploader_id) if uploader_id not in (None, "") else None
+    except (TypeError, ValueError):
+        uploader_id = None
+    return (
+        file_id,
+        file_unique_id,
+        file_name,
+        file_size,
+        raw.get("title") or file_name.rsplit(".", 1)[0],
+        raw.get("author") or "Unknown",
+        [str(t) for t in tags],
+        uploader_id,
+    )
+
+def load_checkpoint(path: Optional[str], manifest: str) -> int:
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("manifest") != os.path.abspath(manifest):
+        raise SystemExit(f"Checkpoint {path} belongs to another manifest: {data.get('manifest')}")
+    return int(data.get("records", 0))
+
+def save_checkpoint(path: Optional[str], manifest: str, records: int):
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"manifest": os.path.abspath(manifest), "records": records, "updated_at": time.time()}, f)
+    os.replace(tmp, path)
+
+class Importer:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.fmt = args.format or ("csv" if args.manifest.lower().endswith(".csv") else "ndjson")
+        self.done = load_checkpoint(args.checkpoint, args.manifest)
+        # (manifest position after the batch, Meilisearch task uid), oldest first
+        self.pending_tasks: Deque[Tuple[int, int]] = deque()
+        self.rows = 0
+        self.skipped = 0
+        self.indexed = 0
+        self.started = time.monotonic()
+
+    async def run(self):
+        if self.done:
+            logger.info(f"Resuming after {self.done} records")
+        position = self.done
+        batch: List[Tuple[Any, ...]] = []
+        for raw in iter_manifest(self.args.manifest, self.fmt, skip=self.done):
+            position += 1
+            record = to_record(raw) if raw is not None else None
+            if record is None:
+                self.skipped += 1
+                logger.warning(f"Skipping record {position}: malformed or missing file_id/file_unique_id")
+            else:
+                batch.append(record)
+            if len(batch) >= self.args.batch_size:
+                await self.flush(batch, position)
+                batch = []
+        await self.flush(batch, position)
+        await self.drain_tasks(0)
+        # Once every task has finished, so no old result is cached under the new generation
+        if meili_service.cache is not None:
+            await meili_service.cache.invalidate()
+        self.report(final=True)
+
+    async def flush(self, batch: List[Tuple[Any, ...]], position: int):
+        docs: List[Dict[str, Any]] = []
+        if batch:
+            books = await db_service.import_books(batch)
+            self.rows += len(batch)
+            docs = [build_meili_document(book) for book in books]
+        for i in range(0, len(docs), self.args.meili_batch_size):
+            task = await meili_service.add_documents(docs[i:i + self.args.meili_batch_size], invalidate=False)
+            self.pending_tasks.append((position, task["taskUid"]))
+            self.indexed += len(docs[i:i + self.args.meili_batch_size])
+        if not docs:
+            # Nothing to index: the position is durable once earlier tasks finish
+            self.pending_tasks.append((position, -1))
+        await self.drain_tasks(self.args.max_pending_tasks)
+        self.report()
+
+    async def drain_tasks(self, keep: int):
+        """Wait for the oldest tasks until at most ``keep`` remain, advancing the checkpoint."""
+        while len(self.pending_tasks) > keep:
+            position, task_uid = self.pending_tasks.popleft()
+            if task_uid >= 0:
+                task = await meili_service.wait_for_task(task_uid, timeout=self.args.task_timeout)
+                if task.get("status") != "succeeded":
+                    raise MeilisearchError(500, f"Indexing task {task_uid} {task.get('status')}: {task.get('error')}")
+            self.done = position
+            save_checkpoint(self.args.checkpoint, self.args.manifest, position)
+
+    def report(self, final: bool = False):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        logger.info(
+            f"{'Done' if final else 'Progress'}: {self.rows} rows, {self.indexed} docs sent, "
+            f"{self.skipped} skipped, checkpoint {self.done}, {self.rows / elapsed:.0f} rows/s"
+        )
+
+async def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk import books from an NDJSON/CSV manifest.")
+    parser.add_argument("manifest", help="Path to the .ndjson or .csv manifest")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="Manifest format (default: by extension)")
+    parser.add_argument("--checkpoint", help="Checkpoint file used to resume interrupted imports")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Records per COPY batch")
+    parser.add_argument("--meili-batch-size", type=int, default=10000, help="Documents per Meilisearch request")
+    parser.add_argument("--max-pending-tasks", type=int, default=4, help="Unfinished indexing tasks before waiting")
+    parser.add_argument("--task-timeout", type=float, default=600.0, help="Seconds to wait for one indexing task")
+    args = parser.parse_args(argv)
+
+    await db_service.connect()
+    await meili_service.init_index()
+    try:
+        await Importer(args).run()
+    finally:
+        await db_service.close()
+        await meili_service.close()
+        await redis_service.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
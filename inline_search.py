@@ -0,0 +1,141 @@
+"""
+Inline-mode search.
+
+``@bot <prefix>`` fires an inline query on nearly every keystroke. A query
+first waits ``debounce`` seconds and is dropped when the same user typed
+again meanwhile (a per-user sequence counter), so only the prefix the user
+paused on reaches Meilisearch, or even resolves its filters. Pages are
+cached per (normalized prefix, filters, offset) for a short TTL. A search
+slower than ``budget`` returns a page marked ``timed_out`` while it keeps
+running in the background to fill the cache for the next keystroke.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from cache import LRUCache
+from query_normalizer import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# (query, limit, offset, filter, plan_key) -> Meilisearch result
+SearchFunc = Callable[[str, int, int, Optional[str], Optional[str]], Awaitable[Dict[str, Any]]]
+# () -> (filter, plan_key) of the user's search
+PlanFunc = Callable[[], Awaitable[Tuple[Optional[str], Optional[str]]]]
+
+@dataclass(frozen=True)
+class InlinePage:
+    hits: List[Dict[str, Any]]
+    next_offset: str
+    timed_out: bool = False
+
+class InlineSearcher:
+    def __init__(
+        self,
+        search: SearchFunc,
+        page_size: int = 20,
+        debounce: float = 0.3,
+        budget: float = 8.0,
+        cache_ttl: float = 60.0,
+        max_pages: int = 10000,
+        max_results: int = 1000,
+    ):
+        self.search = search
+        self.page_size = page_size
+        self.debounce = debounce
+        self.budget = budget
+        # Meilisearch stops counting at maxTotalHits, so paging stops there too
+        self.max_results = max_results
+        self.pages = LRUCache(max_pages, ttl=cache_ttl)
+        self._seq: Dict[int, int] = {}
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self.queries = 0
+        self.debounced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.searches = 0
+        self.total_latency = 0.0
+
+    @staticmethod
+    def parse_offset(offset: str) -> int:
+        return int(offset) if offset and offset.isdigit() else 0
+
+    async def query(
+        self,
+        user_id: int,
+        text: str,
+        offset: str = "",
+        plan: Optional[PlanFunc] = None,
+    ) -> Optional[InlinePage]:
+        """
+        Return a page of hits, an empty ``timed_out`` page when the budget
+        runs out, or None when a newer keystroke from the same user
+        superseded this one. ``plan`` is only awaited for queries that
+        survive the debounce.
+        """
+        self.queries += 1
+        start = self.parse_offset(offset)
+        text = normalize_query(text) or text.strip()
+
+        # Only the first page is typed; "load more" requests are never superseded
+        if start == 0 and self.debounce > 0:
+            seq = self._seq.get(user_id, 0) + 1
+            self._seq[user_id] = seq
+            await asyncio.sleep(self.debounce)
+            if self._seq.get(user_id) != seq:
+                self.debounced += 1
+                return None
+            del self._seq[user_id]
+
+        filter, plan_key = await plan() if plan is not None else (None, None)
+        key = (text, plan_key or filter, start)
+        page = self.pages.get(key)
+        if page is not None:
+            return page
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, text, start, filter, plan_key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        try:
+            # Shielded: a slow search keeps going and fills the cache
+            return await asyncio.wait_for(asyncio.shield(task), self.budget)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return InlinePage([], "", timed_out=True)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Inline search failed for {text!r}: {e}")
+            return InlinePage([], "")
+
+    def _done(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch(self, key: tuple, text: str, start: int, filter: Optional[str], plan_key: Optional[str]) -> InlinePage:
+        started = time.monotonic()
+        result = await self.search(text, self.page_size, start, filter, plan_key)
+        self.searches += 1
+        self.total_latency += time.monotonic() - started
+        hits = result.get("hits", [])
+        end = start + len(hits)
+        total = min(result.get("estimatedTotalHits", 0), self.max_results)
+        page = InlinePage(hits, str(end) if hits and end < total else "")
+        self.pages.set(key, page)
+        return page
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queries": self.queries,
+            "debounced": self.debounced,
+            "searches": self.searches,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "page_cache": self.pages.stats(),
+            "avg_search_ms": round(self.total_latency / self.searches * 1000, 1) if self.searches else 0.0,
+        }
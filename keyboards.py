@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
@@ -78,6 +80,63 @@ def _build_page_picker_rows(current_page: int, total_pages: int) -> tuple[list[i
     nav.append(InlineKeyboardButton(text="❌", callback_data="close"))
     return layout, page_buttons + nav
 
+def _freeze_filters(filters: dict | None) -> tuple:
+    return tuple(sorted((filters or {}).items()))
+
+def _rows(items: list[InlineKeyboardButton], sizes: list[int]) -> list[list[InlineKeyboardButton]]:
+    """Split ``items`` into rows of ``sizes``; the last size repeats for any overflow."""
+    rows: list[list[InlineKeyboardButton]] = []
+    start = 0
+    for size in sizes:
+        if start >= len(items):
+            return rows
+        rows.append(items[start:start + size])
+        start += size
+    while start < len(items):
+        rows.append(items[start:start + sizes[-1]])
+        start += sizes[-1]
+    return rows
+
+# Keyboards below are memoized and shared between renders: treat the
+# returned markups and buttons as read-only.
+
+@lru_cache(maxsize=1024)
+def _page_picker_keyboard(current_page: int, total_pages: int) -> InlineKeyboardMarkup:
+    layout, items = _build_page_picker_rows(current_page, total_pages)
+    return InlineKeyboardMarkup(inline_keyboard=_rows(items, [*layout, 5]))
+
+@lru_cache(maxsize=4096)
+def _search_header_rows(current_page: int, total_pages: int, sort: str, filters: tuple) -> tuple:
+    rows = []
+    if total_pages > 1:
+        rows.append(tuple(_build_page_quick_row(current_page, total_pages)))
+    filter_dict = dict(filters)
+    rows.append(tuple(
+        InlineKeyboardButton(text=_filter_button_text(filter_dict, key, label), callback_data=f"fltmenu:{key}")
+        for label, key in [("分级", "rating"), ("格式", "format"), ("体积", "size"), ("字数", "words")]
+    ))
+    rows.append(tuple(
+        InlineKeyboardButton(text=_sort_button_text(sort, key, label), callback_data=f"sort:{key}")
+        for key, label in [("best", "最佳"), ("hot", "最热"), ("new", "最新"), ("big", "最大")]
+    ))
+    return tuple(rows)
+
+@lru_cache(maxsize=1024)
+def _search_nav_row(current_page: int, total_pages: int) -> tuple:
+    nav = []
+    if current_page > 0:
+        nav.append(InlineKeyboardButton(text="<", callback_data=f"page:{current_page - 1}"))
+    else:
+        nav.append(InlineKeyboardButton(text="·", callback_data="noop"))
+    nav.append(InlineKeyboardButton(text=f"{current_page + 1}/{total_pages}", callback_data="noop"))
+    if current_page < total_pages - 1:
+        nav.append(InlineKeyboardButton(text=">", callback_data=f"page:{current_page + 1}"))
+    else:
+        nav.append(InlineKeyboardButton(text="·", callback_data="noop"))
+    nav.append(InlineKeyboardButton(text="⚙️", callback_data="settings"))
+    nav.append(InlineKeyboardButton(text="❌", callback_data="close"))
+    return tuple(nav)
+
 def get_search_keyboard(
     current_page: int,
     total_pages: int,
@@ -86,101 +145,63 @@ def get_search_keyboard(
     sort: str = "best",
     filters: dict | None = None,
 ) -> InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-
     if mode == "page_picker":
-        layout, items = _build_page_picker_rows(current_page, total_pages)
-        for b in items:
-            builder.add(b)
-        builder.adjust(*layout, 5)
-        return builder.as_markup()
+        return _page_picker_keyboard(current_page, total_pages)
 
-    sizes: list[int] = []
+    # Only the book selection buttons differ between renders of the same state
+    books = [InlineKeyboardButton(text=str(i + 1), callback_data=f"sel:{book_id}") for i, book_id in enumerate(book_ids)]
+    rows = [list(row) for row in _search_header_rows(current_page, total_pages, sort, _freeze_filters(filters))]
+    rows.extend(_rows(books, [3, 4, 3, 3]))
+    rows.append(list(_search_nav_row(current_page, total_pages)))
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
-    if total_pages > 1:
-        quick = _build_page_quick_row(current_page, total_pages)
-        for b in quick:
-            builder.add(b)
-        sizes.append(len(quick))
-
-    for label, key in [("分级", "rating"), ("格式", "format"), ("体积", "size"), ("字数", "words")]:
-        builder.button(text=_filter_button_text(filters or {}, key, label), callback_data=f"fltmenu:{key}")
-    sizes.append(4)
-
-    builder.button(text=_sort_button_text(sort, "best", "最佳"), callback_data="sort:best")
-    builder.button(text=_sort_button_text(sort, "hot", "最热"), callback_data="sort:hot")
-    builder.button(text=_sort_button_text(sort, "new", "最新"), callback_data="sort:new")
-    builder.button(text=_sort_button_text(sort, "big", "最大"), callback_data="sort:big")
-    sizes.append(4)
-
-    for i, book_id in enumerate(book_ids):
-        builder.button(text=str(i + 1), callback_data=f"sel:{book_id}")
-
-    num_books = len(book_ids)
-    layout = []
-    if num_books > 0:
-        count = min(num_books, 3)
-        layout.append(count)
-        num_books -= count
-    if num_books > 0:
-        count = min(num_books, 4)
-        layout.append(count)
-        num_books -= count
-    if num_books > 0:
-        count = min(num_books, 3)
-        layout.append(count)
-        num_books -= count
-
-    if current_page > 0:
-        builder.button(text="<", callback_data=f"page:{current_page - 1}")
-    else:
-        builder.button(text="·", callback_data="noop")
-    builder.button(text=f"{current_page + 1}/{total_pages}", callback_data="noop")
-    if current_page < total_pages - 1:
-        builder.button(text=">", callback_data=f"page:{current_page + 1}")
-    else:
-        builder.button(text="·", callback_data="noop")
-    builder.button(text="⚙️", callback_data="settings")
-    builder.button(text="❌", callback_data="close")
-    layout.append(5)
+def get_filter_menu_keyboard(
+    filter_key: str, selected: dict | None = None, counts: dict | None = None
+) -> InlineKeyboardMarkup:
+    """``counts`` maps option values to result counts; shown next to each option when given."""
+    selected = selected or {}
+    menu_key = filter_key if filter_key in ("format", "size", "words") else "rating"
+    frozen_counts = tuple(sorted((str(k), v) for k, v in counts.items() if isinstance(v, int))) if counts else None
+    return _filter_menu_keyboard(filter_key, selected.get(menu_key), frozen_counts)
 
-    builder.adjust(*sizes, *layout)
-    return builder.as_markup()
+def _option_label(text: str, value: str, current: str | None, counts: dict | None) -> str:
+    if counts is not None:
+        n = counts.get(value, 0)
+        # Meilisearch stops counting at maxTotalHits
+        text = f"{text}({'999+' if n > 999 else n})"
+    if current == value:
+        text = f"·{text}·"
+    return text
 
-def get_filter_menu_keyboard(filter_key: str, selected: dict | None = None) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=256)
+def _filter_menu_keyboard(
+    filter_key: str, current: str | None, counts: tuple[tuple[str, int], ...] | None = None
+) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    selected = selected or {}
     sizes: list[int] = []
+    option_counts = dict(counts) if counts is not None else None
 
     if filter_key == "format":
         options = ["ALL", "PDF", "EPUB", "TXT", "MOBI", "AZW3"]
         labels = {"ALL": "全部"}
         for v in options:
-            text = labels.get(v, v)
-            if selected.get("format") == v:
-                text = f"·{text}·"
+            text = _option_label(labels.get(v, v), v, current, option_counts)
             builder.button(text=text, callback_data=f"flt:format:{v}")
         sizes.extend([3, 3])
     elif filter_key == "size":
         options = [("ALL", "全部"), ("<5MB", "<5MB"), ("5-20MB", "5-20MB"), ("20-50MB", "20-50MB"), (">50MB", ">50MB")]
         for v, text in options:
-            if selected.get("size") == v:
-                text = f"·{text}·"
-            builder.button(text=text, callback_data=f"flt:size:{v}")
+            builder.button(text=_option_label(text, v, current, option_counts), callback_data=f"flt:size:{v}")
         sizes.extend([3, 2])
     elif filter_key == "words":
         options = [("ALL", "全部"), ("<10万", "<10万"), ("10-50万", "10-50万"), ("50-100万", "50-100万"), (">100万", ">100万")]
         for v, text in options:
-            if selected.get("words") == v:
-                text = f"·{text}·"
-            builder.button(text=text, callback_data=f"flt:words:{v}")
+            builder.button(text=_option_label(text, v, current, option_counts), callback_data=f"flt:words:{v}")
         sizes.extend([3, 2])
     else:
         options = [("ALL", "全部"), ("G", "全年龄"), ("R15", "R15"), ("R18", "R18")]
         for v, text in options:
-            if selected.get("rating") == v:
-                text = f"·{text}·"
-            builder.button(text=text, callback_data=f"flt:rating:{v}")
+            builder.button(text=_option_label(text, v, current, option_counts), callback_data=f"flt:rating:{v}")
         sizes.extend([2, 2])
 
     builder.button(text="清除", callback_data=f"fltclr:{filter_key}")
@@ -193,18 +214,16 @@ def get_filter_menu_keyboard(filter_key: str, selected: dict | None = None) -> I
     return builder.as_markup()
 
 def get_book_detail_keyboard(book_id: int) -> InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-    
-    # Row 1: Download (Full width or main)
-    # Using book_id to avoid length limit
-    builder.button(text="⬇️ 免费下载", callback_data=f"dl:{book_id}")
-    
-    # Row 2: Collections, Related
-    builder.button(text="❤️ 收藏", callback_data=f"fav:{book_id}")
-    builder.button(text="🔗 相关书籍", callback_data=f"rel:{book_id}")
-    
-    builder.adjust(1, 2)
-    return builder.as_markup()
+    return InlineKeyboardMarkup(inline_keyboard=[
+        # Row 1: Download (Full width or main)
+        # Using book_id to avoid length limit
+        [InlineKeyboardButton(text="⬇️ 免费下载", callback_data=f"dl:{book_id}")],
+        # Row 2: Collections, Related
+        [
+            InlineKeyboardButton(text="❤️ 收藏", callback_data=f"fav:{book_id}"),
+            InlineKeyboardButton(text="🔗 相关书籍", callback_data=f"rel:{book_id}"),
+        ],
+    ])
 
 def get_moderation_keyboard(short_id: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
@@ -212,7 +231,32 @@ def get_moderation_keyboard(short_id: str) -> InlineKeyboardMarkup:
     builder.button(text="❌ 拒绝", callback_data=f"mod_reject:{short_id}")
     return builder.as_markup()
 
-def get_settings_keyboard(settings: dict) -> InlineKeyboardMarkup:
+def get_batch_moderation_keyboard(batch_id: str, short_ids: list[str]) -> InlineKeyboardMarkup:
+    rows = [[
+        InlineKeyboardButton(text="✅ 全部通过", callback_data=f"mod_all:a:{batch_id}"),
+        InlineKeyboardButton(text="❌ 全部拒绝", callback_data=f"mod_all:r:{batch_id}"),
+    ]]
+    for i, short_id in enumerate(short_ids, 1):
+        rows.append([
+            InlineKeyboardButton(text=f"✅ {i}", callback_data=f"mod_item:a:{short_id}"),
+            InlineKeyboardButton(text=f"❌ {i}", callback_data=f"mod_item:r:{short_id}"),
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def drop_moderation_item(markup: InlineKeyboardMarkup | None, short_id: str) -> InlineKeyboardMarkup | None:
+    """Remove a handled item's row; None once only the batch row is left."""
+    if markup is None:
+        return None
+    suffix = f":{short_id}"
+    rows = [
+        row for row in markup.inline_keyboard
+        if not any((b.callback_data or "").startswith("mod_item:") and (b.callback_data or "").endswith(suffix) for b in row)
+    ]
+    if not any((b.callback_data or "").startswith("mod_item:") for row in rows for b in row):
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def _build_settings_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="设置内容分级", callback_data="setmenu:content_rating")
     builder.button(text="搜索按钮模式", callback_data="setmenu:search_button_mode")
@@ -234,13 +278,23 @@ def get_settings_keyboard(settings: dict) -> InlineKeyboardMarkup:
     builder.adjust(2, 2, 2, 2, 1, 2)
     return builder.as_markup()
 
+# The settings keyboard does not depend on the settings themselves
+_SETTINGS_KEYBOARD = _build_settings_keyboard()
+
+def get_settings_keyboard(settings: dict) -> InlineKeyboardMarkup:
+    return _SETTINGS_KEYBOARD
+
 def get_settings_menu_keyboard(menu_key: str, settings: dict) -> InlineKeyboardMarkup:
+    defaults = {"content_rating": "ALL", "search_button_mode": "preview"}
+    return _settings_menu_keyboard(menu_key, settings.get(menu_key, defaults.get(menu_key)))
+
+@lru_cache(maxsize=64)
+def _settings_menu_keyboard(menu_key: str, current: str | None) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     sizes: list[int] = []
 
     if menu_key == "content_rating":
         options = [("ALL", "全部"), ("G", "全年龄"), ("R15", "R15"), ("R18", "R18")]
-        current = settings.get("content_rating", "ALL")
         for v, text in options:
             if v == current:
                 text = f"·{text}·"
@@ -248,7 +302,6 @@ def get_settings_menu_keyboard(menu_key: str, settings: dict) -> InlineKeyboardM
         sizes.extend([2, 2])
     elif menu_key == "search_button_mode":
         options = [("preview", "预览模式"), ("download", "极速下载")]
-        current = settings.get("search_button_mode", "preview")
         for v, text in options:
             if v == current:
                 text = f"·{text}·"
@@ -0,0 +1,181 @@
+"""
+Search query normalization.
+
+Queries are normalized before they reach Meilisearch and the search caches
+so that trivially different spellings share one cache entry: NFKC folds
+full-width forms, book title marks (《》 etc.) and trailing file
+extensions are dropped, traditional characters are mapped to simplified
+ones, case is folded and whitespace collapsed.
+
+Traditional to simplified conversion uses OpenCC when the optional
+``opencc`` package is installed, otherwise a built-in table of common
+characters.
+
+The deduplication gained on a query log (one query per line, or NDJSON
+with a ``query`` field) can be measured with:
+
+    python query_normalizer.py queries.log --top 20
+"""
+import argparse
+import json
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+# Traditional -> simplified pairs for common characters, used without OpenCC.
+# Only unambiguous one-way mappings; characters that are also in use as
+# simplified characters (乾, 著, 瞭 ...) are left alone.
+_T2S_PAIRS = """
+萬万 與与 專专 業业 叢丛 東东 絲丝 兩两 嚴严 喪丧 個个 豐丰 臨临 為为 麗丽 舉举 義义 烏乌 樂乐 喬乔
+習习 鄉乡 書书 買买 亂乱 爭争 於于 虧亏 雲云 亞亚 產产 畝亩 親亲 億亿 僅仅 從从 侖仑 倉仓 儀仪 們们
+價价 眾众 優优 夥伙 會会 傘伞 偉伟 傳传 傷伤 倫伦 偽伪 體体 餘余 傭佣 俠侠 侶侣 僥侥 偵侦 側侧 僑侨
+儈侩 儂侬 係系 俔伣 倆俩 儉俭 債债 傾倾 僂偻 僕仆 僱雇 儲储 兒儿 兌兑 黨党 蘭兰 關关 興兴 養养 獸兽
+內内 岡冈 冊册 寫写 軍军 農农 馮冯 衝冲 決决 況况 凍冻 淨净 涼凉 減减 湊凑 凜凛 幾几 鳳凤 憑凭 凱凯
+擊击 鑿凿 芻刍 劃划 劉刘 則则 剛刚 創创 刪删 別别 剗刬 劑剂 剮剐 劍剑 劇剧 勸劝 辦办 務务 動动 勵励
+勁劲 勞劳 勢势 勳勋 勻匀 匯汇 區区 醫医 華华 協协 單单 賣卖 盧卢 衛卫 卻却 廠厂 廳厅 曆历 歷历 厲厉
+壓压 厭厌 縣县 參参 雙双 發发 變变 敘叙 臺台 葉叶 號号 嘆叹 嘰叽 嚇吓 呂吕 嗎吗 噸吨 聽听 啟启 吳吴
+嘔呕 員员 嗚呜 詠咏 響响 啞哑 嘩哗 喲哟 嗆呛 囑嘱 團团 園园 圍围 圖图 國国 圓圆 聖圣 場场 壞坏 塊块
+堅坚 壇坛 壩坝 墳坟 墜坠 壘垒 壟垄 執执 塗涂 報报 處处 備备 復复 夠够 頭头 夾夹 奪夺 奮奋 獎奖 奧奥
+婦妇 媽妈 嫵妩 姍姗 婁娄 婭娅 嬌娇 孫孙 學学 寧宁 寶宝 實实 寵宠 審审 憲宪 宮宫 寬宽 賓宾 寢寝 對对
+尋寻 導导 將将 爾尔 塵尘 嘗尝 堯尧 層层 屬属 屢屡 歲岁 豈岂 島岛 嶺岭 巒峦 崗岗 嶼屿 峽峡 幣币 帥帅
+師师 帳帐 帶带 幫帮 幹干 廣广 莊庄 慶庆 廬庐 庫库 應应 廟庙 龐庞 廢废 開开 異异 棄弃 張张 彌弥 彎弯
+彈弹 強强 歸归 當当 錄录 彥彦 徹彻 徑径 徠徕 憶忆 懷怀 態态 慫怂 憐怜 總总 戀恋 懇恳 惡恶 惱恼 悅悦
+懸悬 驚惊 懼惧 慘惨 懶懒 願愿 懲惩 戲戏 戰战 戶户 紮扎 撲扑 擴扩 掃扫 揚扬 擾扰 撫抚 搶抢 護护 擔担
+擬拟 攏拢 揀拣 擁拥 攔拦 擰拧 撥拨 擇择 掛挂 攬揽 擠挤 揮挥 損损 撿捡 換换 搗捣 據据 擄掳 攜携 搖摇
+攝摄 敵敌 數数 齋斋 斬斩 斷断 無无 舊旧 時时 曠旷 曇昙 晝昼 顯显 晉晋 曬晒 曉晓 暫暂 曖暧 術术 樸朴
+機机 殺杀 雜杂 權权 條条 來来 楊杨 極极 構构 樅枞 樞枢 棗枣 櫃柜 檸柠 標标 棧栈 欄栏 樹树 樣样 橋桥
+檢检 樓楼 槍枪 歡欢 歐欧 殘残 殼壳 毀毁 氣气 漢汉 湯汤 溝沟 滄沧 滬沪 淚泪 潑泼 澤泽 潔洁 灑洒 濃浓
+濤涛 澇涝 潤润 漲涨 澀涩 淵渊 漁渔 漸渐 溫温 滅灭 燈灯 靈灵 災灾 爐炉 點点 煉炼 爛烂 煩烦 燒烧 熱热
+愛爱 爺爷 牆墙 狀状 猶犹 獨独 獵猎 貓猫 獻献 環环 現现 瑪玛 瓊琼 璽玺 甌瓯 電电 畫画 暢畅 療疗 瘧疟
+癥症 癢痒 瘋疯 盞盏 監监 盤盘 睜睁 礦矿 碼码 磚砖 確确 碩硕 禮礼 禍祸 禪禅 離离 種种 積积 稱称 穩稳
+窮穷 竊窃 竅窍 競竞 筆笔 筍笋 節节 範范 築筑 簡简 簽签 籃篮 類类 糧粮 糾纠 紅红 紀纪 約约 級级 紙纸
+紋纹 納纳 純纯 紛纷 細细 終终 組组 經经 結结 給给 絕绝 統统 綜综 綠绿 維维 網网 緊紧 線线 練练 編编
+緣缘 縮缩 績绩 織织 繞绕 繪绘 繼继 續续 纜缆 罰罚 羅罗 罷罢 聞闻 聯联 聲声 職职 聰聪 肅肃 腸肠 膚肤
+腦脑 臉脸 膽胆 艦舰 艱艰 藝艺 蘇苏 蘋苹 莖茎 薦荐 藥药 萊莱 蓮莲 獲获 營营 蕭萧 薩萨 藍蓝 蘆芦 虛虚
+蟲虫 蝦虾 螞蚂 蠟蜡 蠻蛮 補补 襯衬 裝装 見见 觀观 規规 視视 覽览 覺觉 觸触 計计 訂订 認认 討讨 讓让
+訓训 議议 記记 講讲 許许 論论 設设 訪访 證证 評评 識识 詞词 試试 詩诗 話话 誠诚 該该 詳详 語语 誤误
+說说 請请 諸诸 讀读 課课 誰谁 調调 談谈 謝谢 謎谜 謠谣 謹谨 譜谱 讚赞 貝贝 負负 財财 貢贡 貨货 質质
+販贩 貪贪 責责 貴贵 貸贷 費费 貿贸 資资 賊贼 賞赏 賜赐 賢贤 賴赖 購购 賽赛 贈赠 贏赢 趕赶 趙赵 躍跃
+蹤踪 車车 軌轨 轉转 輪轮 軟软 輕轻 載载 較较 輔辅 輩辈 輸输 轟轰 辭辞 邊边 遼辽 達达 遷迁 過过 邁迈
+運运 還还 這这 進进 遠远 違违 連连 遲迟 適适 選选 遺遗 鄧邓 鄭郑 鄰邻 醜丑 釋释 裡里 裏里 鑒鉴 針针
+釣钓 鈔钞 鈴铃 鉛铅 銀银 銅铜 鋼钢 錢钱 錯错 鍵键 鎖锁 鏡镜 鐘钟 鍾钟 鐵铁 鑰钥 長长 門门 閃闪 閉闭
+問问 閒闲 間间 閱阅 闊阔 隊队 陽阳 陰阴 陣阵 階阶 際际 陸陆 陳陈 險险 隨随 隱隐 難难 雞鸡 雖虽 霧雾
+靜静 韓韩 頁页 頂顶 項项 順顺 須须 預预 領领 頻频 題题 額额 顏颜 顧顾 風风 飛飞 飯饭 飲饮 館馆 餓饿
+馬马 駕驾 騎骑 驗验 驅驱 髮发 鬥斗 鬧闹 魚鱼 鮮鲜 鳥鸟 鳴鸣 鴨鸭 鵝鹅 鷹鹰 麥麦 黃黄 齊齐 齒齿 龍龙
+龜龟 麼么 後后 灣湾 緒绪 傑杰 遙遥 譯译 詭诡 謀谋 獄狱 屍尸 殭僵
+"""
+
+def _build_table(pairs: str) -> Dict[int, str]:
+    table: Dict[int, str] = {}
+    for pair in pairs.split():
+        if pair[0] != pair[1]:
+            table[ord(pair[0])] = pair[1]
+    return table
+
+_T2S_TABLE = _build_table(_T2S_PAIRS)
+
+def _load_opencc() -> Optional[Callable[[str], str]]:
+    try:
+        import opencc
+    except ImportError:
+        return None
+    # The official bindings want "t2s.json", the pure-Python port "t2s"
+    for profile in ("t2s", "t2s.json"):
+        try:
+            return opencc.OpenCC(profile).convert
+        except Exception:
+            continue
+    return None
+
+_opencc_convert = _load_opencc()
+
+def to_simplified(text: str) -> str:
+    if _opencc_convert is not None:
+        return _opencc_convert(text)
+    return text.translate(_T2S_TABLE)
+
+_TITLE_MARKS_RE = re.compile(r"[《》〈〉「」『』【】]")
+_EXTENSION_RE = re.compile(r"\.(?:pdf|epub|txt|mobi|azw3?|docx?|rtf|fb2|djvu|zip|rar|7z)(?=\s|$)", re.IGNORECASE)
+
+@lru_cache(maxsize=8192)
+def normalize_query(text: str) -> str:
+    """Canonical form of a search query; may be empty for queries like ".pdf"."""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _TITLE_MARKS_RE.sub(" ", text)
+    text = _EXTENSION_RE.sub(" ", text)
+    text = to_simplified(text).casefold()
+    return " ".join(text.split())
+
+def normalizer_stats() -> Dict[str, int]:
+    info = normalize_query.cache_info()
+    return {"size": info.currsize, "hits": info.hits, "misses": info.misses}
+
+def _basic_key(text: str) -> str:
+    # What the search caches keyed on before this module
+    return " ".join((text or "").split()).casefold()
+
+def iter_query_log(lines: Iterable[str]) -> Iterator[str]:
+    """Yield queries from plain lines or NDJSON records with a ``query`` field."""
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        if line.lstrip().startswith("{"):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                pass
+            else:
+                if isinstance(record, dict) and isinstance(record.get("query"), str):
+                    yield record["query"]
+                continue
+        yield line
+
+def measure_dedup(queries: Iterable[str]) -> Dict[str, object]:
+    """Count distinct cache keys before and after normalization."""
+    total = 0
+    raw: Set[str] = set()
+    basic: Set[str] = set()
+    groups: Dict[str, Counter] = defaultdict(Counter)
+    for query in queries:
+        total += 1
+        raw.add(query)
+        basic.add(_basic_key(query))
+        groups[normalize_query(query)][query] += 1
+    merged = sorted(
+        ((key, variants) for key, variants in groups.items() if len(variants) > 1),
+        key=lambda item: (-sum(item[1].values()), item[0]),
+    )
+    return {
+        "queries": total,
+        "distinct_raw": len(raw),
+        "distinct_basic": len(basic),
+        "distinct_normalized": len(groups),
+        # Share of distinct raw queries folded into another one
+        "dedup_ratio": round(1 - len(groups) / len(raw), 4) if raw else 0.0,
+        "dedup_ratio_vs_basic": round(1 - len(groups) / len(basic), 4) if basic else 0.0,
+        "merged": merged,
+    }
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure how much query normalization deduplicates a query log.")
+    parser.add_argument("log", help="Query log: one query per line, or NDJSON with a 'query' field")
+    parser.add_argument("--top", type=int, default=10, help="Show the N largest merged groups")
+    args = parser.parse_args(argv)
+
+    with open(args.log, "r", encoding="utf-8") as f:
+        result = measure_dedup(iter_query_log(f))
+    print(f"T2S backend:          {'opencc' if _opencc_convert is not None else 'built-in table'}")
+    print(f"Queries:              {result['queries']}")
+    print(f"Distinct raw:         {result['distinct_raw']}")
+    print(f"Distinct (old keys):  {result['distinct_basic']}")
+    print(f"Distinct normalized:  {result['distinct_normalized']}")
+    print(f"Dedup ratio:          {result['dedup_ratio']:.2%} (vs old keys {result['dedup_ratio_vs_basic']:.2%})")
+    for key, variants in result["merged"][: args.top]:
+        shown = ", ".join(f"{v!r}×{n}" for v, n in variants.most_common(5))
+        print(f"  {key!r} <- {shown}")
+
+if __name__ == "__main__":
+    main()
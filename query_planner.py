@@ -0,0 +1,210 @@
+"""
+Search query planning.
+
+Compiles the UI state of a search (tag mode, filter menu selections and
+sort) into Meilisearch ``filter`` and ``sort`` parameters. Selections are
+normalized first: unknown values and "ALL" are dropped and keys are put
+in a fixed order. String values are escaped, and compiled plans are
+memoized. ``SearchPlan.key`` is canonical: equivalent states share a key,
+which the search result cache uses.
+
+``plan_facets`` plans the option counts in the filter menus. Every menu
+maps to one facet attribute (size and word ranges are precomputed into
+``size_bucket``/``words_bucket`` at indexing time), so counts come from
+the main query's ``facetDistribution``; only a menu with a selection
+needs an extra query, sent in the same multi-search request as the hits.
+"""
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+RATING_LEVELS = {"G": 0, "R15": 1, "R18": 2}
+
+SIZE_RANGES = {
+    "<5MB": (None, 5 * 1024 * 1024),
+    "5-20MB": (5 * 1024 * 1024, 20 * 1024 * 1024),
+    "20-50MB": (20 * 1024 * 1024, 50 * 1024 * 1024),
+    ">50MB": (50 * 1024 * 1024, None),
+}
+
+WORD_RANGES = {
+    "<10万": (None, 100000),
+    "10-50万": (100000, 500000),
+    "50-100万": (500000, 1000000),
+    ">100万": (1000000, None),
+}
+
+SORTS = {
+    "best": None,
+    "hot": ("downloads:desc",),
+    "new": ("created_at:desc",),
+    "big": ("file_size:desc",),
+}
+
+FILTER_KEYS = ("format", "rating", "size", "words")
+
+@dataclass(frozen=True)
+class SearchPlan:
+    filter: Optional[str]
+    sort: Optional[Tuple[str, ...]]
+    key: str
+
+    @property
+    def sort_list(self) -> Optional[List[str]]:
+        return list(self.sort) if self.sort else None
+
+def quote_filter_value(value: str) -> str:
+    """Quote a string for a Meilisearch filter expression."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Tuple[Tuple[str, str], ...]:
+    """Keep only effective selections, in a fixed key order."""
+    filters = filters or {}
+    result = []
+    for key in FILTER_KEYS:
+        value = filters.get(key)
+        if not isinstance(value, str) or not value or value == "ALL":
+            continue
+        if key == "rating" and value not in RATING_LEVELS:
+            continue
+        if key == "size" and value not in SIZE_RANGES:
+            continue
+        if key == "words" and value not in WORD_RANGES:
+            continue
+        result.append((key, value))
+    return tuple(result)
+
+def _range_parts(attribute: str, bounds: Tuple[Optional[int], Optional[int]]) -> List[str]:
+    lo, hi = bounds
+    parts = []
+    if lo is not None:
+        parts.append(f"{attribute} >= {lo}")
+    if hi is not None:
+        parts.append(f"{attribute} < {hi}")
+    return parts
+
+def _filter_parts(tag: Optional[str], filters: Tuple[Tuple[str, str], ...]) -> List[str]:
+    parts: List[str] = []
+    if tag is not None:
+        parts.append(f"tags = {quote_filter_value(tag)}")
+    for key, value in filters:
+        if key == "format":
+            parts.append(f"ext = {quote_filter_value(value)}")
+        elif key == "rating":
+            parts.append(f"content_rating <= {RATING_LEVELS[value]}")
+        elif key == "size":
+            parts.extend(_range_parts("file_size", SIZE_RANGES[value]))
+        elif key == "words":
+            parts.extend(_range_parts("word_count", WORD_RANGES[value]))
+    return parts
+
+@lru_cache(maxsize=4096)
+def _compile(tag: Optional[str], filters: Tuple[Tuple[str, str], ...], sort: str) -> SearchPlan:
+    key = json.dumps([tag, filters, sort], ensure_ascii=False, separators=(",", ":"))
+    return SearchPlan(" AND ".join(_filter_parts(tag, filters)) or None, SORTS[sort], key)
+
+def plan_search(
+    query: str,
+    filter_type: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    sort: str = "best",
+) -> SearchPlan:
+    """Compile a search's UI state into Meilisearch parameters."""
+    tag = (query or "").strip() if filter_type == "tags" else None
+    return _compile(tag, normalize_filters(filters), sort if sort in SORTS else "best")
+
+def bucket_of(value: Optional[int], ranges: Dict[str, Tuple[Optional[int], Optional[int]]]) -> str:
+    """Name of the range option ``value`` falls into."""
+    value = value or 0
+    for option, (lo, hi) in ranges.items():
+        if (lo is None or value >= lo) and (hi is None or value < hi):
+            return option
+    return next(reversed(ranges))
+
+# Filter menus, the facet attribute counted for each, and range options
+FACETS = (
+    ("format", "ext", None),
+    ("rating", "content_rating", None),
+    ("size", "size_bucket", SIZE_RANGES),
+    ("words", "words_bucket", WORD_RANGES),
+)
+
+@dataclass(frozen=True)
+class FacetQuery:
+    facet: str
+    filter: Optional[str]
+    attributes: Tuple[str, ...] = ()
+
+@dataclass(frozen=True)
+class FacetPlan:
+    """
+    Facet attributes for the main query, plus one extra (limit 0) query
+    per menu with a selection.
+
+    Each menu's counts ignore that menu's own selection, so a user sees
+    what switching to another option would return.
+    """
+    main_attributes: Tuple[str, ...]
+    queries: Tuple[FacetQuery, ...]
+    key: str
+
+@lru_cache(maxsize=1024)
+def _compile_facets(tag: Optional[str], filters: Tuple[Tuple[str, str], ...]) -> FacetPlan:
+    selected = dict(filters)
+    main_attributes: List[str] = []
+    queries: List[FacetQuery] = []
+    for name, attribute, _ in FACETS:
+        if name in selected:
+            others = tuple(item for item in filters if item[0] != name)
+            queries.append(FacetQuery(name, " AND ".join(_filter_parts(tag, others)) or None, (attribute,)))
+        else:
+            main_attributes.append(attribute)
+    key = json.dumps(["facets", tag, filters], ensure_ascii=False, separators=(",", ":"))
+    return FacetPlan(tuple(main_attributes), tuple(queries), key)
+
+def plan_facets(
+    query: str,
+    filter_type: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> FacetPlan:
+    """Plan the filter menu counts for a search; sort does not affect them."""
+    tag = (query or "").strip() if filter_type == "tags" else None
+    return _compile_facets(tag, normalize_filters(filters))
+
+def _distribution_counts(
+    name: str, distribution: Dict[str, int], total: int, ranges: Optional[Dict[str, Any]] = None
+) -> Dict[str, int]:
+    counts = {"ALL": total}
+    if name == "rating":
+        # content_rating <= level: each option includes the milder ones
+        running = 0
+        for option, level in sorted(RATING_LEVELS.items(), key=lambda item: item[1]):
+            running += distribution.get(str(level), 0)
+            counts[option] = running
+    elif ranges is not None:
+        counts.update({option: distribution.get(option, 0) for option in ranges})
+    else:
+        counts.update({str(value).upper(): n for value, n in distribution.items()})
+    return counts
+
+def collect_facets(plan: FacetPlan, main: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+    """Turn the main result and the facet query results into per-menu option counts."""
+    sources = {query.facet: result for query, result in zip(plan.queries, results)}
+    counts: Dict[str, Dict[str, int]] = {}
+    for name, attribute, ranges in FACETS:
+        result = sources.get(name, main)
+        distribution = (result.get("facetDistribution") or {}).get(attribute) or {}
+        counts[name] = _distribution_counts(name, distribution, result.get("estimatedTotalHits", 0), ranges)
+    return counts
+
+def plan_cache_stats() -> Dict[str, Any]:
+    info = _compile.cache_info()
+    total = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": round(info.hits / total, 4) if total else 0.0,
+    }
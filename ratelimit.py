@@ -0,0 +1,214 @@
+"""
+Outbound Telegram rate limiting.
+
+A request middleware on ``bot.session`` throttles every API call with token
+buckets: one global bucket (~30 msg/s) and one per chat (about 1 msg/s in
+private chats, 20/min in groups). Callers waiting on the global bucket are
+served by priority, so interactive replies overtake notifications sent
+under ``low_priority()``. Flood-wait (429) responses block the affected
+chat (or, for calls without a chat, that method) for ``retry_after``
+seconds and the call is retried.
+
+Limits are per process; with several worker processes lower
+OUTBOUND_GLOBAL_RATE accordingly.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, AnswerInlineQuery, GetUpdates, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+NOTIFICATION = 1
+
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+# Long polling and query answers (chat-less, with a short deadline) must
+# never wait behind outgoing messages
+EXEMPT_METHODS = (GetUpdates, AnswerCallbackQuery, AnswerInlineQuery)
+
+@contextmanager
+def low_priority() -> Iterator[None]:
+    """Send the calls made inside the block as background notifications."""
+    token = request_priority.set(NOTIFICATION)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: Optional[float] = None) -> float:
+        """Seconds until a whole token is available."""
+        self._refill(time.monotonic() if now is None else now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def reserve(self, now: Optional[float] = None) -> float:
+        """Take a token now, returning how long the caller must wait before using it."""
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class OutboundLimiter:
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20 / 60,
+        chat_burst: float = 3,
+        max_chats: int = 10000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        # Idle buckets refill completely, so dropping them loses nothing
+        self._chats = LRUCache(max_chats, ttl=max(chat_burst / group_rate, 60.0))
+        self._blocked_until: Dict[Any, float] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+        self.chat_waiting = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.retry_after_hits = 0
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = TokenBucket(rate, self.chat_burst)
+        # Re-set on every use to refresh the idle TTL
+        self._chats.set(chat_id, bucket)
+        return bucket
+
+    def block(self, key: Any, seconds: float):
+        """Hold all calls to ``key`` (a chat id, or the method type of chat-less calls) for ``seconds``."""
+        until = time.monotonic() + seconds
+        self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), until)
+
+    async def _wait_blocked(self, key: Any):
+        until = self._blocked_until.get(key)
+        if until is None:
+            return
+        delay = until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif self._blocked_until.get(key) == until:
+            del self._blocked_until[key]
+
+    async def acquire(
+        self,
+        chat_id: Optional[Union[int, str]] = None,
+        priority: Optional[int] = None,
+        method: Optional[type] = None,
+    ):
+        started = time.monotonic()
+        await self._wait_blocked(chat_id if chat_id is not None else method)
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay > 0:
+                self.chat_waiting += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self.chat_waiting -= 1
+        await self._acquire_global(request_priority.get() if priority is None else priority)
+        waited = time.monotonic() - started
+        self.acquired += 1
+        if waited > 0.001:
+            self.throttled += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    async def _acquire_global(self, priority: int):
+        if not self._waiters and self.global_bucket.wait_time() == 0:
+            self.global_bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        """Hand out global tokens to waiters, highest priority first."""
+        while self._waiters:
+            delay = self.global_bucket.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.global_bucket.take()
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._waiters) + self.chat_waiting,
+            "global_waiting": len(self._waiters),
+            "chat_waiting": self.chat_waiting,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "avg_wait_s": round(self.total_wait / self.throttled, 3) if self.throttled else 0.0,
+            "max_wait_s": round(self.max_wait, 3),
+            "retry_after": self.retry_after_hits,
+            "tracked_chats": len(self._chats),
+        }
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    def __init__(self, limiter: OutboundLimiter, max_retries: int = 3):
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, EXEMPT_METHODS):
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            await self.limiter.acquire(chat_id, method=type(method))
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.limiter.retry_after_hits += 1
+                # A flood wait without a chat only holds back that method
+                self.limiter.block(chat_id if chat_id is not None else type(method), e.retry_after)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(f"Flood wait {e.retry_after}s on {type(method).__name__} (chat {chat_id}), retry {attempt}")
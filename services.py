@@ -1,80 +1,334 @@
 import asyncio
+import hashlib
 import json
 import logging
-import meilisearch
+import time
+import uuid
+from datetime import datetime, timedelta
+import aiohttp
 import asyncpg
 import redis.asyncio as redis
 from config import config
-from typing import List, Dict, Optional, Any
+from cache import LRUCache
+from query_planner import FacetPlan, collect_facets
+from typing import AsyncIterator, List, Dict, Optional, Any, Set, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Settings applied to the books index (and to shadow indexes during rebuilds)
+INDEX_SETTINGS: Dict[str, Any] = {
+    'searchableAttributes': [
+        'title',
+        'author',
+        'tags',
+        'file_name'
+    ],
+    'filterableAttributes': [
+        'tags',
+        'author',
+        'ext',
+        'file_size',
+        'word_count',
+        'content_rating',
+        'size_bucket',
+        'words_bucket'
+    ],
+    'sortableAttributes': [
+        'created_at',
+        'downloads',
+        'file_size'
+    ],
+    'rankingRules': [
+        'words',
+        'typo',
+        'proximity',
+        'attribute',
+        'sort',
+        'exactness'
+    ],
+    'typoTolerance': {
+        'minWordSizeForTypos': {
+            'oneTypo': 5,
+            'twoTypos': 9
+        }
+    },
+    'pagination': {
+        'maxTotalHits': 1000
+    }
+}
+
+# Meilisearch reports these attribute lists sorted, so order is irrelevant
+_UNORDERED_SETTINGS = {"filterableAttributes", "sortableAttributes"}
+
+def settings_diff(desired: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the subset of ``desired`` that differs from ``current``."""
+    diff: Dict[str, Any] = {}
+    for key, value in desired.items():
+        have = current.get(key)
+        if isinstance(value, dict):
+            sub = settings_diff(value, have if isinstance(have, dict) else {})
+            if sub:
+                diff[key] = sub
+        elif key in _UNORDERED_SETTINGS and isinstance(have, list):
+            if sorted(value) != sorted(have):
+                diff[key] = value
+        elif value != have:
+            diff[key] = value
+    return diff
+
+class MeilisearchError(Exception):
+    """Raised when Meilisearch answers with a non-2xx status."""
+
+    def __init__(self, status: int, message: str, code: Optional[str] = None):
+        super().__init__(f"[{status}] {code or 'error'}: {message}")
+        self.status = status
+        self.code = code
+
+
+class SearchResultCache:
+    """
+    Shared search result cache.
+
+    Entries live in Redis (shared by all workers) and optionally in a small
+    in-process LRU in front of it. Invalidation bumps a generation counter in
+    Redis; entries written under an older generation are treated as misses.
+    The local tier cannot see remote bumps, so its TTL should stay short.
+    """
+
+    GEN_KEY = "search_cache:gen"
+
+    def __init__(
+        self,
+        redis_client,
+        ttl: int = 300,
+        local_size: int = 1024,
+        local_ttl: float = 5.0,
+    ):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.local = LRUCache(local_size, ttl=local_ttl) if local_size > 0 else None
+        self.hits = 0
+        self.local_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def make_key(
+        query: str,
+        limit: int,
+        offset: int,
+        filter: Optional[str] = None,
+        sort: Optional[List[str]] = None,
+        plan_key: Optional[str] = None,
+        facets_key: Optional[str] = None,
+    ) -> str:
+        # Keyed on the exact ``q`` sent; keyword callers normalize it beforehand
+        q = query or ""
+        # A query plan key already canonically encodes filter and sort
+        if plan_key is not None:
+            parts = [q, plan_key, offset, limit]
+        else:
+            parts = [q, filter or "", sort or [], offset, limit]
+        # Results carrying facet counts are a different payload
+        if facets_key is not None:
+            parts.append(facets_key)
+        raw = json.dumps(parts, ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Return (result or None, current generation)."""
+        if self.local is not None:
+            cached = self.local.get(key)
+            if cached is not None:
+                self.local_hits += 1
+                return cached[1], cached[0]
+        try:
+            gen, data = await self.redis.mget(self.GEN_KEY, f"search_cache:{key}")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Search cache lookup failed: {e}")
+            return None, ""
+        gen = gen or "0"
+        if data:
+            try:
+                entry = json.loads(data)
+                result = entry["result"] if entry.get("gen") == gen else None
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                # A corrupt or truncated entry is a miss; the next store overwrites it
+                self.errors += 1
+                logger.warning(f"Ignoring unreadable search cache entry {key}: {e}")
+                result = None
+            if result is not None:
+                self.hits += 1
+                if self.local is not None:
+                    self.local.set(key, (gen, result))
+                return result, gen
+        self.misses += 1
+        return None, gen
+
+    async def set(self, key: str, gen: str, result: Dict[str, Any]):
+        """Store a result fetched while ``gen`` was the current generation."""
+        if not gen:
+            return
+        if self.local is not None:
+            self.local.set(key, (gen, result))
+        try:
+            payload = json.dumps({"gen": gen, "result": result}, ensure_ascii=False)
+            await self.redis.set(f"search_cache:{key}", payload, ex=self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Search cache store failed: {e}")
+
+    async def invalidate(self):
+        if self.local is not None:
+            self.local.clear()
+        try:
+            await self.redis.incr(self.GEN_KEY)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Search cache invalidation failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.local_hits + self.misses
+        return {
+            "hits": self.hits,
+            "local_hits": self.local_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round((self.hits + self.local_hits) / total, 4) if total else 0.0,
+            "local_size": len(self.local) if self.local is not None else 0,
+        }
+
+
 class MeilisearchService:
-    def __init__(self):
-        self.client = meilisearch.Client(config.MEILI_HOST, config.MEILI_MASTER_KEY)
+    def __init__(self, cache: Optional[SearchResultCache] = None):
+        self.cache = cache
+        self.host = config.MEILI_HOST.rstrip("/")
         self.index_name = "books"
-        self.index = self.client.index(self.index_name)
+        self.headers = {"Authorization": f"Bearer {config.MEILI_MASTER_KEY}"}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._settings_task: Optional[asyncio.Task] = None
+        # Singleflight: identical searches in flight share one backend request
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.backend_searches = 0
+        self.coalesced_searches = 0
+        self._invalidation_watchers: Set[asyncio.Task] = set()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Created lazily: aiohttp sessions must be bound to the running loop,
+        # while the service singleton is instantiated at import time.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=config.MEILI_MAX_CONNECTIONS,
+                keepalive_timeout=config.MEILI_KEEPALIVE_TIMEOUT,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=config.MEILI_TIMEOUT,
+                connect=config.MEILI_CONNECT_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers=self.headers,
+                json_serialize=json.dumps,
+            )
+        return self._session
+
+    RETRY_STATUSES = (502, 503, 504)
+
+    @staticmethod
+    def _is_read(method: str, path: str) -> bool:
+        # Retrying a write would enqueue a second Meilisearch task
+        return method == "GET" or path.endswith("/search") or path == "/multi-search"
+
+    async def _request(self, method: str, path: str, payload: Any = None) -> Any:
+        """
+        Send one API call. Non-2xx answers raise ``MeilisearchError``; reads
+        are retried on connection errors (e.g. a dropped keep-alive
+        connection) and on 502/503/504.
+        """
+        retries = config.MEILI_RETRIES if self._is_read(method, path) else 0
+        attempt = 0
+        while True:
+            try:
+                return await self._send(method, path, payload)
+            except (aiohttp.ClientConnectionError, MeilisearchError) as e:
+                if isinstance(e, MeilisearchError) and e.status not in self.RETRY_STATUSES:
+                    raise
+                if attempt >= retries:
+                    raise
+                logger.warning(f"Meilisearch {method} {path} failed, retrying: {e}")
+                await asyncio.sleep(config.MEILI_RETRY_BACKOFF * 2 ** attempt)
+                attempt += 1
+
+    async def _send(self, method: str, path: str, payload: Any = None) -> Any:
+        session = self._get_session()
+        async with session.request(method, f"{self.host}{path}", json=payload) as resp:
+            body = await resp.read()
+            data = json.loads(body) if body and resp.content_type == "application/json" else None
+            if resp.status >= 400:
+                data = data if isinstance(data, dict) else {}
+                raise MeilisearchError(resp.status, data.get("message", resp.reason or ""), data.get("code"))
+            return data
 
     async def init_index(self):
-        """Initialize Meilisearch index settings for optimal performance."""
-        # Run in executor because meilisearch-python-sdk is synchronous (mostly)
-        # or we use the async client if available, but the standard lib is sync.
-        # We will wrap sync calls in run_in_executor for async compatibility.
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, self._configure_index)
-
-    def _configure_index(self):
+        """
+        Make sure the index exists and its settings match ``INDEX_SETTINGS``.
+
+        Only settings that actually differ are sent, so a plain restart does
+        not trigger re-indexing; the resulting task is awaited in the background.
+        """
+        await self._configure_index()
+
+    async def _configure_index(self):
         try:
-            # Create index if not exists
             try:
-                self.client.get_index(self.index_name)
-            except Exception:
-                self.client.create_index(self.index_name, {'primaryKey': 'id'})
-            
-            # Update settings
-            self.index.update_settings({
-                'searchableAttributes': [
-                    'title',
-                    'author',
-                    'tags',
-                    'file_name'
-                ],
-                'filterableAttributes': [
-                    'tags',
-                    'author',
-                    'ext',
-                    'file_size',
-                    'word_count',
-                    'content_rating'
-                ],
-                'sortableAttributes': [
-                    'created_at',
-                    'downloads',
-                    'file_size'
-                ],
-                'rankingRules': [
-                    'words',
-                    'typo',
-                    'proximity',
-                    'attribute',
-                    'sort',
-                    'exactness'
-                ],
-                'typoTolerance': {
-                    'minWordSizeForTypos': {
-                        'oneTypo': 5,
-                        'twoTypos': 9
-                    }
-                },
-                'pagination': {
-                    'maxTotalHits': 1000
-                }
-            })
-            logger.info("Meilisearch index configured successfully.")
+                current = await self._request("GET", f"/indexes/{self.index_name}/settings")
+            except MeilisearchError as e:
+                if e.status != 404:
+                    raise
+                # Create index if not exists; tasks run in order, no need to wait
+                await self.create_index(self.index_name)
+                current = {}
+
+            diff = settings_diff(INDEX_SETTINGS, current)
+            if not diff:
+                logger.info("Meilisearch index settings already up to date.")
+                return
+            task = await self.update_settings(diff)
+            logger.info(f"Meilisearch settings changed ({', '.join(sorted(diff))}), task {task.get('taskUid')} enqueued.")
+            self._settings_task = asyncio.create_task(self._watch_settings_task(task["taskUid"]))
         except Exception as e:
             err_type = type(e).__name__
             logger.error(f"Failed to configure Meilisearch [{err_type}]: {e}")
 
+    async def _watch_settings_task(self, task_uid: int):
+        try:
+            task = await self.wait_for_task(task_uid, timeout=3600, interval=2.0)
+        except Exception as e:
+            logger.error(f"Failed to track Meilisearch settings task {task_uid}: {e}")
+            return
+        if task.get("status") == "succeeded":
+            logger.info(f"Meilisearch settings task {task_uid} finished in {task.get('duration')}.")
+        else:
+            logger.error(f"Meilisearch settings task {task_uid} {task.get('status')}: {task.get('error')}")
+
+    async def get_index(self, index_uid: Optional[str] = None) -> Dict[str, Any]:
+        return await self._request("GET", f"/indexes/{index_uid or self.index_name}")
+
+    async def create_index(self, index_uid: str) -> Dict[str, Any]:
+        return await self._request("POST", "/indexes", {"uid": index_uid, "primaryKey": "id"})
+
+    async def delete_index(self, index_uid: str) -> Dict[str, Any]:
+        return await self._request("DELETE", f"/indexes/{index_uid}")
+
+    async def update_settings(self, settings: Dict[str, Any], index_uid: Optional[str] = None) -> Dict[str, Any]:
+        return await self._request("PATCH", f"/indexes/{index_uid or self.index_name}/settings", settings)
+
+    async def swap_indexes(self, index_a: str, index_b: str) -> Dict[str, Any]:
+        """Atomically exchange the contents of two indexes."""
+        return await self._request("POST", "/swap-indexes", [{"indexes": [index_a, index_b]}])
+
     async def search(
         self,
         query: str,
@@ -82,31 +336,460 @@ class MeilisearchService:
         offset: int = 0,
         filter: Optional[str] = None,
         sort: Optional[List[str]] = None,
+        plan_key: Optional[str] = None,
+        facets: Optional[FacetPlan] = None,
     ) -> Dict[str, Any]:
-        loop = asyncio.get_running_loop()
-        options = {
+        """
+        Search the books index. With ``facets`` the hits and the filter menu
+        counts come from one multi-search request; the counts are returned
+        under ``facet_counts``.
+        """
+        payload = {
+            'q': query,
             'limit': limit,
             'offset': offset,
             'attributesToHighlight': ['title', 'author'],
         }
         if filter:
-            options['filter'] = filter
+            payload['filter'] = filter
         if sort:
-            options["sort"] = sort
-        return await loop.run_in_executor(None, lambda: self.index.search(query, options))
+            payload["sort"] = sort
+
+        key = SearchResultCache.make_key(
+            query, limit, offset, filter, sort, plan_key, facets.key if facets is not None else None
+        )
+        gen = ""
+        if self.cache is not None:
+            cached, gen = await self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced_searches += 1
+        else:
+            task = asyncio.create_task(self._fetch_search(key, gen, payload, facets))
+            self._inflight[key] = task
+            self.backend_searches += 1
+
+            def _cleanup(t: asyncio.Task, k: str = key):
+                if self._inflight.get(k) is t:
+                    del self._inflight[k]
+                # Mark the exception retrieved even if every waiter was cancelled
+                if not t.cancelled():
+                    t.exception()
+
+            task.add_done_callback(_cleanup)
+        # Shielded so one cancelled caller does not fail the others
+        return await asyncio.shield(task)
+
+    async def _fetch_search(
+        self, key: str, gen: str, payload: Dict[str, Any], facets: Optional[FacetPlan] = None
+    ) -> Dict[str, Any]:
+        if facets is None:
+            result = await self._request("POST", f"/indexes/{self.index_name}/search", payload)
+        else:
+            main = dict(payload, indexUid=self.index_name)
+            if facets.main_attributes:
+                main["facets"] = list(facets.main_attributes)
+            queries = [main]
+            for facet_query in facets.queries:
+                query = {"indexUid": self.index_name, "q": payload["q"], "limit": 0}
+                if facet_query.filter:
+                    query["filter"] = facet_query.filter
+                if facet_query.attributes:
+                    query["facets"] = list(facet_query.attributes)
+                queries.append(query)
+            results = await self.multi_search(queries)
+            result = results[0]
+            result["facet_counts"] = collect_facets(facets, result, results[1:])
+        if self.cache is not None:
+            await self.cache.set(key, gen, result)
+        return result
+
+    async def multi_search(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run several queries in one request; each needs its ``indexUid``."""
+        result = await self._request("POST", "/multi-search", {"queries": queries})
+        return result.get("results", [])
+
+    def _invalidate_after(self, task: Dict[str, Any]):
+        """
+        Invalidate the search cache once ``task`` has been applied.
+
+        Invalidating at enqueue time would let searches that still see the old
+        index get cached under the new generation.
+        """
+        if self.cache is None:
+            return
+        watcher = asyncio.create_task(self._invalidate_when_done(task["taskUid"]))
+        self._invalidation_watchers.add(watcher)
+        watcher.add_done_callback(self._invalidation_watchers.discard)
+
+    async def _invalidate_when_done(self, task_uid: int):
+        try:
+            task = await self.wait_for_task(task_uid, timeout=600, interval=0.5)
+            if task.get("status") != "succeeded":
+                logger.error(f"Meilisearch task {task_uid} {task.get('status')}: {task.get('error')}")
+                return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Outcome unknown: drop the cache rather than risk serving stale results
+            logger.warning(f"Failed to track Meilisearch task {task_uid}: {e}")
+        await self.cache.invalidate()
+
+    async def add_documents(
+        self, documents: List[Dict[str, Any]], index_uid: Optional[str] = None, invalidate: bool = True
+    ) -> Dict[str, Any]:
+        """``invalidate=False`` leaves cache invalidation to a caller that tracks the task itself."""
+        task = await self._request("POST", f"/indexes/{index_uid or self.index_name}/documents", documents)
+        if invalidate and index_uid in (None, self.index_name):
+            self._invalidate_after(task)
+        return task
+
+    async def update_documents(self, documents: List[Dict[str, Any]], invalidate: bool = True) -> Dict[str, Any]:
+        """Add or merge documents (PUT): fields missing from a document are kept."""
+        task = await self._request("PUT", f"/indexes/{self.index_name}/documents", documents)
+        if invalidate:
+            self._invalidate_after(task)
+        return task
+
+    async def delete_document(self, document_id: str) -> Dict[str, Any]:
+        task = await self._request("DELETE", f"/indexes/{self.index_name}/documents/{document_id}")
+        self._invalidate_after(task)
+        return task
+
+    async def get_task(self, task_uid: int) -> Dict[str, Any]:
+        return await self._request("GET", f"/tasks/{task_uid}")
+
+    async def get_tasks(self, task_uids: List[int]) -> List[Dict[str, Any]]:
+        uids = ",".join(str(uid) for uid in task_uids)
+        data = await self._request("GET", f"/tasks?uids={uids}&limit={len(task_uids)}")
+        return data.get("results", [])
+
+    async def wait_for_task(self, task_uid: int, timeout: float = 60.0, interval: float = 0.2) -> Dict[str, Any]:
+        """Poll a Meilisearch task until it leaves the enqueued/processing states."""
+        deadline = time.monotonic() + timeout
+        while True:
+            task = await self.get_task(task_uid)
+            if task.get("status") not in ("enqueued", "processing"):
+                return task
+            if time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(f"Meilisearch task {task_uid} still {task.get('status')} after {timeout}s")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend_searches": self.backend_searches,
+            "coalesced_searches": self.coalesced_searches,
+            "in_flight": len(self._inflight),
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+    async def close(self):
+        pending = list(self._inflight.values()) + list(self._invalidation_watchers)
+        if self._settings_task is not None and not self._settings_task.done():
+            pending.append(self._settings_task)
+        # Nothing may still be using the session when it is closed
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._inflight.clear()
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+class IndexingQueue:
+    """
+    Micro-batching queue in front of ``MeilisearchService.add_documents``.
+
+    Documents are buffered (latest version per id wins) and flushed when the
+    batch is full or ``flush_interval`` elapses. Returned task uids are polled
+    until Meilisearch finishes them, which is what queue depth and lag measure.
+    """
+
+    def __init__(
+        self,
+        meili: MeilisearchService,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        poll_interval: float = 1.0,
+    ):
+        self.meili = meili
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        # id -> (first enqueue time, latest version); insertion order is age order
+        self._docs: Dict[Any, Tuple[float, Dict[str, Any]]] = {}
+        # task uid -> (enqueue time of the batch's oldest doc, doc count)
+        self._tasks: Dict[int, Tuple[float, int]] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._workers: List[asyncio.Task] = []
+        self.enqueued = 0
+        self.batches = 0
+        self.indexed = 0
+        self.failed_tasks = 0
+        self.last_lag = 0.0
+
+    def enqueue(self, documents: List[Dict[str, Any]]):
+        if not documents:
+            return
+        now = time.monotonic()
+        for doc in documents:
+            # A newer version replaces the doc but keeps its place and age
+            entry = self._docs.get(doc["id"])
+            self._docs[doc["id"]] = (entry[0] if entry else now, doc)
+        self.enqueued += len(documents)
+        if len(self._docs) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._run_flusher()),
+                asyncio.create_task(self._run_poller()),
+            ]
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._docs:
+                keys = list(self._docs)[: self.batch_size]
+                entries = {key: self._docs.pop(key) for key in keys}
+                oldest = min(enqueued_at for enqueued_at, _ in entries.values())
+                try:
+                    # poll_tasks invalidates the cache once the task has finished
+                    task = await self.meili.add_documents([doc for _, doc in entries.values()], invalidate=False)
+                except Exception as e:
+                    logger.error(f"Indexing flush failed ({len(entries)} docs), will retry: {e}")
+                    # Back in front with their original age; versions enqueued meanwhile win
+                    restored = {
+                        key: (enqueued_at, self._docs[key][1] if key in self._docs else doc)
+                        for key, (enqueued_at, doc) in entries.items()
+                    }
+                    for key, entry in self._docs.items():
+                        restored.setdefault(key, entry)
+                    self._docs = restored
+                    return
+                self._tasks[task["taskUid"]] = (oldest, len(entries))
+                self.batches += 1
+
+    async def poll_tasks(self):
+        if not self._tasks:
+            return
+        finished = 0
+        for task in await self.meili.get_tasks(list(self._tasks)):
+            status = task.get("status")
+            if status in ("enqueued", "processing"):
+                continue
+            oldest, count = self._tasks.pop(task["uid"], (time.monotonic(), 0))
+            if status == "succeeded":
+                self.indexed += count
+                self.last_lag = time.monotonic() - oldest
+                finished += 1
+            else:
+                self.failed_tasks += 1
+                logger.error(f"Indexing task {task['uid']} {status}: {task.get('error')}")
+        if finished and self.meili.cache is not None:
+            # Results cached while the task was processing may miss the new docs
+            await self.meili.cache.invalidate()
+
+    async def _run_flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Indexing flusher error: {e}")
+
+    async def _run_poller(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll_tasks()
+            except Exception as e:
+                logger.warning(f"Indexing task poll failed: {e}")
+
+    def depth(self) -> int:
+        return len(self._docs) + sum(count for _, count in self._tasks.values())
+
+    def lag(self) -> float:
+        """Age in seconds of the oldest document not yet searchable."""
+        starts = [oldest for oldest, _ in self._tasks.values()]
+        if self._docs:
+            starts.append(next(iter(self._docs.values()))[0])
+        return time.monotonic() - min(starts) if starts else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._docs),
+            "pending_tasks": len(self._tasks),
+            "depth": self.depth(),
+            "lag_s": round(self.lag(), 3),
+            "last_lag_s": round(self.last_lag, 3),
+            "enqueued": self.enqueued,
+            "batches": self.batches,
+            "indexed": self.indexed,
+            "failed_tasks": self.failed_tasks,
+        }
+
+    async def close(self, timeout: float = 10.0):
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+        # Drain: push what is buffered and give in-flight tasks a chance to finish
+        deadline = time.monotonic() + timeout
+        try:
+            await self.flush()
+            while self._tasks and time.monotonic() < deadline:
+                await self.poll_tasks()
+                if self._tasks:
+                    await asyncio.sleep(min(self.poll_interval, 0.5))
+        except Exception as e:
+            logger.error(f"Indexing queue drain failed: {e}")
+        if self._docs or self._tasks:
+            logger.warning(f"Indexing queue closed with {len(self._docs)} buffered docs, {len(self._tasks)} unfinished tasks")
+
+
+class SearchPrefetcher:
+    """
+    Speculatively fetch the next result page so it lands in the search cache.
 
-    async def add_documents(self, documents: List[Dict[str, Any]]):
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, lambda: self.index.add_documents(documents))
+    At most one prefetch per user is kept; a newer one, a re-render or
+    leaving the result list cancels the previous. When all slots are busy
+    the prefetch is dropped rather than queued, since it is only an
+    optimization.
+    """
 
-    async def delete_document(self, document_id: str):
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, lambda: self.index.delete_document(document_id))
+    def __init__(self, meili: MeilisearchService, concurrency: int = 4):
+        self.meili = meili
+        self.concurrency = concurrency
+        # Slots are taken when a prefetch is scheduled, so tasks never queue up
+        self._active = 0
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def schedule(
+        self,
+        user_id: int,
+        query: str,
+        limit: int,
+        offset: int,
+        filter: Optional[str] = None,
+        sort: Optional[List[str]] = None,
+        plan_key: Optional[str] = None,
+    ):
+        self.cancel(user_id)
+        if self._active >= self.concurrency:
+            self.dropped += 1
+            return
+        self._active += 1
+        task = asyncio.create_task(self._run(query, limit, offset, filter, sort, plan_key))
+        self._tasks[user_id] = task
+        self.scheduled += 1
+
+        def _cleanup(t: asyncio.Task, uid: int = user_id):
+            self._active -= 1
+            if self._tasks.get(uid) is t:
+                del self._tasks[uid]
+
+        task.add_done_callback(_cleanup)
+
+    def cancel(self, user_id: int):
+        task = self._tasks.pop(user_id, None)
+        if task and not task.done():
+            task.cancel()
+            self.cancelled += 1
+
+    async def _run(
+        self,
+        query: str,
+        limit: int,
+        offset: int,
+        filter: Optional[str],
+        sort: Optional[List[str]],
+        plan_key: Optional[str] = None,
+    ):
+        try:
+            await self.meili.search(query, limit=limit, offset=offset, filter=filter, sort=sort, plan_key=plan_key)
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.debug(f"Prefetch failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self._active,
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+IMPORT_COLUMNS = ["file_id", "file_unique_id", "file_name", "file_size", "title", "author", "tags", "uploader_id"]
+
+def _encode_book(book: Dict[str, Any]) -> str:
+    return json.dumps(
+        {k: v.isoformat() if isinstance(v, datetime) else v for k, v in book.items()},
+        ensure_ascii=False,
+    )
+
+def _decode_book(data: str) -> Dict[str, Any]:
+    book = json.loads(data)
+    for field in ("created_at", "updated_at"):
+        if isinstance(book.get(field), str):
+            book[field] = datetime.fromisoformat(book[field])
+    return book
+
+# Fill the book cache only if no invalidation happened since the read began.
+# KEYS: book key, version key. ARGV: version seen before the read ("" if none), payload, ttl.
+_BOOK_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
 
 
 class DatabaseService:
-    def __init__(self):
+    def __init__(self, redis_service: Optional["RedisService"] = None):
         self.pool = None
+        # Read-through book record cache: local LRU -> Redis -> Postgres
+        self.redis_service = redis_service
+        self.book_cache = LRUCache(config.BOOK_CACHE_LOCAL_SIZE, ttl=config.BOOK_CACHE_LOCAL_TTL)
+        # Bumped on every local invalidation; guards local fills the same way
+        self._local_invalidations = 0
+        self._book_fill = None
+        if redis_service is not None:
+            redis_service.register_local_cache("book", self.book_cache)
+            self._book_fill = redis_service.redis.register_script(_BOOK_FILL_SCRIPT)
+        # Write-behind download counters, flushed by a background task
+        self._pending_downloads: Dict[int, int] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.download_flushes = 0
+        self.downloads_flushed = 0
+        self.download_flush_failures = 0
+        self.last_flush_batch = 0
+        self.last_flush_ms = 0.0
 
     async def connect(self):
         self.pool = await asyncpg.create_pool(config.PG_DSN)
@@ -132,59 +815,386 @@ class DatabaseService:
                 CREATE INDEX IF NOT EXISTS idx_books_title ON books(title);
                 CREATE INDEX IF NOT EXISTS idx_books_author ON books(author);
                 CREATE UNIQUE INDEX IF NOT EXISTS uniq_books_file_unique_id ON books(file_unique_id);
+                ALTER TABLE books ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();
+                CREATE INDEX IF NOT EXISTS idx_books_updated_at ON books(updated_at, id);
+                -- Bumped by writes to searched/filtered fields; download counters only bump updated_at
+                ALTER TABLE books ADD COLUMN IF NOT EXISTS content_updated_at TIMESTAMP NOT NULL DEFAULT NOW();
             """)
 
-    async def add_book(self, book_data: Dict[str, Any]) -> int:
+    async def get_book(self, book_id: int) -> Optional[Dict[str, Any]]:
+        cached = self.book_cache.get(str(book_id))
+        if cached is not None:
+            return dict(cached)
+
+        local_generation = self._local_invalidations
+        version = None
+        if self.redis_service is not None:
+            try:
+                data, version = await self.redis_service.redis.mget(f"book:{book_id}", f"book:ver:{book_id}")
+            except Exception as e:
+                logger.warning(f"Book cache lookup failed: {e}")
+                data = None
+            if data:
+                book = _decode_book(data)
+                self.book_cache.set(str(book_id), book)
+                return dict(book)
+
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM books WHERE id = $1", book_id)
+        if row is None:
+            return None
+        book = dict(row)
+        # A write that landed while we were reading must not be overwritten
+        # by this (possibly older) row
+        filled = True
+        if self._book_fill is not None:
+            try:
+                filled = bool(await self._book_fill(
+                    keys=[f"book:{book_id}", f"book:ver:{book_id}"],
+                    args=[version or "", _encode_book(book), config.BOOK_CACHE_TTL],
+                ))
+            except Exception as e:
+                logger.warning(f"Book cache store failed: {e}")
+                filled = False
+        if filled and self._local_invalidations == local_generation:
+            self.book_cache.set(str(book_id), book)
+        return dict(book)
+
+    async def invalidate_book(self, book_id: int):
+        await self.invalidate_books([book_id])
+
+    async def invalidate_books(self, book_ids: List[int]):
+        self._local_invalidations += 1
+        for book_id in book_ids:
+            self.book_cache.pop(str(book_id))
+        if self.redis_service is None or not book_ids:
+            return
+        try:
+            async with self.redis_service.redis.pipeline(transaction=False) as pipe:
+                for book_id in book_ids:
+                    # The version outlives any in-flight read, so stale fills are refused
+                    pipe.incr(f"book:ver:{book_id}")
+                    pipe.expire(f"book:ver:{book_id}", config.BOOK_CACHE_TTL)
+                pipe.delete(*[f"book:{book_id}" for book_id in book_ids])
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Book cache invalidation failed for {len(book_ids)} books: {e}")
+        await self.redis_service.publish_invalidations("book", book_ids)
+
+    async def add_books(self, books: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Insert many books in one statement.
+
+        Returns the stored rows (new ones and those that already existed with
+        the same file_unique_id or file_id) and the input books that were
+        skipped because they conflicted on either column.
+        """
+        if not books:
+            return [], []
+        # Drop in-batch duplicates on either unique column; the first one wins
+        seen_unique_ids, seen_file_ids = set(), set()
+        unique = []
+        for book in books:
+            if book['file_unique_id'] in seen_unique_ids or book['file_id'] in seen_file_ids:
+                continue
+            seen_unique_ids.add(book['file_unique_id'])
+            seen_file_ids.add(book['file_id'])
+            unique.append(book)
+        # Sorted keys keep unique-index lock order consistent across workers
+        ordered = sorted(unique, key=lambda book: book['file_unique_id'])
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow("""
-                INSERT INTO books (file_id, file_unique_id, file_name, file_size, title, author, tags, uploader_id)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-                ON CONFLICT (file_unique_id) DO NOTHING
-                RETURNING id
-            """, book_data['file_id'], book_data['file_unique_id'], book_data['file_name'],
-               book_data['file_size'], book_data.get('title'), book_data.get('author'),
-               book_data.get('tags', []), book_data.get('uploader_id'))
-            if row:
-                return row['id']
-            existing = await conn.fetchrow("SELECT id FROM books WHERE file_unique_id = $1", book_data['file_unique_id'])
-            return existing['id']
-
-    async def get_book(self, book_id: int):
+            rows = await conn.fetch("""
+                WITH input AS (
+                    SELECT * FROM unnest($1::text[], $2::text[], $3::text[], $4::bigint[],
+                                         $5::text[], $6::text[], $7::text[], $8::bigint[])
+                        AS t(file_id, file_unique_id, file_name, file_size, title, author, tags, uploader_id)
+                ), inserted AS (
+                    INSERT INTO books (file_id, file_unique_id, file_name, file_size, title, author, tags, uploader_id)
+                    SELECT file_id, file_unique_id, file_name, file_size, title, author,
+                           ARRAY(SELECT jsonb_array_elements_text(tags::jsonb)), uploader_id
+                    FROM input
+                    ON CONFLICT DO NOTHING
+                    RETURNING *
+                )
+                SELECT *, TRUE AS inserted FROM inserted
+                UNION ALL
+                -- The statement snapshot only sees rows that existed before the insert
+                SELECT b.*, FALSE AS inserted FROM books b
+                WHERE b.file_unique_id = ANY($2::text[]) OR b.file_id = ANY($1::text[])
+            """,
+                [b['file_id'] for b in ordered],
+                [b['file_unique_id'] for b in ordered],
+                [b['file_name'] for b in ordered],
+                [b.get('file_size') for b in ordered],
+                [b.get('title') for b in ordered],
+                [b.get('author') for b in ordered],
+                [json.dumps(b.get('tags') or []) for b in ordered],
+                [b.get('uploader_id') for b in ordered],
+            )
+        result = [dict(row) for row in rows]
+        inserted = {book['file_unique_id'] for book in result if book.pop('inserted')}
+        kept = {id(book) for book in unique if book['file_unique_id'] in inserted}
+        skipped = [book for book in books if id(book) not in kept]
+        if skipped:
+            logger.info(f"Skipped {len(skipped)} of {len(books)} books already in the library")
+        await self.invalidate_books([book['id'] for book in result])
+        return result, skipped
+
+    async def import_books(self, records: List[Tuple[Any, ...]]) -> List[Dict[str, Any]]:
+        """
+        Bulk insert manifest records via COPY into a temp table.
+
+        ``records`` follow ``IMPORT_COLUMNS``. Rows that already exist are
+        skipped; all rows of the batch (new and pre-existing) are returned so
+        a resumed import can re-index them.
+        """
         async with self.pool.acquire() as conn:
-            return await conn.fetchrow("SELECT * FROM books WHERE id = $1", book_id)
-            
-    async def get_book_by_file_unique_id(self, file_unique_id: str):
+            async with conn.transaction():
+                await conn.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS import_books_tmp (
+                        file_id TEXT,
+                        file_unique_id TEXT,
+                        file_name TEXT,
+                        file_size BIGINT,
+                        title TEXT,
+                        author TEXT,
+                        tags TEXT[],
+                        uploader_id BIGINT
+                    ) ON COMMIT DELETE ROWS
+                """)
+                await conn.copy_records_to_table("import_books_tmp", records=records, columns=IMPORT_COLUMNS)
+                await conn.execute(f"""
+                    INSERT INTO books ({", ".join(IMPORT_COLUMNS)})
+                    SELECT {", ".join(IMPORT_COLUMNS)} FROM import_books_tmp
+                    ON CONFLICT DO NOTHING
+                """)
+                rows = await conn.fetch("""
+                    SELECT b.* FROM books b
+                    JOIN import_books_tmp t ON t.file_unique_id = b.file_unique_id
+                """)
+        return [dict(row) for row in rows]
+
+    async def iter_changed_books(
+        self,
+        since: Optional[Tuple[datetime, int]] = None,
+        settle: float = 5.0,
+        chunk_size: int = 1000,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream books changed after the ``(updated_at, id)`` watermark in chunks.
+
+        Each chunk is its own keyset query, so no transaction or cursor stays
+        open while the caller waits on Meilisearch. Rows newer than ``settle``
+        seconds (measured once, at the start) are left for the next pass,
+        giving slow transactions time to commit before the watermark moves
+        past them.
+        """
         async with self.pool.acquire() as conn:
-            return await conn.fetchrow("SELECT * FROM books WHERE file_unique_id = $1", file_unique_id)
+            cutoff = await conn.fetchval("SELECT NOW()::timestamp - $1::interval", timedelta(seconds=settle))
+        last = since
+        while True:
+            args: List[Any] = [cutoff, chunk_size]
+            conditions = ["updated_at <= $1"]
+            if last is not None:
+                conditions.append("(updated_at, id) > ($3, $4)")
+                args.extend(last)
+            query = f"SELECT * FROM books WHERE {' AND '.join(conditions)} ORDER BY updated_at, id LIMIT $2"
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(query, *args)
+            if not rows:
+                return
+            chunk = [dict(row) for row in rows]
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            last = (chunk[-1]["updated_at"], chunk[-1]["id"])
 
-    async def increment_download(self, book_id: int):
+    async def seconds_since(self, ts: datetime) -> float:
+        """Age of ``ts`` measured on the database clock."""
         async with self.pool.acquire() as conn:
-            await conn.execute("UPDATE books SET downloads = downloads + 1 WHERE id = $1", book_id)
+            return float(await conn.fetchval("SELECT EXTRACT(EPOCH FROM NOW()::timestamp - $1::timestamp)", ts))
+
+    async def get_existing_file_unique_ids(self, file_unique_ids: List[str]) -> Set[str]:
+        """Return which of ``file_unique_ids`` are already in the library, in one query."""
+        if not file_unique_ids:
+            return set()
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT file_unique_id FROM books WHERE file_unique_id = ANY($1::text[])",
+                file_unique_ids,
+            )
+        return {row["file_unique_id"] for row in rows}
+
+    def record_download(self, book_id: int):
+        """Buffer a download; persisted by the next ``flush_downloads``."""
+        self._pending_downloads[book_id] = self._pending_downloads.get(book_id, 0) + 1
+
+    async def flush_downloads(self) -> int:
+        """Persist buffered download counts in one set-based UPDATE."""
+        async with self._flush_lock:
+            if not self._pending_downloads:
+                return 0
+            batch, self._pending_downloads = self._pending_downloads, {}
+            # Sorted ids keep row lock order consistent across workers
+            ids = sorted(batch)
+            counts = [batch[book_id] for book_id in ids]
+            start = time.perf_counter()
+            try:
+                async with self.pool.acquire() as conn:
+                    await conn.execute("""
+                        UPDATE books SET downloads = books.downloads + v.n, updated_at = NOW()
+                        FROM unnest($1::int[], $2::int[]) AS v(id, n)
+                        WHERE books.id = v.id
+                    """, ids, counts)
+            except Exception as e:
+                # Put the counts back so the next flush retries them
+                for book_id, n in batch.items():
+                    self._pending_downloads[book_id] = self._pending_downloads.get(book_id, 0) + n
+                self.download_flush_failures += 1
+                logger.error(f"Download counter flush failed ({len(ids)} books): {e}")
+                return 0
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            self.last_flush_batch = len(ids)
+            self.download_flushes += 1
+            self.downloads_flushed += sum(counts)
+        await self.invalidate_books(ids)
+        return len(ids)
+
+    def start_download_flusher(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._run_download_flusher())
+
+    async def _run_download_flusher(self):
+        while True:
+            await asyncio.sleep(config.DOWNLOAD_FLUSH_INTERVAL)
+            try:
+                await self.flush_downloads()
+            except Exception as e:
+                logger.error(f"Download flusher error: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_download_books": len(self._pending_downloads),
+            "download_flushes": self.download_flushes,
+            "downloads_flushed": self.downloads_flushed,
+            "download_flush_failures": self.download_flush_failures,
+            "last_flush_batch": self.last_flush_batch,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
 
     async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
         if self.pool:
+            # Drain buffered counters before the pool goes away
+            await self.flush_downloads()
             await self.pool.close()
 
 
+# Merge a patch into the stored search context server-side, in one round trip.
+# ARGV: base ({"query", "filter"}), patch, ttl.
+# "upsert" starts a fresh context when none exists or the query/filter changed;
+# "update" only patches an existing context and returns nil otherwise.
+_SEARCH_CTX_SCRIPT = """
+local raw = redis.call('GET', KEYS[1])
+local ctx = nil
+if raw then ctx = cjson.decode(raw) end
+local base = cjson.decode(ARGV[1])
+local patch = cjson.decode(ARGV[2])
+if not ctx or ctx['query'] ~= base['query'] or ctx['filter'] ~= base['filter'] then
+    ctx = {query = base['query'], filter = base['filter'], page = 0, sort = 'best', filters = {}}
+end
+for k, v in pairs(patch) do ctx[k] = v end
+local encoded = cjson.encode(ctx)
+redis.call('SET', KEYS[1], encoded, 'EX', tonumber(ARGV[3]))
+return encoded
+"""
+
+_UPLOAD_RELEASE_SCRIPT = """
+redis.call('LTRIM', KEYS[1], ARGV[1], -1)
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('ZREM', KEYS[2], ARGV[2])
+else
+    redis.call('ZADD', KEYS[2], ARGV[3], ARGV[2])
+end
+return 1
+"""
+
 class RedisService:
-    def __init__(self):
-        self.redis = redis.from_url(config.REDIS_URL, encoding="utf-8", decode_responses=True)
+    # Pub/sub channel used to evict entries from every worker's local caches.
+    # Messages are "<instance_id>|<namespace>|<key>".
+    INVALIDATION_CHANNEL = "cache:invalidate"
+
+    def __init__(self, client=None):
+        self.redis = client or redis.from_url(config.REDIS_URL, encoding="utf-8", decode_responses=True)
         self.supports_getdel = hasattr(self.redis, "getdel")
+        self._search_ctx_script = self.redis.register_script(_SEARCH_CTX_SCRIPT)
+        self._upload_release_script = self.redis.register_script(_UPLOAD_RELEASE_SCRIPT)
+        self.instance_id = uuid.uuid4().hex[:12]
+        self.settings_cache = LRUCache(config.USER_SETTINGS_CACHE_SIZE, ttl=config.USER_SETTINGS_CACHE_TTL)
+        self._local_caches: Dict[str, LRUCache] = {"user_settings": self.settings_cache}
+        self._listener_task: Optional[asyncio.Task] = None
 
-    async def cache_search_context(self, user_id: int, query: str, filter_type: str = None):
-        data = json.dumps(
-            {
-                "query": query,
-                "filter": filter_type,
-                "page": 0,
-                "sort": "best",
-                "filters": {},
-            }
-        )
-        await self.redis.set(f"search_ctx:{user_id}", data, ex=3600)
+    def register_local_cache(self, namespace: str, cache: LRUCache):
+        """Let ``publish_invalidation(namespace, key)`` evict entries from ``cache``."""
+        self._local_caches[namespace] = cache
 
-    async def get_search_context(self, user_id: int) -> Optional[Dict[str, Any]]:
-        data = await self.redis.get(f"search_ctx:{user_id}")
+    async def publish_invalidation(self, namespace: str, key: Any):
+        try:
+            await self.redis.publish(self.INVALIDATION_CHANNEL, f"{self.instance_id}|{namespace}|{key}")
+        except Exception as e:
+            logger.error(f"Failed to publish cache invalidation {namespace}:{key}: {e}")
+
+    async def publish_invalidations(self, namespace: str, keys: List[Any]):
+        if not keys:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.publish(self.INVALIDATION_CHANNEL, f"{self.instance_id}|{namespace}|{key}")
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to publish {len(keys)} cache invalidations for {namespace}: {e}")
+
+    def start_invalidation_listener(self):
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._listen_invalidations())
+
+    async def _listen_invalidations(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    sender, _, rest = str(message["data"]).partition("|")
+                    if sender == self.instance_id:
+                        continue
+                    namespace, _, key = rest.partition("|")
+                    cache = self._local_caches.get(namespace)
+                    if cache is not None:
+                        cache.pop(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener error, resubscribing: {e}")
+                # Messages may have been missed while disconnected
+                for cache in self._local_caches.values():
+                    cache.clear()
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    @staticmethod
+    def _load_search_context(data: Optional[str]) -> Optional[Dict[str, Any]]:
         if not data:
             return None
         ctx = json.loads(data)
@@ -192,19 +1202,48 @@ class RedisService:
             ctx["page"] = 0
         if "sort" not in ctx:
             ctx["sort"] = "best"
-        if "filters" not in ctx or ctx["filters"] is None:
+        if "filters" not in ctx or not isinstance(ctx["filters"], dict):
             ctx["filters"] = {}
+        # cjson turns empty objects into arrays
+        facets = ctx.get("facets")
+        if isinstance(facets, dict):
+            ctx["facets"] = {k: v for k, v in facets.items() if isinstance(v, dict)}
+        else:
+            ctx.pop("facets", None)
         return ctx
 
-    async def update_search_context(self, user_id: int, patch: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        ctx = await self.get_search_context(user_id)
-        if not ctx:
-            return None
-        merged = {**ctx, **patch}
-        await self.redis.set(f"search_ctx:{user_id}", json.dumps(merged), ex=3600)
-        return merged
+    async def get_search_context(self, user_id: int) -> Optional[Dict[str, Any]]:
+        data = await self.redis.get(f"search_ctx:{user_id}")
+        return self._load_search_context(data)
+
+    async def upsert_search_context(
+        self,
+        user_id: int,
+        query: str,
+        filter_type: Optional[str],
+        patch: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """
+        Create or merge the search context in a single atomic round trip.
+
+        A new context is started when the stored one belongs to another
+        query/filter, otherwise ``patch`` is merged into it.
+        """
+        data = await self._search_ctx_script(
+            keys=[f"search_ctx:{user_id}"],
+            args=[json.dumps({"query": query, "filter": filter_type}), json.dumps(patch), 3600],
+        )
+        return self._load_search_context(data)
 
     async def get_user_settings(self, user_id: int) -> Dict[str, Any]:
+        cached = self.settings_cache.get(str(user_id))
+        if cached is not None:
+            return dict(cached)
+        settings = await self._fetch_user_settings(user_id)
+        self.settings_cache.set(str(user_id), settings)
+        return dict(settings)
+
+    async def _fetch_user_settings(self, user_id: int) -> Dict[str, Any]:
         defaults = {
             "content_rating": "ALL",
             "search_button_mode": "preview",
@@ -226,18 +1265,121 @@ class RedisService:
         return defaults
 
     async def update_user_settings(self, user_id: int, patch: Dict[str, Any]) -> Dict[str, Any]:
-        current = await self.get_user_settings(user_id)
+        current = await self._fetch_user_settings(user_id)
         merged = {**current, **patch}
         await self.redis.set(f"user_settings:{user_id}", json.dumps(merged), ex=7776000)
-        return merged
+        self.settings_cache.set(str(user_id), merged)
+        await self.publish_invalidation("user_settings", user_id)
+        return dict(merged)
+
+    async def get_sync_watermark(self) -> Optional[Tuple[datetime, int]]:
+        data = await self.redis.get("sync:books:watermark")
+        if not data:
+            return None
+        wm = json.loads(data)
+        return datetime.fromisoformat(wm["updated_at"]), int(wm["id"])
+
+    async def set_sync_watermark(self, watermark: Tuple[datetime, int]):
+        await self.redis.set(
+            "sync:books:watermark",
+            json.dumps({"updated_at": watermark[0].isoformat(), "id": watermark[1]}),
+        )
+
+    async def get_sync_status(self) -> Optional[Dict[str, Any]]:
+        data = await self.redis.get("sync:books:status")
+        return json.loads(data) if data else None
+
+    async def set_sync_status(self, status: Dict[str, Any]):
+        await self.redis.set("sync:books:status", json.dumps(status, ensure_ascii=False))
 
     async def create_upload_session(self, file_data: Dict[str, Any]) -> str:
         """Store upload data temporarily and return a short ID."""
-        import uuid
         short_id = uuid.uuid4().hex[:8]
         await self.redis.set(f"pending:{short_id}", json.dumps(file_data), ex=86400)
         return short_id
 
+    async def create_upload_batch(self, items: List[Dict[str, Any]]) -> Tuple[str, List[str]]:
+        """Store one pending session per item plus a batch index, in one round trip."""
+        batch_id = uuid.uuid4().hex[:8]
+        short_ids = [uuid.uuid4().hex[:8] for _ in items]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for short_id, item in zip(short_ids, items):
+                pipe.set(f"pending:{short_id}", json.dumps(item), ex=86400)
+            pipe.set(f"pending_batch:{batch_id}", json.dumps(short_ids), ex=86400)
+            await pipe.execute()
+        return batch_id, short_ids
+
+    async def pop_upload_batch(self, batch_id: str) -> List[str]:
+        """Return the session ids of a batch and forget the batch."""
+        if self.supports_getdel:
+            data = await self.redis.getdel(f"pending_batch:{batch_id}")
+        else:
+            async with self.redis.pipeline() as pipe:
+                pipe.get(f"pending_batch:{batch_id}")
+                pipe.delete(f"pending_batch:{batch_id}")
+                data = (await pipe.execute())[0]
+        return json.loads(data) if data else []
+
+    async def delete_upload_sessions(self, short_ids: List[str]) -> int:
+        if not short_ids:
+            return 0
+        return await self.redis.delete(*(f"pending:{short_id}" for short_id in short_ids))
+
+    async def get_and_delete_upload_sessions(self, short_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Fetch and delete many upload sessions in one pipelined round trip."""
+        if not short_ids:
+            return []
+        keys = [f"pending:{short_id}" for short_id in short_ids]
+        if self.supports_getdel:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.getdel(key)
+                values = await pipe.execute()
+        else:
+            async with self.redis.pipeline() as pipe:
+                for key in keys:
+                    pipe.get(key)
+                pipe.delete(*keys)
+                values = (await pipe.execute())[:-1]
+        return [json.loads(value) if value else None for value in values]
+
+    async def iter_upload_session_ids(self, count: int = 1000) -> AsyncIterator[str]:
+        """Yield the short ids of all pending upload sessions."""
+        async for key in self.redis.scan_iter(match="pending:*", count=count):
+            yield key.split(":", 1)[1]
+
+    # Uploads waiting in a batch window: one list per batch key, plus a
+    # sorted set of batch keys scored by the oldest unreleased item.
+    UPLOAD_JOURNAL = "upload_journal"
+
+    async def journal_upload(self, key: Any, payload: str):
+        async with self.redis.pipeline() as pipe:
+            pipe.rpush(f"{self.UPLOAD_JOURNAL}:{key}", payload)
+            pipe.zadd(self.UPLOAD_JOURNAL, {str(key): time.time()}, nx=True)
+            await pipe.execute()
+
+    async def release_uploads(self, key: Any, count: int):
+        """Drop the first ``count`` journalled uploads of ``key`` once they were handled."""
+        await self._upload_release_script(
+            keys=[f"{self.UPLOAD_JOURNAL}:{key}", self.UPLOAD_JOURNAL],
+            args=[count, str(key), time.time()],
+        )
+
+    async def claim_stale_uploads(self, min_age: float, limit: int = 100) -> List[Tuple[str, List[str]]]:
+        """Take over journalled batches nobody released within ``min_age`` seconds."""
+        keys = await self.redis.zrangebyscore(self.UPLOAD_JOURNAL, "-inf", time.time() - min_age, start=0, num=limit)
+        claimed = []
+        for key in keys:
+            # MULTI makes the read and delete atomic, so only one process claims a batch
+            async with self.redis.pipeline() as pipe:
+                pipe.lrange(f"{self.UPLOAD_JOURNAL}:{key}", 0, -1)
+                pipe.delete(f"{self.UPLOAD_JOURNAL}:{key}")
+                pipe.zrem(self.UPLOAD_JOURNAL, key)
+                payloads = (await pipe.execute())[0]
+            if payloads:
+                claimed.append((key, payloads))
+        return claimed
+
     async def get_and_delete_upload_session(self, short_id: str) -> Optional[Dict[str, Any]]:
         """Retrieve and delete upload session atomically."""
         # Use getdel if available (Redis 6.2+), else get and del
@@ -255,9 +1397,36 @@ class RedisService:
         return json.loads(data) if data else None
 
     async def close(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
         await self.redis.close()
 
 # Singleton instances
-meili_service = MeilisearchService()
-db_service = DatabaseService()
 redis_service = RedisService()
+meili_service = MeilisearchService(
+    cache=SearchResultCache(
+        redis_service.redis,
+        ttl=config.SEARCH_CACHE_TTL,
+        local_size=config.SEARCH_CACHE_LOCAL_SIZE,
+        local_ttl=config.SEARCH_CACHE_LOCAL_TTL,
+    )
+    if config.SEARCH_CACHE_TTL > 0
+    else None
+)
+db_service = DatabaseService(redis_service)
+indexing_queue = IndexingQueue(
+    meili_service,
+    batch_size=config.INDEX_BATCH_SIZE,
+    flush_interval=config.INDEX_FLUSH_INTERVAL,
+    poll_interval=config.INDEX_TASK_POLL_INTERVAL,
+)
+# Prefetching only pays off when results are cached
+search_prefetcher = (
+    SearchPrefetcher(meili_service, concurrency=config.SEARCH_PREFETCH_CONCURRENCY)
+    if config.SEARCH_PREFETCH and meili_service.cache is not None
+    else None
+)
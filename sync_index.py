@@ -0,0 +1,186 @@
+"""
+Incremental Postgres -> Meilisearch sync.
+
+Pages through `books` rows changed since the stored `(updated_at, id)`
+watermark with keyset queries and sends them to Meilisearch in chunks. This
+keeps `downloads` (used by the "最热" sort) fresh and heals documents whose
+indexing failed at approval time. The search cache is invalidated once per
+pass, and only when searched or filtered fields changed
+(`content_updated_at`); download-count updates alone leave it alone.
+
+    python sync_index.py              # one incremental pass
+    python sync_index.py --loop       # keep syncing every --interval seconds
+    python sync_index.py --full       # rebuild into a shadow index and swap it in
+
+A full rebuild never touches the live index until the shadow copy is loaded
+and configured, so searches keep hitting a complete index throughout.
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from services import meili_service, db_service, redis_service, MeilisearchError, INDEX_SETTINGS
+from utils import build_meili_document
+
+logger = logging.getLogger("sync_index")
+
+Watermark = Tuple[datetime, int]
+
+class IndexSync:
+    def __init__(self, chunk_size: int = 1000, max_pending_tasks: int = 4, task_timeout: float = 600.0, settle: float = 5.0):
+        self.chunk_size = chunk_size
+        self.max_pending_tasks = max_pending_tasks
+        self.task_timeout = task_timeout
+        self.settle = settle
+
+    async def run_pass(self, full: bool = False) -> Dict[str, Any]:
+        if full:
+            return await self.rebuild()
+        started = time.monotonic()
+        since = await redis_service.get_sync_watermark()
+        pending: Deque[Tuple[Watermark, int]] = deque()
+        watermark = since
+        rows = 0
+        content_changed = False
+        try:
+            async for chunk in db_service.iter_changed_books(since, settle=self.settle, chunk_size=self.chunk_size):
+                content_changed = content_changed or self._content_changed(chunk, since)
+                task = await meili_service.update_documents(
+                    [build_meili_document(book) for book in chunk], invalidate=False
+                )
+                pending.append(((chunk[-1]["updated_at"], chunk[-1]["id"]), task["taskUid"]))
+                rows += len(chunk)
+                watermark = await self._drain(pending, self.max_pending_tasks, watermark)
+            watermark = await self._drain(pending, 0, watermark)
+        finally:
+            # After the tasks, so no result computed from the old documents is cached anew
+            if content_changed and meili_service.cache is not None:
+                await meili_service.cache.invalidate()
+        return await self._report("incremental", rows, started, watermark)
+
+    @staticmethod
+    def _content_changed(chunk: List[Dict[str, Any]], since: Optional[Watermark]) -> bool:
+        if since is None:
+            return True
+        return any((book.get("content_updated_at") or since[0]) > since[0] for book in chunk)
+
+    async def rebuild(self) -> Dict[str, Any]:
+        """Load every row into a shadow index, then swap it with the live one."""
+        started = time.monotonic()
+        live = meili_service.index_name
+        shadow = f"{live}_shadow"
+        # Leftover from an interrupted rebuild. Deleting a missing index is
+        # accepted (202) and only fails inside the task, so check first
+        try:
+            await meili_service.get_index(shadow)
+        except MeilisearchError as e:
+            if e.status != 404:
+                raise
+        else:
+            await self._wait(await meili_service.delete_index(shadow))
+        await self._wait(await meili_service.create_index(shadow))
+        await self._wait(await meili_service.update_settings(INDEX_SETTINGS, index_uid=shadow))
+
+        pending: Deque[Tuple[Watermark, int]] = deque()
+        watermark: Optional[Watermark] = None
+        rows = 0
+        async for chunk in db_service.iter_changed_books(None, settle=self.settle, chunk_size=self.chunk_size):
+            task = await meili_service.add_documents([build_meili_document(book) for book in chunk], index_uid=shadow)
+            pending.append(((chunk[-1]["updated_at"], chunk[-1]["id"]), task["taskUid"]))
+            rows += len(chunk)
+            watermark = await self._drain(pending, self.max_pending_tasks, watermark, persist=False)
+        watermark = await self._drain(pending, 0, watermark, persist=False)
+
+        # Swapping needs both indexes to exist
+        try:
+            await meili_service.get_index(live)
+        except MeilisearchError as e:
+            if e.status != 404:
+                raise
+            await self._wait(await meili_service.create_index(live))
+        await self._wait(await meili_service.swap_indexes(live, shadow))
+        logger.info(f"Swapped rebuilt index into '{live}' ({rows} documents)")
+        if meili_service.cache is not None:
+            await meili_service.cache.invalidate()
+        if watermark:
+            # Incremental passes continue from the rebuild snapshot
+            await redis_service.set_sync_watermark(watermark)
+        # The shadow now holds the previous live data
+        await self._wait(await meili_service.delete_index(shadow))
+        return await self._report("full", rows, started, watermark)
+
+    async def _report(self, mode: str, rows: int, started: float, watermark: Optional[Watermark]) -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - started, 1e-6)
+        status = {
+            "mode": mode,
+            "rows": rows,
+            "rows_per_s": round(rows / elapsed, 1),
+            "duration_s": round(elapsed, 3),
+            # Age of the newest change this pass delivered; 0 when nothing was pending
+            "lag_s": round(await db_service.seconds_since(watermark[0]), 3) if rows and watermark else 0.0,
+            "watermark": [watermark[0].isoformat(), watermark[1]] if watermark else None,
+            "finished_at": time.time(),
+        }
+        await redis_service.set_sync_status(status)
+        logger.info(
+            f"Sync pass ({mode}): {rows} rows in {elapsed:.2f}s, "
+            f"{status['rows_per_s']} rows/s, lag {status['lag_s']}s"
+        )
+        return status
+
+    async def _wait(self, task: Dict[str, Any]):
+        result = await meili_service.wait_for_task(task["taskUid"], timeout=self.task_timeout)
+        if result.get("status") != "succeeded":
+            raise MeilisearchError(500, f"Task {task['taskUid']} ({result.get('type')}) {result.get('status')}: {result.get('error')}")
+
+    async def _drain(
+        self,
+        pending: Deque[Tuple[Watermark, int]],
+        keep: int,
+        watermark: Optional[Watermark],
+        persist: bool = True,
+    ) -> Optional[Watermark]:
+        """Wait for the oldest tasks until at most ``keep`` remain, advancing the watermark."""
+        while len(pending) > keep:
+            chunk_watermark, task_uid = pending.popleft()
+            task = await meili_service.wait_for_task(task_uid, timeout=self.task_timeout)
+            if task.get("status") != "succeeded":
+                raise MeilisearchError(500, f"Sync task {task_uid} {task.get('status')}: {task.get('error')}")
+            watermark = chunk_watermark
+            if persist:
+                await redis_service.set_sync_watermark(watermark)
+        return watermark
+
+async def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Sync changed books from Postgres into Meilisearch.")
+    parser.add_argument("--full", action="store_true", help="Rebuild into a shadow index and swap it in")
+    parser.add_argument("--loop", action="store_true", help="Run incremental passes forever")
+    parser.add_argument("--interval", type=float, default=30.0, help="Seconds between passes with --loop")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per cursor fetch and per Meilisearch request")
+    parser.add_argument("--max-pending-tasks", type=int, default=4, help="Unfinished indexing tasks before waiting")
+    parser.add_argument("--task-timeout", type=float, default=600.0, help="Seconds to wait for one indexing task")
+    parser.add_argument("--settle", type=float, default=5.0, help="Skip rows changed in the last N seconds")
+    args = parser.parse_args(argv)
+
+    sync = IndexSync(args.chunk_size, args.max_pending_tasks, args.task_timeout, args.settle)
+    await db_service.connect()
+    try:
+        await sync.run_pass(full=args.full)
+        while args.loop:
+            await asyncio.sleep(args.interval)
+            try:
+                await sync.run_pass()
+            except Exception as e:
+                logger.error(f"Sync pass failed: {e}")
+    finally:
+        await db_service.close()
+        await meili_service.close()
+        await redis_service.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
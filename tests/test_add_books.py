@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+
+from services import DatabaseService
+
+class FakeBooksConn:
+    """Runs the add_books statement against an in-memory books table.
+
+    Both file_id and file_unique_id are unique; ON CONFLICT DO NOTHING skips
+    a row conflicting on either, and the trailing SELECT only sees the rows
+    that existed before the statement.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.queries = []
+
+    async def fetch(self, query, file_ids, unique_ids, names, sizes, titles, authors, tags, uploaders):
+        self.queries.append(" ".join(query.split()))
+        before = list(self.table)
+        rows = []
+        for values in zip(file_ids, unique_ids, names, sizes, titles, authors, tags, uploaders):
+            file_id, unique_id = values[0], values[1]
+            if any(b["file_id"] == file_id or b["file_unique_id"] == unique_id for b in self.table):
+                continue
+            book = dict(zip(
+                ("file_id", "file_unique_id", "file_name", "file_size", "title", "author", "tags", "uploader_id"),
+                values,
+            ))
+            book["tags"] = json.loads(book["tags"])
+            book["id"] = len(self.table) + 1
+            self.table.append(book)
+            rows.append({**book, "inserted": True})
+        for book in before:
+            if book["file_unique_id"] in unique_ids or book["file_id"] in file_ids:
+                rows.append({**book, "inserted": False})
+        return rows
+
+class FakePool:
+    def __init__(self, table):
+        self.conn = FakeBooksConn(table)
+
+    def acquire(self):
+        conn = self.conn
+
+        class Acquire:
+            async def __aenter__(self):
+                return conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+class RecordingDatabaseService(DatabaseService):
+    def __init__(self, table):
+        super().__init__()
+        self.pool = FakePool(table)
+        self.invalidated = []
+
+    async def invalidate_books(self, book_ids):
+        self.invalidated.append(sorted(book_ids))
+
+def book(file_id, unique_id, name=None):
+    return {"file_id": file_id, "file_unique_id": unique_id, "file_name": name or f"{file_id}.pdf", "file_size": 1}
+
+class TestAddBooks(unittest.TestCase):
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_batch_duplicates_on_either_column_are_skipped(self):
+        db = RecordingDatabaseService([])
+        first = book("f1", "u1")
+        same_unique = book("f2", "u1")
+        same_file = book("f1", "u2")
+        other = book("f3", "u3")
+        rows, skipped = self.run_async(db.add_books([first, same_unique, same_file, other]))
+        self.assertEqual(sorted((r["file_id"], r["file_unique_id"]) for r in rows), [("f1", "u1"), ("f3", "u3")])
+        # The very input dicts are reported, so callers can answer their uploaders
+        self.assertEqual(len(skipped), 2)
+        self.assertIs(skipped[0], same_unique)
+        self.assertIs(skipped[1], same_file)
+        self.assertEqual(db.invalidated, [[1, 2]])
+
+    def test_existing_rows_are_returned_and_reported(self):
+        table = [
+            {"id": 1, "file_id": "old-f", "file_unique_id": "u1", "file_name": "a.pdf", "tags": []},
+            {"id": 2, "file_id": "f2", "file_unique_id": "old-u", "file_name": "b.pdf", "tags": []},
+        ]
+        db = RecordingDatabaseService(table)
+        by_unique = book("new-f", "u1")
+        by_file = book("f2", "new-u")
+        fresh = book("f3", "u3")
+        rows, skipped = self.run_async(db.add_books([by_unique, by_file, fresh]))
+        self.assertEqual(sorted(r["id"] for r in rows), [1, 2, 3])
+        self.assertNotIn("inserted", rows[0])
+        self.assertEqual(len(skipped), 2)
+        self.assertIs(skipped[0], by_unique)
+        self.assertIs(skipped[1], by_file)
+        self.assertEqual(len(table), 3)
+        query = db.pool.conn.queries[0]
+        self.assertIn("ON CONFLICT DO NOTHING", query)
+        self.assertIn("b.file_unique_id = ANY($2::text[]) OR b.file_id = ANY($1::text[])", query)
+
+    def test_new_book_sharing_a_unique_id_with_a_stored_one_is_skipped(self):
+        # Inserted rows are matched back by file_unique_id; an input that only
+        # collides on file_id must not be mistaken for the new row
+        table = [{"id": 1, "file_id": "f1", "file_unique_id": "old-u", "file_name": "a.pdf", "tags": []}]
+        db = RecordingDatabaseService(table)
+        clash = book("f1", "u9")
+        rows, skipped = self.run_async(db.add_books([clash]))
+        self.assertEqual([r["id"] for r in rows], [1])
+        self.assertEqual(skipped, [clash])
+
+    def test_empty_batch(self):
+        db = RecordingDatabaseService([])
+        self.assertEqual(self.run_async(db.add_books([])), ([], []))
+        self.assertEqual(db.pool.conn.queries, [])
+
+if __name__ == "__main__":
+    unittest.main()
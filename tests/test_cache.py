@@ -0,0 +1,203 @@
+import unittest
+import asyncio
+import os
+import time
+
+from cache import LRUCache
+
+class FakeRedis:
+    def __init__(self):
+        self._store = {}
+    async def mget(self, *keys):
+        return [self._store.get(k) for k in keys]
+    async def set(self, key, value, ex=None):
+        self._store[key] = value
+    async def incr(self, key):
+        self._store[key] = str(int(self._store.get(key) or 0) + 1)
+        return int(self._store[key])
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction_order(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_ttl_expiry(self):
+        cache = LRUCache(maxsize=4, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+class TestSearchResultCache(unittest.TestCase):
+    def test_invalidation_bumps_generation(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import SearchResultCache
+        cache = SearchResultCache(FakeRedis(), local_size=0)
+        key = cache.make_key("三体", 10, 0)
+        # The key follows the q sent to Meilisearch; normalizing is the caller's job
+        self.assertNotEqual(key, cache.make_key("三體", 10, 0))
+
+        async def scenario():
+            result, gen = await cache.get(key)
+            self.assertIsNone(result)
+            await cache.set(key, gen, {"hits": [{"id": 1}]})
+            result, _ = await cache.get(key)
+            self.assertEqual(result["hits"][0]["id"], 1)
+            await cache.invalidate()
+            result, _ = await cache.get(key)
+            self.assertIsNone(result)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_corrupt_entry_is_a_miss(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import SearchResultCache
+        redis_client = FakeRedis()
+        cache = SearchResultCache(redis_client, local_size=0)
+        key = cache.make_key("三体", 10, 0)
+        redis_client._store[f"search_cache:{key}"] = '{"gen": "0", "result": {"hi'
+
+        loop = asyncio.new_event_loop()
+        try:
+            result, gen = loop.run_until_complete(cache.get(key))
+        finally:
+            loop.close()
+        self.assertIsNone(result)
+        self.assertEqual(gen, "0")
+        self.assertEqual(cache.stats()["errors"], 1)
+
+class TestWriteInvalidation(unittest.TestCase):
+    def test_cache_is_invalidated_after_the_task_succeeds(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import MeilisearchService, SearchResultCache
+        redis_client = FakeRedis()
+        svc = MeilisearchService(cache=SearchResultCache(redis_client, local_size=0))
+        status = {"value": "enqueued"}
+
+        async def fake_request(method, path, payload=None):
+            if path.startswith("/tasks/"):
+                return {"uid": 7, "status": status["value"]}
+            return {"taskUid": 7}
+
+        svc._request = fake_request
+
+        async def scenario():
+            await svc.update_documents([{"id": 1}])
+            await asyncio.sleep(0.05)
+            # Still processing: a search now sees the old index, so the generation must not move yet
+            self.assertIsNone(redis_client._store.get(SearchResultCache.GEN_KEY))
+            status["value"] = "succeeded"
+            await asyncio.sleep(0.6)
+            self.assertEqual(redis_client._store.get(SearchResultCache.GEN_KEY), "1")
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+
+class VersionedFakeRedis(FakeRedis):
+    def register_script(self, script):
+        async def fill(keys, args):
+            if (self._store.get(keys[1]) or "") != args[0]:
+                return 0
+            self._store[keys[0]] = args[1]
+            return 1
+        return fill
+
+    def pipeline(self, transaction=True):
+        store = self._store
+
+        class Pipe:
+            def __init__(self):
+                self.ops = []
+            async def __aenter__(self):
+                return self
+            async def __aexit__(self, *exc):
+                return False
+            def incr(self, key):
+                self.ops.append(lambda: store.__setitem__(key, str(int(store.get(key) or 0) + 1)))
+            def expire(self, key, ttl):
+                pass
+            def delete(self, *keys):
+                self.ops.append(lambda: [store.pop(k, None) for k in keys])
+            async def execute(self):
+                for op in self.ops:
+                    op()
+
+        return Pipe()
+
+class TestBookCacheFill(unittest.TestCase):
+    def test_read_racing_an_invalidation_does_not_fill(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import DatabaseService
+
+        redis_client = VersionedFakeRedis()
+
+        class FakeRedisService:
+            redis = redis_client
+            def register_local_cache(self, namespace, cache):
+                pass
+            async def publish_invalidations(self, namespace, keys):
+                pass
+
+        db = DatabaseService(FakeRedisService())
+        rows = {"value": {"id": 1, "title": "old"}}
+        race = {"on": True}
+
+        class Conn:
+            async def fetchrow(self, query, book_id):
+                row = dict(rows["value"])
+                if race["on"]:
+                    # A writer commits and invalidates while this read is in flight
+                    rows["value"] = {"id": 1, "title": "new"}
+                    await db.invalidate_book(1)
+                return row
+
+        class Acquire:
+            async def __aenter__(self):
+                return Conn()
+            async def __aexit__(self, *exc):
+                return False
+
+        class Pool:
+            def acquire(self):
+                return Acquire()
+
+        db.pool = Pool()
+
+        async def scenario():
+            stale = await db.get_book(1)
+            self.assertEqual(stale["title"], "old")
+            self.assertNotIn("book:1", redis_client._store)
+            self.assertIsNone(db.book_cache.get("1"))
+            race["on"] = False
+            fresh = await db.get_book(1)
+            self.assertEqual(fresh["title"], "new")
+            self.assertIn("book:1", redis_client._store)
+            self.assertEqual(db.book_cache.get("1")["title"], "new")
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+
+if __name__ == "__main__":
+    unittest.main()
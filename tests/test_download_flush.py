@@ -0,0 +1,87 @@
+import asyncio
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+
+from services import DatabaseService
+
+class FakeConn:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def execute(self, query, *args):
+        self.pool.executed.append((" ".join(query.split()), args))
+        if self.pool.fail:
+            raise ConnectionError("connection reset")
+
+class FakePool:
+    def __init__(self):
+        self.executed = []
+        self.fail = False
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                return FakeConn(pool)
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+class RecordingDatabaseService(DatabaseService):
+    def __init__(self):
+        super().__init__()
+        self.pool = FakePool()
+        self.invalidated = []
+
+    async def invalidate_books(self, book_ids):
+        self.invalidated.append(list(book_ids))
+
+class TestDownloadFlush(unittest.TestCase):
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_batch_is_one_update(self):
+        db = RecordingDatabaseService()
+        for book_id in (5, 3, 5, 9, 5, 3):
+            db.record_download(book_id)
+        flushed = self.run_async(db.flush_downloads())
+        self.assertEqual(flushed, 3)
+        self.assertEqual(len(db.pool.executed), 1)
+        query, args = db.pool.executed[0]
+        self.assertIn("unnest", query)
+        self.assertEqual(args, ([3, 5, 9], [2, 3, 1]))
+        self.assertEqual(db.invalidated, [[3, 5, 9]])
+        self.assertEqual(db.stats()["downloads_flushed"], 6)
+        self.assertEqual(self.run_async(db.flush_downloads()), 0)
+        self.assertEqual(len(db.pool.executed), 1)
+
+    def test_failed_update_restores_the_counts(self):
+        db = RecordingDatabaseService()
+        db.record_download(1)
+        db.record_download(1)
+        db.pool.fail = True
+        self.assertEqual(self.run_async(db.flush_downloads()), 0)
+        # Downloads recorded after the failure add up with the restored ones
+        db.record_download(1)
+        db.record_download(2)
+        self.assertEqual(db._pending_downloads, {1: 3, 2: 1})
+        self.assertEqual(db.stats()["download_flush_failures"], 1)
+        self.assertEqual(db.invalidated, [])
+
+        db.pool.fail = False
+        self.assertEqual(self.run_async(db.flush_downloads()), 2)
+        self.assertEqual(db.pool.executed[-1][1], ([1, 2], [3, 1]))
+        self.assertEqual(db._pending_downloads, {})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+
+import import_books
+
+class FakeDB:
+    def __init__(self):
+        self.batches = []
+
+    async def import_books(self, records):
+        self.batches.append([record[1] for record in records])
+        return [
+            {"id": i, "file_id": r[0], "file_unique_id": r[1], "file_name": r[2], "file_size": r[3]}
+            for i, r in enumerate(records)
+        ]
+
+class FakeMeili:
+    cache = None
+
+    def __init__(self, statuses=None):
+        self.statuses = statuses or {}
+        self.sent = []
+        self.waited = []
+
+    async def add_documents(self, documents, index_uid=None, invalidate=True):
+        self.sent.append([doc["file_unique_id"] for doc in documents])
+        return {"taskUid": len(self.sent)}
+
+    async def wait_for_task(self, task_uid, timeout=60.0, interval=0.2):
+        self.waited.append(task_uid)
+        return {"uid": task_uid, "status": self.statuses.get(task_uid, "succeeded")}
+
+def record(n):
+    return {"file_id": f"f{n}", "file_unique_id": f"u{n}", "file_name": f"{n}.txt"}
+
+class TestImporter(unittest.TestCase):
+    def setUp(self):
+        self._saved = (import_books.db_service, import_books.meili_service)
+        self.db, self.meili = FakeDB(), FakeMeili()
+        import_books.db_service, import_books.meili_service = self.db, self.meili
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        import_books.db_service, import_books.meili_service = self._saved
+        self.tmp.cleanup()
+
+    def write_manifest(self, lines):
+        path = os.path.join(self.tmp.name, "books.ndjson")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def importer(self, manifest, batch_size=2):
+        args = argparse.Namespace(
+            manifest=manifest,
+            format=None,
+            checkpoint=os.path.join(self.tmp.name, "books.ckpt"),
+            batch_size=batch_size,
+            meili_batch_size=10,
+            max_pending_tasks=4,
+            task_timeout=1.0,
+        )
+        return import_books.Importer(args)
+
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_resume_skips_checkpointed_records(self):
+        manifest = self.write_manifest([json.dumps(record(n)) for n in range(1, 6)])
+        # The first run fails on its second indexing task
+        self.meili.statuses = {2: "failed"}
+        with self.assertRaises(import_books.MeilisearchError):
+            self.run_async(self.importer(manifest).run())
+        checkpoint = os.path.join(self.tmp.name, "books.ckpt")
+        self.assertEqual(import_books.load_checkpoint(checkpoint, manifest), 2)
+
+        self.db.batches.clear()
+        self.meili.statuses = {}
+        importer = self.importer(manifest)
+        self.run_async(importer.run())
+        self.assertEqual(self.db.batches, [["u3", "u4"], ["u5"]])
+        self.assertEqual(importer.done, 5)
+
+    def test_malformed_rows_are_skipped_and_reported(self):
+        manifest = self.write_manifest([
+            json.dumps(record(1)),
+            "{not json",
+            json.dumps(["a", "list"]),
+            json.dumps({"file_name": "no ids.txt"}),
+            json.dumps(record(2)),
+        ])
+        importer = self.importer(manifest, batch_size=10)
+        with self.assertLogs("import_books", level="WARNING") as logs:
+            self.run_async(importer.run())
+        self.assertEqual(self.db.batches, [["u1", "u2"]])
+        self.assertEqual(importer.skipped, 3)
+        self.assertEqual(importer.done, 5)
+        self.assertEqual(sum("Skipping record" in line for line in logs.output), 3)
+        self.assertIn("record 2", logs.output[0])
+
+if __name__ == "__main__":
+    unittest.main()
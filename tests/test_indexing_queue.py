@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+
+from services import IndexingQueue
+
+class FakeCache:
+    def __init__(self):
+        self.invalidations = 0
+
+    async def invalidate(self):
+        self.invalidations += 1
+
+class FakeMeili:
+    def __init__(self):
+        self.cache = FakeCache()
+        self.batches = []
+        self.statuses = {}
+        self.failures = 0
+
+    async def add_documents(self, documents, index_uid=None, invalidate=True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("meilisearch unavailable")
+        self.batches.append([doc["id"] for doc in documents])
+        uid = len(self.batches)
+        self.statuses[uid] = "enqueued"
+        return {"taskUid": uid}
+
+    async def get_tasks(self, task_uids):
+        return [{"uid": uid, "status": self.statuses[uid]} for uid in task_uids]
+
+def docs(*ids, title="t"):
+    return [{"id": i, "title": title} for i in ids]
+
+class TestIndexingQueue(unittest.TestCase):
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_full_batch_flushes_before_the_interval(self):
+        meili = FakeMeili()
+
+        async def scenario():
+            queue = IndexingQueue(meili, batch_size=3, flush_interval=10.0, poll_interval=10.0)
+            queue.start()
+            queue.enqueue(docs(1, 2))
+            await asyncio.sleep(0.02)
+            self.assertEqual(meili.batches, [])
+            queue.enqueue(docs(3))
+            await asyncio.sleep(0.02)
+            self.assertEqual(meili.batches, [[1, 2, 3]])
+            meili.statuses[1] = "succeeded"
+            await queue.close(timeout=0.1)
+
+        self.run_async(scenario())
+
+    def test_partial_batch_flushes_after_the_interval(self):
+        meili = FakeMeili()
+
+        async def scenario():
+            queue = IndexingQueue(meili, batch_size=100, flush_interval=0.03, poll_interval=10.0)
+            queue.start()
+            queue.enqueue(docs(1, 1, 2))
+            await asyncio.sleep(0.06)
+            self.assertEqual(meili.batches, [[1, 2]])
+            meili.statuses[1] = "succeeded"
+            await queue.close(timeout=0.1)
+
+        self.run_async(scenario())
+
+    def test_polling_counts_finished_tasks_and_invalidates_once(self):
+        meili = FakeMeili()
+
+        async def scenario():
+            queue = IndexingQueue(meili, batch_size=2)
+            queue.enqueue(docs(1, 2, 3, 4, 5))
+            await queue.flush()
+            meili.statuses.update({1: "succeeded", 2: "failed"})
+            await queue.poll_tasks()
+            return queue.stats()
+
+        stats = self.run_async(scenario())
+        self.assertEqual(stats["indexed"], 2)
+        self.assertEqual(stats["failed_tasks"], 1)
+        self.assertEqual(stats["pending_tasks"], 1)
+        self.assertEqual(stats["depth"], 1)
+        self.assertEqual(meili.cache.invalidations, 1)
+
+    def test_failed_flush_keeps_docs_and_their_age(self):
+        meili = FakeMeili()
+        meili.failures = 1
+
+        async def scenario():
+            queue = IndexingQueue(meili, batch_size=2)
+            queue.enqueue(docs(1, 2, 3))
+            enqueued_at = time.monotonic()
+            await asyncio.sleep(0.05)
+            await queue.flush()
+            self.assertEqual(meili.batches, [])
+            # A newer version arriving meanwhile is the one that gets sent
+            queue.enqueue(docs(2, 4, title="new"))
+            lag = queue.lag()
+            await queue.flush()
+            return enqueued_at, lag, queue
+
+        enqueued_at, lag, queue = self.run_async(scenario())
+        # Loop timers may fire a little early
+        self.assertGreaterEqual(lag, 0.04)
+        self.assertEqual(meili.batches, [[1, 2], [3, 4]])
+        oldest, _ = queue._tasks[1]
+        self.assertLessEqual(oldest, enqueued_at)
+
+    def test_partial_flush_keeps_the_age_of_what_is_left(self):
+        meili = FakeMeili()
+
+        async def scenario():
+            queue = IndexingQueue(meili, batch_size=2)
+            queue.enqueue(docs(1, 2, 3))
+            await asyncio.sleep(0.05)
+            # Only one batch gets through; doc 3 stays buffered
+            original = meili.add_documents
+            calls = {"n": 0}
+
+            async def one_batch(documents, index_uid=None, invalidate=True):
+                calls["n"] += 1
+                if calls["n"] > 1:
+                    raise ConnectionError("meilisearch unavailable")
+                return await original(documents, index_uid, invalidate)
+
+            meili.add_documents = one_batch
+            await queue.flush()
+            meili.statuses[1] = "succeeded"
+            await queue.poll_tasks()
+            return queue.lag(), queue.stats()["buffered"]
+
+        lag, buffered = self.run_async(scenario())
+        self.assertEqual(buffered, 1)
+        # Loop timers may fire a little early
+        self.assertGreaterEqual(lag, 0.04)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+
+from inline_search import InlineSearcher
+
+class TestInlineSearcher(unittest.TestCase):
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_keystrokes_are_debounced_and_pages_cached(self):
+        calls = []
+
+        async def search(query, limit, offset, filter, plan_key):
+            calls.append((query, offset))
+            return {"hits": [{"id": offset + i} for i in range(limit)], "estimatedTotalHits": 25}
+
+        searcher = InlineSearcher(search, page_size=10, debounce=0.02)
+
+        async def scenario():
+            typing = [searcher.query(1, text) for text in ("三", "三体", "三体 ")]
+            pages = await asyncio.gather(*typing, searcher.query(2, "三"))
+            more = await searcher.query(1, "三体", offset=pages[2].next_offset)
+            last = await searcher.query(1, "三体", offset="20")
+            again = await searcher.query(3, " 《三體》")
+            return pages, more, last, again
+
+        pages, more, last, again = self.run_async(scenario())
+        self.assertIsNone(pages[0])
+        self.assertIsNone(pages[1])
+        self.assertEqual(pages[2].next_offset, "10")
+        self.assertEqual(more.hits[0]["id"], 10)
+        self.assertEqual(last.next_offset, "")
+        self.assertIs(again, pages[2])
+        self.assertEqual(calls, [("三体", 0), ("三", 0), ("三体", 10), ("三体", 20)])
+        self.assertEqual(searcher.stats()["debounced"], 2)
+
+    def test_slow_search_answers_empty_and_fills_cache(self):
+        calls = []
+
+        async def search(query, limit, offset, filter, plan_key):
+            calls.append(query)
+            await asyncio.sleep(0.05)
+            return {"hits": [{"id": 1}], "estimatedTotalHits": 1}
+
+        searcher = InlineSearcher(search, debounce=0, budget=0.01)
+
+        async def scenario():
+            first = await searcher.query(1, "x")
+            await asyncio.sleep(0.08)
+            return first, await searcher.query(1, "x")
+
+        first, retry = self.run_async(scenario())
+        self.assertEqual(first.hits, [])
+        self.assertTrue(first.timed_out)
+        self.assertFalse(retry.timed_out)
+        self.assertEqual(retry.hits, [{"id": 1}])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(searcher.stats()["timeouts"], 1)
+
+    def test_plan_is_resolved_only_after_the_debounce(self):
+        planned = []
+        seen = []
+
+        async def search(query, limit, offset, filter, plan_key):
+            seen.append((query, filter))
+            return {"hits": [], "estimatedTotalHits": 0}
+
+        def plan_for(text):
+            async def plan():
+                planned.append(text)
+                return "content_rating <= 0", f"rated:{text}"
+            return plan
+
+        searcher = InlineSearcher(search, debounce=0.02)
+
+        async def scenario():
+            typing = [searcher.query(1, text, plan=plan_for(text)) for text in ("a", "ab", "abc")]
+            return await asyncio.gather(*typing)
+
+        pages = self.run_async(scenario())
+        self.assertEqual([page is None for page in pages], [True, True, False])
+        self.assertEqual(planned, ["abc"])
+        self.assertEqual(seen, [("abc", "content_rating <= 0")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
-from keyboards import get_search_keyboard, get_book_detail_keyboard, get_filter_menu_keyboard, get_settings_keyboard
+from keyboards import (
+    get_search_keyboard, get_book_detail_keyboard, get_filter_menu_keyboard, get_settings_keyboard,
+    get_batch_moderation_keyboard, drop_moderation_item,
+)
 
 class TestKeyboards(unittest.TestCase):
     def test_search_keyboard_layout(self):
@@ -17,12 +20,24 @@ class TestKeyboards(unittest.TestCase):
         self.assertEqual(rows[6][0].text, "·")
         self.assertEqual(rows[6][2].text, ">")
 
+    def test_search_keyboard_keeps_every_book(self):
+        kb = get_search_keyboard(current_page=0, total_pages=1, book_ids=list(range(20)))
+        selected = [b.callback_data for row in kb.inline_keyboard for b in row if b.callback_data.startswith("sel:")]
+        self.assertEqual(selected, [f"sel:{i}" for i in range(20)])
+        self.assertEqual([len(row) for row in kb.inline_keyboard[-4:-1]], [3, 3, 1])
+
     def test_search_keyboard_page_picker_layout(self):
         kb = get_search_keyboard(current_page=0, total_pages=50, book_ids=list(range(10)), mode="page_picker")
         rows = kb.inline_keyboard
         self.assertGreaterEqual(len(rows), 2)
         self.assertEqual(len(rows[-1]), 5)
 
+    def test_filter_menu_keyboard_counts(self):
+        kb = get_filter_menu_keyboard("rating", {"rating": "R15"}, counts={"ALL": 1200, "G": 4, "R15": 9})
+        labels = [b.text for b in kb.inline_keyboard[0] + kb.inline_keyboard[1]]
+        self.assertEqual(labels, ["全部(999+)", "全年龄(4)", "·R15(9)·", "R18(0)"])
+        self.assertEqual(kb.inline_keyboard[1][0].callback_data, "flt:rating:R15")
+
     def test_detail_keyboard(self):
         kb = get_book_detail_keyboard(123)
         rows = kb.inline_keyboard
@@ -41,5 +56,26 @@ class TestKeyboards(unittest.TestCase):
         rows = kb.inline_keyboard
         self.assertEqual(len(rows), 6)
 
+    def test_static_parts_are_memoized(self):
+        a = get_search_keyboard(current_page=1, total_pages=5, book_ids=[1, 2], sort="hot", filters={"format": "PDF"})
+        b = get_search_keyboard(current_page=1, total_pages=5, book_ids=[3, 4], sort="hot", filters={"format": "PDF"})
+        self.assertIs(a.inline_keyboard[1][0], b.inline_keyboard[1][0])
+        self.assertEqual(b.inline_keyboard[3][0].callback_data, "sel:3")
+        self.assertEqual(a.inline_keyboard[1][1].text, "格式:PDF▾")
+        self.assertIs(get_filter_menu_keyboard("format", {"format": "PDF"}), get_filter_menu_keyboard("format", {"format": "PDF"}))
+        self.assertIs(get_settings_keyboard({}), get_settings_keyboard({"hide_personal_info": True}))
+
+    def test_batch_moderation_keyboard(self):
+        kb = get_batch_moderation_keyboard("b1", ["s1", "s2"])
+        rows = kb.inline_keyboard
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0][0].callback_data, "mod_all:a:b1")
+        self.assertEqual(rows[2][1].callback_data, "mod_item:r:s2")
+
+        kb = drop_moderation_item(kb, "s1")
+        self.assertEqual(len(kb.inline_keyboard), 2)
+        self.assertEqual(kb.inline_keyboard[1][0].callback_data, "mod_item:a:s2")
+        self.assertIsNone(drop_moderation_item(kb, "s2"))
+
 if __name__ == "__main__":
     unittest.main()
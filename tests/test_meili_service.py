@@ -0,0 +1,293 @@
+import unittest
+import asyncio
+import os
+
+class TestSearchCoalescing(unittest.TestCase):
+    def test_identical_searches_share_one_request(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import MeilisearchService
+        svc = MeilisearchService()
+        calls = []
+
+        async def fake_request(method, path, payload=None):
+            calls.append(payload["q"])
+            await asyncio.sleep(0.01)
+            return {"hits": [{"id": 1}], "estimatedTotalHits": 1}
+
+        svc._request = fake_request
+
+        async def scenario():
+            return await asyncio.gather(
+                *[svc.search("三体", offset=0) for _ in range(5)],
+                svc.search("三体", offset=10),
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(results[0]["hits"][0]["id"], 1)
+        self.assertEqual(svc.stats()["coalesced_searches"], 4)
+        self.assertEqual(svc.stats()["in_flight"], 0)
+
+    def test_cached_result_matches_the_query_sent(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import MeilisearchService, SearchResultCache
+        from fakeredis import aioredis as fake_aioredis
+        svc = MeilisearchService()
+        svc.cache = SearchResultCache(fake_aioredis.FakeRedis(decode_responses=True), local_size=0)
+        calls = []
+
+        async def fake_request(method, path, payload=None):
+            calls.append(payload["q"])
+            return {"hits": [{"id": payload["q"]}], "estimatedTotalHits": 1}
+
+        svc._request = fake_request
+
+        async def scenario():
+            # Tag searches send the tag verbatim, so spellings must not share an entry
+            first = await svc.search("Sci-Fi")
+            second = await svc.search("sci-fi")
+            again = await svc.search("Sci-Fi")
+            return first, second, again
+
+        loop = asyncio.new_event_loop()
+        try:
+            first, second, again = loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(calls, ["Sci-Fi", "sci-fi"])
+        self.assertEqual(second["hits"][0]["id"], "sci-fi")
+        self.assertEqual(again["hits"][0]["id"], "Sci-Fi")
+
+class TestFacetedSearch(unittest.TestCase):
+    def test_hits_and_facets_share_one_multi_search(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import MeilisearchService
+        from query_planner import plan_facets, plan_search
+        svc = MeilisearchService()
+        calls = []
+
+        async def fake_request(method, path, payload=None):
+            calls.append(path)
+            await asyncio.sleep(0.01)
+            if path != "/multi-search":
+                return {"hits": [{"id": 1}], "estimatedTotalHits": 3}
+            distribution = {
+                "ext": {"PDF": 3},
+                "content_rating": {"0": 3},
+                "size_bucket": {"<5MB": 1, "5-20MB": 2},
+                "words_bucket": {"<10万": 3},
+            }
+            # No selection: every menu is counted from the main query
+            self.assertEqual(len(payload["queries"]), 1)
+            self.assertEqual(payload["queries"][0]["facets"], list(distribution))
+            return {"results": [{"hits": [{"id": 1}], "estimatedTotalHits": 3, "facetDistribution": distribution}]}
+
+        svc._request = fake_request
+        plan = plan_search("三体")
+        facets = plan_facets("三体")
+
+        async def scenario():
+            return await asyncio.gather(
+                svc.search("三体", plan_key=plan.key, facets=facets),
+                svc.search("三体", plan_key=plan.key, facets=facets),
+                svc.search("三体", plan_key=plan.key),
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            first, second, plain = loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(sorted(calls), ["/indexes/books/search", "/multi-search"])
+        self.assertEqual(first["hits"][0]["id"], 1)
+        self.assertEqual(first["facet_counts"]["format"], {"ALL": 3, "PDF": 3})
+        self.assertEqual(first["facet_counts"]["size"], {"ALL": 3, "<5MB": 1, "5-20MB": 2, "20-50MB": 0, ">50MB": 0})
+        self.assertIs(second, first)
+        self.assertNotIn("facet_counts", plain)
+
+class FakeResponse:
+    def __init__(self, status, body=b"", content_type="application/json", reason="OK"):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.reason = reason
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def read(self):
+        return self.body
+
+class FakeSession:
+    """Stands in for aiohttp.ClientSession; replies are popped in order."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = []
+        self.closed = False
+
+    def request(self, method, url, json=None):
+        self.calls.append((method, url, json))
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    async def close(self):
+        self.closed = True
+
+class TestMeiliClient(unittest.TestCase):
+    def setUp(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import MeilisearchService
+        self.svc = MeilisearchService()
+
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_error_status_maps_to_meilisearch_error(self):
+        from services import MeilisearchError
+        body = b'{"message": "Index `x` not found.", "code": "index_not_found"}'
+        self.svc._session = FakeSession([
+            FakeResponse(404, body, reason="Not Found"),
+            FakeResponse(500, b"boom", "text/plain", "Server Error"),
+        ])
+
+        with self.assertRaises(MeilisearchError) as caught:
+            self.run_async(self.svc.get_index("x"))
+        self.assertEqual((caught.exception.status, caught.exception.code), (404, "index_not_found"))
+        with self.assertRaises(MeilisearchError) as caught:
+            self.run_async(self.svc.delete_index("x"))
+        self.assertEqual((caught.exception.status, caught.exception.code), (500, None))
+
+    def test_reads_are_retried_and_writes_are_not(self):
+        import aiohttp
+        from config import config
+        from services import MeilisearchError
+        config.MEILI_RETRY_BACKOFF, saved = 0.0, config.MEILI_RETRY_BACKOFF
+        try:
+            self.svc._session = FakeSession([
+                aiohttp.ServerDisconnectedError(),
+                FakeResponse(503, b"{}"),
+                FakeResponse(200, b'{"hits": [], "estimatedTotalHits": 0}'),
+                FakeResponse(503, b"{}"),
+            ])
+            result = self.run_async(self.svc.search("三体"))
+            self.assertEqual(result["estimatedTotalHits"], 0)
+            self.assertEqual(len(self.svc._session.calls), 3)
+            with self.assertRaises(MeilisearchError):
+                self.run_async(self.svc.add_documents([{"id": 1}], invalidate=False))
+            self.assertEqual(len(self.svc._session.calls), 4)
+        finally:
+            config.MEILI_RETRY_BACKOFF = saved
+
+    def test_session_is_created_lazily_and_closed(self):
+        async def scenario():
+            self.assertIsNone(self.svc._session)
+            session = self.svc._get_session()
+            self.assertIs(self.svc._get_session(), session)
+            await self.svc.close()
+            self.assertTrue(session.closed)
+            # A closed session is replaced on next use
+            fresh = self.svc._get_session()
+            await self.svc.close()
+            return session, fresh
+
+        session, fresh = self.run_async(scenario())
+        self.assertIsNot(session, fresh)
+
+    def test_close_cancels_inflight_searches(self):
+        async def scenario():
+            gate = asyncio.Event()
+
+            async def slow_request(method, path, payload=None):
+                gate.set()
+                await asyncio.sleep(10)
+
+            self.svc._request = slow_request
+            search = asyncio.create_task(self.svc.search("三体"))
+            await gate.wait()
+            await self.svc.close()
+            with self.assertRaises(asyncio.CancelledError):
+                await search
+            return self.svc.stats()["in_flight"]
+
+        self.assertEqual(self.run_async(scenario()), 0)
+
+class TestSearchPrefetcher(unittest.TestCase):
+    def test_saturated_prefetches_are_dropped_not_queued(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import MeilisearchService, SearchPrefetcher
+        svc = MeilisearchService()
+        calls = []
+
+        async def fake_request(method, path, payload=None):
+            calls.append(payload["q"])
+            await asyncio.sleep(0.05)
+            return {"hits": [], "estimatedTotalHits": 0}
+
+        svc._request = fake_request
+        prefetcher = SearchPrefetcher(svc, concurrency=2)
+
+        async def scenario():
+            for user_id in range(5):
+                prefetcher.schedule(user_id, f"q{user_id}", limit=10, offset=10)
+            self.assertEqual(prefetcher.stats()["in_flight"], 2)
+            self.assertEqual(prefetcher.stats()["dropped"], 3)
+            prefetcher.cancel(0)
+            await asyncio.sleep(0.01)
+            prefetcher.schedule(9, "q9", limit=10, offset=10)
+            await asyncio.sleep(0.1)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(sorted(calls), ["q1", "q9"])
+        self.assertEqual(prefetcher.stats()["cancelled"], 1)
+        self.assertEqual(prefetcher.stats()["in_flight"], 0)
+
+class TestSettingsDiff(unittest.TestCase):
+    def test_only_changed_settings_are_sent(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import INDEX_SETTINGS, settings_diff
+        current = {
+            "searchableAttributes": list(INDEX_SETTINGS["searchableAttributes"]),
+            "filterableAttributes": sorted(INDEX_SETTINGS["filterableAttributes"]),
+            "sortableAttributes": sorted(INDEX_SETTINGS["sortableAttributes"]),
+            "rankingRules": list(INDEX_SETTINGS["rankingRules"]),
+            "typoTolerance": {
+                "enabled": True,
+                "minWordSizeForTypos": {"oneTypo": 5, "twoTypos": 9},
+                "disableOnWords": [],
+            },
+            "pagination": {"maxTotalHits": 1000},
+        }
+        self.assertEqual(settings_diff(INDEX_SETTINGS, current), {})
+
+        current["pagination"] = {"maxTotalHits": 500}
+        current["rankingRules"] = list(reversed(current["rankingRules"]))
+        diff = settings_diff(INDEX_SETTINGS, current)
+        self.assertEqual(set(diff), {"pagination", "rankingRules"})
+        self.assertEqual(diff["pagination"], {"maxTotalHits": 1000})
+
+if __name__ == "__main__":
+    unittest.main()
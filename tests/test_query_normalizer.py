@@ -0,0 +1,24 @@
+import unittest
+
+from query_normalizer import iter_query_log, measure_dedup, normalize_query
+
+class TestQueryNormalizer(unittest.TestCase):
+    def test_variants_share_one_form(self):
+        variants = ["三体", " 三体 ", "三體", "《三体》", "三体.epub", "三体．ＰＤＦ", "　三體　"]
+        self.assertEqual({normalize_query(v) for v in variants}, {"三体"})
+        self.assertEqual(normalize_query("Ｈａｒｒｙ  POTTER.txt"), "harry potter")
+        self.assertEqual(normalize_query("node.js 实战"), "node.js 实战")
+        self.assertEqual(normalize_query(".pdf"), "")
+
+    def test_measure_dedup(self):
+        log = ["三体\n", "三體\n", " 三体\n", "\n", '{"query": "《三体》"}\n', "流浪地球\n"]
+        result = measure_dedup(iter_query_log(log))
+        self.assertEqual(result["queries"], 5)
+        self.assertEqual(result["distinct_raw"], 5)
+        self.assertEqual(result["distinct_basic"], 4)
+        self.assertEqual(result["distinct_normalized"], 2)
+        self.assertEqual(result["dedup_ratio"], 0.6)
+        self.assertEqual(result["merged"][0][0], "三体")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from query_planner import (
+    SIZE_RANGES, WORD_RANGES, bucket_of, collect_facets, plan_facets, plan_search, plan_cache_stats,
+)
+
+class TestQueryPlanner(unittest.TestCase):
+    def test_compiles_filters_and_sort(self):
+        plan = plan_search("三体", filters={"words": "10-50万", "format": "PDF", "rating": "R15", "size": "<5MB"}, sort="hot")
+        self.assertEqual(
+            plan.filter,
+            'ext = "PDF" AND content_rating <= 1 AND file_size < 5242880 AND word_count >= 100000 AND word_count < 500000',
+        )
+        self.assertEqual(plan.sort_list, ["downloads:desc"])
+
+    def test_defaults_and_unknown_values(self):
+        plan = plan_search("x", filters={"format": "ALL", "rating": "NC17", "size": "huge"}, sort="bogus")
+        self.assertIsNone(plan.filter)
+        self.assertIsNone(plan.sort_list)
+        self.assertEqual(plan.key, plan_search("y").key)
+
+    def test_tag_is_escaped(self):
+        plan = plan_search('科幻" OR tags = "x\\', filter_type="tags")
+        self.assertEqual(plan.filter, 'tags = "科幻\\" OR tags = \\"x\\\\"')
+
+    def test_key_is_canonical_and_plans_are_memoized(self):
+        a = plan_search("q", filters={"size": "<5MB", "format": "EPUB"}, sort="new")
+        before = plan_cache_stats()["hits"]
+        b = plan_search("other", filters={"format": "EPUB", "size": "<5MB", "words": "ALL"}, sort="new")
+        self.assertIs(a, b)
+        self.assertEqual(plan_cache_stats()["hits"], before + 1)
+        self.assertNotEqual(a.key, plan_search("q", filters={"format": "EPUB"}, sort="new").key)
+        self.assertNotEqual(plan_search("科幻", filter_type="tags").key, plan_search("历史", filter_type="tags").key)
+
+    def test_facet_counts_ignore_own_selection(self):
+        facets = plan_facets("q", filters={"format": "PDF", "size": "<5MB"})
+        self.assertEqual(facets.main_attributes, ("content_rating", "words_bucket"))
+        by_facet = {fq.facet: fq for fq in facets.queries}
+        self.assertEqual(sorted(by_facet), ["format", "size"])
+        self.assertEqual(by_facet["format"].filter, "file_size < 5242880")
+        self.assertEqual(by_facet["format"].attributes, ("ext",))
+        self.assertEqual(by_facet["size"].filter, 'ext = "PDF"')
+        self.assertEqual(by_facet["size"].attributes, ("size_bucket",))
+        self.assertEqual(facets.key, plan_facets("q", filters={"size": "<5MB", "format": "PDF"}).key)
+
+        main = {
+            "estimatedTotalHits": 7,
+            "facetDistribution": {"content_rating": {"0": 4, "2": 3}, "words_bucket": {"<10万": 6, ">100万": 1}},
+        }
+        results = [
+            {"estimatedTotalHits": 30, "facetDistribution": {"ext": {"pdf": 12, "EPUB": 18}}},
+            {"estimatedTotalHits": 12, "facetDistribution": {"size_bucket": {"<5MB": 7, ">50MB": 5}}},
+        ]
+        counts = collect_facets(facets, main, results)
+        self.assertEqual(counts["format"], {"ALL": 30, "PDF": 12, "EPUB": 18})
+        self.assertEqual(counts["rating"], {"ALL": 7, "G": 4, "R15": 4, "R18": 7})
+        self.assertEqual(counts["size"], {"ALL": 12, "<5MB": 7, "5-20MB": 0, "20-50MB": 0, ">50MB": 5})
+        self.assertEqual(counts["words"], {"ALL": 7, "<10万": 6, "10-50万": 0, "50-100万": 0, ">100万": 1})
+
+    def test_unfiltered_search_needs_no_facet_queries(self):
+        facets = plan_facets("q")
+        self.assertEqual(facets.queries, ())
+        self.assertEqual(facets.main_attributes, ("ext", "content_rating", "size_bucket", "words_bucket"))
+
+    def test_buckets_match_range_filters(self):
+        self.assertEqual(bucket_of(None, SIZE_RANGES), "<5MB")
+        self.assertEqual(bucket_of(5 * 1024 * 1024, SIZE_RANGES), "5-20MB")
+        self.assertEqual(bucket_of(10 ** 9, SIZE_RANGES), ">50MB")
+        self.assertEqual(bucket_of(99999, WORD_RANGES), "<10万")
+        self.assertEqual(bucket_of(1000000, WORD_RANGES), ">100万")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, AnswerInlineQuery, GetMe, SendMessage
+
+from ratelimit import (
+    OutboundLimiter, RateLimitMiddleware, TokenBucket, low_priority, NOTIFICATION, INTERACTIVE,
+)
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+class TestTokenBucket(unittest.TestCase):
+    def test_reserve_spaces_out_calls_after_burst(self):
+        bucket = TokenBucket(rate=2.0, capacity=2)
+        now = bucket.updated
+        self.assertEqual(bucket.reserve(now), 0.0)
+        self.assertEqual(bucket.reserve(now), 0.0)
+        self.assertAlmostEqual(bucket.reserve(now), 0.5)
+        self.assertAlmostEqual(bucket.reserve(now), 1.0)
+
+class TestOutboundLimiter(unittest.TestCase):
+    def test_interactive_calls_overtake_notifications(self):
+        limiter = OutboundLimiter(global_rate=50.0)
+        limiter.global_bucket.tokens = 0
+        order = []
+
+        async def call(name, priority):
+            await limiter.acquire(priority=priority)
+            order.append(name)
+
+        async def scenario():
+            tasks = [asyncio.create_task(call(f"n{i}", NOTIFICATION)) for i in range(3)]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.create_task(call("reply", INTERACTIVE)))
+            await asyncio.gather(*tasks)
+
+        run(scenario())
+        self.assertEqual(order[0], "reply")
+        self.assertEqual(sorted(order[1:]), ["n0", "n1", "n2"])
+        self.assertEqual(limiter.stats()["queue_depth"], 0)
+        self.assertEqual(limiter.stats()["throttled"], 4)
+
+    def test_low_priority_context(self):
+        limiter = OutboundLimiter(global_rate=50.0)
+        limiter.global_bucket.tokens = 0
+        order = []
+
+        async def call(name, low):
+            if low:
+                with low_priority():
+                    await limiter.acquire()
+            else:
+                await limiter.acquire()
+            order.append(name)
+
+        async def scenario():
+            first = asyncio.create_task(call("notice", True))
+            await asyncio.sleep(0)
+            await asyncio.gather(first, call("reply", False))
+
+        run(scenario())
+        self.assertEqual(order, ["reply", "notice"])
+
+    def test_retry_after_is_retried(self):
+        limiter = OutboundLimiter(global_rate=100.0)
+        middleware = RateLimitMiddleware(limiter, max_retries=2)
+        method = SendMessage(chat_id=1, text="hi")
+        calls = []
+
+        async def make_request(bot, method):
+            calls.append(method)
+            if len(calls) == 1:
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+            return "ok"
+
+        self.assertEqual(run(middleware(make_request, None, method)), "ok")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(limiter.stats()["retry_after"], 1)
+
+    def test_query_answers_skip_the_limiter(self):
+        limiter = OutboundLimiter(global_rate=1.0)
+        limiter.global_bucket.tokens = 0
+        middleware = RateLimitMiddleware(limiter)
+
+        async def make_request(bot, method):
+            return "ok"
+
+        async def scenario():
+            methods = [AnswerCallbackQuery(callback_query_id="1"), AnswerInlineQuery(inline_query_id="2", results=[])]
+            return await asyncio.wait_for(asyncio.gather(*(middleware(make_request, None, m) for m in methods)), 0.5)
+
+        self.assertEqual(run(scenario()), ["ok", "ok"])
+        self.assertEqual(limiter.acquired, 0)
+
+    def test_chatless_flood_wait_only_holds_that_method(self):
+        limiter = OutboundLimiter(global_rate=100.0)
+        middleware = RateLimitMiddleware(limiter)
+        calls = []
+
+        async def make_request(bot, method):
+            calls.append(type(method).__name__)
+            if calls.count("GetMe") == 1 and isinstance(method, GetMe):
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+            return "ok"
+
+        async def scenario():
+            get_me = asyncio.create_task(middleware(make_request, None, GetMe()))
+            await asyncio.sleep(0.05)
+            started = time.monotonic()
+            await middleware(make_request, None, SendMessage(chat_id=1, text="hi"))
+            send_wait = time.monotonic() - started
+            blocked = not get_me.done()
+            await get_me
+            return send_wait, blocked
+
+        send_wait, blocked = run(scenario())
+        self.assertLess(send_wait, 0.5)
+        self.assertTrue(blocked)
+        self.assertEqual(calls, ["GetMe", "SendMessage", "GetMe"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -37,6 +37,31 @@ class FakeRedis:
     async def close(self):
         pass
 
+class RecordingPipeline:
+    def __init__(self, store):
+        self.store = store
+        self.ops = []
+    async def __aenter__(self):
+        return self
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+    def getdel(self, key):
+        self.ops.append(lambda: self.store.pop(key, None))
+    def get(self, key):
+        self.ops.append(lambda: self.store.get(key))
+    def delete(self, *keys):
+        self.ops.append(lambda: sum(self.store.pop(k, None) is not None for k in keys))
+    async def execute(self):
+        return [op() for op in self.ops]
+
+class BulkFakeRedis:
+    def __init__(self, store):
+        self.store = store
+        self.pipelines = 0
+    def pipeline(self, transaction=True):
+        self.pipelines += 1
+        return RecordingPipeline(self.store)
+
 class TestRedisFallback(unittest.TestCase):
     def test_getdel_fallback_pipeline(self):
         # Prepare minimal env for config.Settings to initialize
@@ -62,5 +87,23 @@ class TestRedisFallback(unittest.TestCase):
             loop.close()
         self.assertEqual(result["file_id"], "x")
 
+    def test_bulk_getdel_single_round_trip(self):
+        os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+        os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+        from services import RedisService
+        for supports_getdel in (True, False):
+            svc = RedisService()
+            store = {"pending:a": '{"file_id":"1"}', "pending:c": '{"file_id":"3"}'}
+            svc.redis = BulkFakeRedis(store)
+            svc.supports_getdel = supports_getdel
+            loop = asyncio.new_event_loop()
+            try:
+                result = loop.run_until_complete(svc.get_and_delete_upload_sessions(["a", "b", "c"]))
+            finally:
+                loop.close()
+            self.assertEqual(result, [{"file_id": "1"}, None, {"file_id": "3"}])
+            self.assertEqual(store, {})
+            self.assertEqual(svc.redis.pipelines, 1)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+
+from fakeredis import aioredis as fake_aioredis
+
+from services import RedisService
+
+class TestSearchContextUpsert(unittest.TestCase):
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_patch_merges_into_same_search_and_resets_on_new_one(self):
+        async def scenario():
+            svc = RedisService(fake_aioredis.FakeRedis(decode_responses=True))
+            first = await svc.upsert_search_context(1, "三体", None, {"page": 2, "sort": "hot"})
+            merged = await svc.upsert_search_context(1, "三体", None, {"filters": {"format": "PDF"}})
+            other = await svc.upsert_search_context(1, "三体", "tags", {"page": 1})
+            return first, merged, other, await svc.get_search_context(1)
+
+        first, merged, other, stored = self.run_async(scenario())
+        self.assertEqual((first["page"], first["sort"], first["filters"]), (2, "hot", {}))
+        self.assertEqual((merged["page"], merged["sort"], merged["filters"]), (2, "hot", {"format": "PDF"}))
+        # Another query or filter type starts from defaults
+        self.assertEqual((other["filter"], other["page"], other["sort"], other["filters"]), ("tags", 1, "best", {}))
+        self.assertEqual(stored, other)
+
+    def test_every_upsert_refreshes_the_ttl(self):
+        async def scenario():
+            client = fake_aioredis.FakeRedis(decode_responses=True)
+            svc = RedisService(client)
+            await svc.upsert_search_context(1, "q", None, {"page": 1})
+            await client.expire("search_ctx:1", 5)
+            await svc.upsert_search_context(1, "q", None, {"page": 2})
+            return await client.ttl("search_ctx:1")
+
+        self.assertGreater(self.run_async(scenario()), 3000)
+
+    def test_concurrent_patches_keep_each_others_fields(self):
+        async def scenario():
+            svc = RedisService(fake_aioredis.FakeRedis(decode_responses=True))
+            await svc.upsert_search_context(1, "q", None, {})
+            patches = [{"page": 3}, {"sort": "new"}, {"message_id": 42}, {"filters": {"size": "<5MB"}}]
+            await asyncio.gather(*(svc.upsert_search_context(1, "q", None, patch) for patch in patches))
+            return json.loads(await svc.redis.get("search_ctx:1"))
+
+        ctx = self.run_async(scenario())
+        self.assertEqual(
+            (ctx["page"], ctx["sort"], ctx["message_id"], ctx["filters"]),
+            (3, "new", 42, {"size": "<5MB"}),
+        )
+
+if __name__ == "__main__":
+    unittest.main()
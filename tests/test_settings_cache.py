@@ -0,0 +1,94 @@
+import asyncio
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+
+import fakeredis
+from fakeredis import aioredis as fake_aioredis
+
+from services import RedisService
+
+class TestSettingsInvalidation(unittest.TestCase):
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def make_instances(self):
+        # Two bot processes sharing one Redis server
+        server = fakeredis.FakeServer()
+        return (
+            RedisService(fake_aioredis.FakeRedis(server=server, decode_responses=True)),
+            RedisService(fake_aioredis.FakeRedis(server=server, decode_responses=True)),
+        )
+
+    async def wait_until(self, predicate, timeout=2.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not predicate():
+            if asyncio.get_running_loop().time() > deadline:
+                raise AssertionError("condition not reached")
+            await asyncio.sleep(0.01)
+
+    def test_write_on_one_instance_evicts_the_other(self):
+        async def scenario():
+            writer, reader = self.make_instances()
+            reader.start_invalidation_listener()
+            try:
+                self.assertEqual((await reader.get_user_settings(7))["content_rating"], "ALL")
+                self.assertIn("7", reader.settings_cache)
+                # Let the listener subscribe before publishing
+                await asyncio.sleep(0.05)
+                await writer.update_user_settings(7, {"content_rating": "G"})
+                await self.wait_until(lambda: "7" not in reader.settings_cache)
+                return (await reader.get_user_settings(7))["content_rating"]
+            finally:
+                await reader.close()
+                await writer.close()
+
+        self.assertEqual(self.run_async(scenario()), "G")
+
+    def test_without_a_subscription_the_ttl_bounds_staleness(self):
+        async def scenario():
+            writer, reader = self.make_instances()
+            reader.settings_cache.ttl = 0.05
+            try:
+                await reader.get_user_settings(7)
+                await writer.update_user_settings(7, {"content_rating": "G"})
+                stale = (await reader.get_user_settings(7))["content_rating"]
+                await asyncio.sleep(0.06)
+                fresh = (await reader.get_user_settings(7))["content_rating"]
+                return stale, fresh
+            finally:
+                await reader.close()
+                await writer.close()
+
+        self.assertEqual(self.run_async(scenario()), ("ALL", "G"))
+
+    def test_lost_subscription_drops_local_entries(self):
+        async def scenario():
+            _, reader = self.make_instances()
+            await reader.get_user_settings(7)
+
+            class BrokenPubSub:
+                async def subscribe(self, *channels):
+                    raise ConnectionError("connection lost")
+
+                async def aclose(self):
+                    pass
+
+            reader.redis.pubsub = lambda **kwargs: BrokenPubSub()
+            reader.start_invalidation_listener()
+            try:
+                # Missed messages can't be replayed, so everything local goes
+                await self.wait_until(lambda: "7" not in reader.settings_cache)
+            finally:
+                await reader.close()
+
+        self.run_async(scenario())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import unittest
+from datetime import datetime, timedelta
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("MEILI_MASTER_KEY", "TEST_KEY")
+
+import sync_index
+from services import MeilisearchError
+
+T0 = datetime(2024, 1, 1)
+
+class FakeCache:
+    def __init__(self, log):
+        self.log = log
+
+    async def invalidate(self):
+        self.log.append("invalidate")
+
+class FakeMeili:
+    def __init__(self):
+        self.log = []
+        self.cache = FakeCache(self.log)
+        self.index_name = "books"
+        self.tasks = {}
+        self._uid = 0
+        self.indexes = {"books"}
+        self.documents = {}
+
+    def _task(self, name, status="succeeded", error=None):
+        self._uid += 1
+        self.tasks[self._uid] = {"uid": self._uid, "type": name, "status": status, "error": error}
+        self.log.append(name)
+        return {"taskUid": self._uid}
+
+    async def update_documents(self, documents, invalidate=True):
+        assert not invalidate
+        return self._task("update")
+
+    async def add_documents(self, documents, index_uid=None, invalidate=True):
+        self.documents.setdefault(index_uid, []).extend(documents)
+        return self._task("add")
+
+    async def get_index(self, index_uid=None):
+        if index_uid not in self.indexes:
+            raise MeilisearchError(404, f"Index `{index_uid}` not found.", "index_not_found")
+        return {"uid": index_uid}
+
+    async def create_index(self, index_uid):
+        self.indexes.add(index_uid)
+        return self._task("create")
+
+    async def delete_index(self, index_uid):
+        # Meilisearch accepts the request and fails the task
+        if index_uid not in self.indexes:
+            return self._task("delete", "failed", {"code": "index_not_found"})
+        self.indexes.discard(index_uid)
+        return self._task("delete")
+
+    async def update_settings(self, settings, index_uid=None):
+        return self._task("settings")
+
+    async def swap_indexes(self, index_a, index_b):
+        return self._task("swap")
+
+    async def wait_for_task(self, task_uid, timeout=60.0, interval=0.2):
+        self.log.append(f"wait:{self.tasks[task_uid]['type']}")
+        return self.tasks[task_uid]
+
+class FakeDB:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def iter_changed_books(self, since, settle=5.0, chunk_size=1000):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def seconds_since(self, ts):
+        return 1.0
+
+class FakeRedisService:
+    def __init__(self, watermark=None):
+        self.watermark = watermark
+
+    async def get_sync_watermark(self):
+        return self.watermark
+
+    async def set_sync_watermark(self, watermark):
+        self.watermark = watermark
+
+    async def set_sync_status(self, status):
+        pass
+
+def book(book_id, updated, content_updated):
+    return {"id": book_id, "updated_at": updated, "content_updated_at": content_updated, "file_name": "a.pdf"}
+
+class SyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self._saved = (sync_index.meili_service, sync_index.db_service, sync_index.redis_service)
+
+    def tearDown(self):
+        sync_index.meili_service, sync_index.db_service, sync_index.redis_service = self._saved
+
+    def install(self, meili, db, redis_service):
+        sync_index.meili_service, sync_index.db_service, sync_index.redis_service = meili, db, redis_service
+
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+class TestIncrementalSync(SyncTestCase):
+    def test_download_only_changes_keep_the_search_cache(self):
+        meili = FakeMeili()
+        chunks = [[book(1, T0 + timedelta(minutes=5), T0 - timedelta(days=1))]]
+        self.install(meili, FakeDB(chunks), FakeRedisService((T0, 0)))
+        self.run_async(sync_index.IndexSync(chunk_size=1).run_pass())
+        self.assertNotIn("invalidate", meili.log)
+
+    def test_content_changes_invalidate_once_after_the_tasks(self):
+        meili = FakeMeili()
+        chunks = [
+            [book(1, T0 + timedelta(minutes=1), T0 + timedelta(minutes=1))],
+            [book(2, T0 + timedelta(minutes=2), T0 - timedelta(days=1))],
+        ]
+        self.install(meili, FakeDB(chunks), FakeRedisService((T0, 0)))
+        self.run_async(sync_index.IndexSync(chunk_size=1, max_pending_tasks=4).run_pass())
+        self.assertEqual(meili.log, ["update", "update", "wait:update", "wait:update", "invalidate"])
+
+class TestRebuild(SyncTestCase):
+    def test_rebuild_without_leftover_shadow(self):
+        meili = FakeMeili()
+        redis_service = FakeRedisService()
+        chunks = [[book(1, T0, T0), book(2, T0, T0)]]
+        self.install(meili, FakeDB(chunks), redis_service)
+        status = self.run_async(sync_index.IndexSync().rebuild())
+        self.assertEqual(status["rows"], 2)
+        self.assertEqual(len(meili.documents["books_shadow"]), 2)
+        self.assertIn("swap", meili.log)
+        self.assertEqual(meili.indexes, {"books"})
+        self.assertEqual(redis_service.watermark, (T0, 2))
+        self.assertTrue(all(task["status"] == "succeeded" for task in meili.tasks.values()))
+
+    def test_rebuild_removes_leftover_shadow(self):
+        meili = FakeMeili()
+        meili.indexes.add("books_shadow")
+        self.install(meili, FakeDB([[book(1, T0, T0)]]), FakeRedisService())
+        self.run_async(sync_index.IndexSync().rebuild())
+        self.assertEqual(meili.log[:2], ["delete", "wait:delete"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:ABC")
+os.environ.setdefault("MEILI_MASTER_KEY", "test")
+
+import fakeredis
+from fakeredis import aioredis as fake_aioredis
+from aiogram import Bot, Dispatcher
+from aiogram.types import InlineQuery, Message
+
+from inline_search import InlineSearcher
+
+from update_stream import (
+    GROUP, UpdateStreamProducer, UpdateStreamWorker, lease_key, shard_for, stream_key,
+)
+
+class TestShardFor(unittest.TestCase):
+    def test_same_user_same_shard(self):
+        message = {"update_id": 1, "message": {"from": {"id": 42}, "chat": {"id": 42}, "text": "a"}}
+        callback = {"update_id": 2, "callback_query": {"from": {"id": 42}, "message": {"chat": {"id": 42}}}}
+        inline = {"update_id": 3, "inline_query": {"from": {"id": 42}, "query": "b"}}
+        shards = {shard_for(u, 64) for u in (message, callback, inline)}
+        self.assertEqual(shards, {42})
+
+    def test_fallbacks(self):
+        channel_post = {"update_id": 5, "channel_post": {"chat": {"id": -1001}}}
+        self.assertEqual(shard_for(channel_post, 64), 1001 % 64)
+        self.assertEqual(shard_for({"update_id": 70}, 64), 70 % 64)
+
+class BlockingFakeRedis(fake_aioredis.FakeRedis):
+    """fakeredis answers XREADGROUP BLOCK at once; wait a little like Redis would."""
+
+    async def xreadgroup(self, *args, block=None, **kwargs):
+        response = await super().xreadgroup(*args, **kwargs)
+        if not response and block:
+            await asyncio.sleep(0.02)
+        return response
+
+def inline_update(update_id, user_id, query):
+    return {
+        "update_id": update_id,
+        "inline_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "t"},
+            "query": query,
+            "offset": "",
+        },
+    }
+
+def message_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "t"},
+            "text": text,
+        },
+    }
+
+class StreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.handled = []
+
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def client(self):
+        return BlockingFakeRedis(server=self.server, decode_responses=True)
+
+    def dispatcher(self):
+        dp = Dispatcher()
+
+        @dp.message()
+        async def on_message(message: Message):
+            if message.text == "boom":
+                raise ValueError("poison update")
+            if message.text.startswith("slow"):
+                await asyncio.sleep(0.1)
+            self.handled.append((message.from_user.id, message.text))
+
+        return dp
+
+    def worker(self, worker_id, shards=1, dp=None, **kwargs):
+        kwargs.setdefault("lease_ttl", 5)
+        return UpdateStreamWorker(dp or self.dispatcher(), Bot(token="42:TEST"), self.client(), worker_id, shards=shards, **kwargs)
+
+    async def publish(self, *updates, shards=1):
+        producer = UpdateStreamProducer(self.client(), shards)
+        await producer.ensure_groups()
+        for update in updates:
+            await producer.publish(update)
+
+    async def start(self, worker):
+        await worker._heartbeat()
+        await worker._rebalance()
+
+    async def wait_until(self, predicate, timeout=3.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not predicate():
+            if asyncio.get_running_loop().time() > deadline:
+                raise AssertionError("condition not reached")
+            await asyncio.sleep(0.01)
+
+    async def pending(self, shard=0):
+        return (await self.client().xpending(stream_key(shard), GROUP))["pending"]
+
+class TestLeases(StreamTestCase):
+    def test_acquire_renew_and_handover_after_expiry(self):
+        async def scenario():
+            redis_client = self.client()
+            await self.publish(shards=2)
+            first = self.worker("w1", shards=2)
+            await self.start(first)
+            owners = [await redis_client.get(lease_key(s)) for s in range(2)]
+
+            # A live lease is renewed, not taken over
+            await redis_client.expire(lease_key(0), 1)
+            second = self.worker("w2", shards=2)
+            await self.start(second)
+            await first._rebalance()
+            renewed_ttl = await redis_client.ttl(lease_key(0))
+            taken_by_second = dict(second._shard_tasks)
+
+            # w1 stalls past its lease: w2 takes the shard, w1 stops reading it
+            await redis_client.delete(lease_key(0))
+            await second._rebalance()
+            handed_to = await redis_client.get(lease_key(0))
+            await first._rebalance()
+            lost = set(first._lost)
+            await first.stop()
+            await second.stop()
+            return owners, renewed_ttl, taken_by_second, handed_to, lost
+
+        owners, renewed_ttl, taken_by_second, handed_to, lost = self.run_async(scenario())
+        self.assertEqual(owners, ["w1", "w1"])
+        self.assertGreater(renewed_ttl, 1)
+        self.assertEqual(taken_by_second, {})
+        self.assertEqual(handed_to, "w2")
+        self.assertEqual(lost, {0})
+
+class TestConsumption(StreamTestCase):
+    def test_entries_of_a_crashed_worker_are_reclaimed_after_idling(self):
+        async def scenario():
+            await self.publish(*(message_update(i, 7, f"m{i}") for i in range(1, 4)))
+            # A worker read the entries and died before acknowledging them
+            await self.client().xreadgroup(GROUP, "dead", {stream_key(0): ">"}, count=10)
+
+            patient = self.worker("w1", claim_idle=10)
+            await self.start(patient)
+            await asyncio.sleep(0.2)
+            early = list(self.handled)
+            await patient.stop()
+
+            worker = self.worker("w2", claim_idle=0.05)
+            await asyncio.sleep(0.06)
+            await self.start(worker)
+            await self.wait_until(lambda: len(self.handled) == 3)
+            await self.wait_until(lambda: worker.processed == 3)
+            await worker.stop()
+            return early, worker.reclaimed, await self.pending()
+
+        early, reclaimed, pending = self.run_async(scenario())
+        self.assertEqual(early, [])
+        self.assertEqual(self.handled, [(7, "m1"), (7, "m2"), (7, "m3")])
+        self.assertEqual(reclaimed, 3)
+        self.assertEqual(pending, 0)
+
+    def test_poison_update_is_acknowledged(self):
+        async def scenario():
+            await self.publish(message_update(1, 7, "boom"), message_update(2, 7, "ok"))
+            worker = self.worker("w1")
+            await self.start(worker)
+            await self.wait_until(lambda: worker.failed == 1 and worker.processed == 1)
+            await worker.stop()
+            return await self.pending()
+
+        self.assertEqual(self.run_async(scenario()), 0)
+        self.assertEqual(self.handled, [(7, "ok")])
+
+    def test_users_run_concurrently_and_each_in_order(self):
+        async def scenario():
+            await self.publish(
+                message_update(1, 7, "slow first"),
+                message_update(2, 7, "second"),
+                message_update(3, 8, "other user"),
+            )
+            worker = self.worker("w1")
+            await self.start(worker)
+            await self.wait_until(lambda: len(self.handled) == 3)
+            await worker.stop()
+
+        self.run_async(scenario())
+        # User 8 is not held up by user 7's slow handler; user 7 keeps its order
+        self.assertEqual(self.handled, [(8, "other user"), (7, "slow first"), (7, "second")])
+
+    def test_newer_inline_query_supersedes_the_debouncing_one(self):
+        searched = []
+
+        async def search(text, limit, offset, filter, plan_key):
+            searched.append(text)
+            return {"hits": [], "estimatedTotalHits": 0}
+
+        searcher = InlineSearcher(search, debounce=0.1)
+        dp = Dispatcher()
+
+        @dp.inline_query()
+        async def on_inline(inline_query: InlineQuery):
+            await searcher.query(inline_query.from_user.id, inline_query.query, inline_query.offset)
+
+        async def scenario():
+            await self.publish(inline_update(1, 7, "dun"), inline_update(2, 7, "dune"))
+            worker = self.worker("w1", dp=dp)
+            await self.start(worker)
+            await self.wait_until(lambda: worker.processed == 2)
+            await worker.stop()
+
+        self.run_async(scenario())
+        self.assertEqual(searched, ["dune"])
+        self.assertEqual(searcher.debounced, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import asyncio
+
+from uploads import UploadBatcher
+
+class TestUploadBatcher(unittest.TestCase):
+    def test_uploads_in_window_become_one_batch(self):
+        batches = []
+
+        async def handler(key, items):
+            batches.append((key, items))
+
+        async def scenario():
+            batcher = UploadBatcher(handler, window=0.05, max_wait=1.0)
+            for i in range(5):
+                await batcher.add(1, i)
+                await asyncio.sleep(0.01)
+            await batcher.add(2, "x")
+            await asyncio.sleep(0.1)
+            return batcher.stats()
+
+        loop = asyncio.new_event_loop()
+        try:
+            stats = loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(sorted(batches), [(1, [0, 1, 2, 3, 4]), (2, ["x"])])
+        self.assertEqual(stats["batches"], 2)
+        self.assertEqual(stats["pending_items"], 0)
+
+    def test_close_flushes_pending(self):
+        batches = []
+
+        async def handler(key, items):
+            batches.append(items)
+
+        async def scenario():
+            batcher = UploadBatcher(handler, window=10.0)
+            await batcher.add(1, "a")
+            await batcher.add(1, "b")
+            await batcher.close()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(batches, [["a", "b"]])
+
+    def test_items_are_journalled_until_their_batch_is_handled(self):
+        journal = {}
+        seen = []
+
+        async def persist(key, item):
+            journal.setdefault(key, []).append(item)
+
+        async def release(key, count):
+            del journal[key][:count]
+
+        async def handler(key, items):
+            seen.append({k: list(v) for k, v in journal.items()})
+
+        async def scenario():
+            batcher = UploadBatcher(handler, window=0.02, persist=persist, release=release)
+            await batcher.add("album", "a")
+            journalled = list(journal["album"])
+            await batcher.add("album", "b")
+            await asyncio.sleep(0.05)
+            return journalled
+
+        loop = asyncio.new_event_loop()
+        try:
+            journalled = loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(journalled, ["a"])
+        self.assertEqual(seen, [{"album": ["a", "b"]}])
+        self.assertEqual(journal, {"album": []})
+
+    def test_recovered_batches_reach_the_handler(self):
+        batches = []
+        orphaned = [[("7", ["a", "b"])], []]
+
+        async def handler(key, items):
+            batches.append((key, items))
+
+        async def recover():
+            return orphaned.pop(0)
+
+        async def scenario():
+            batcher = UploadBatcher(handler, recover=recover, recover_interval=0.01)
+            batcher.start()
+            await asyncio.sleep(0.005)
+            await batcher.close()
+            return batcher.stats()
+
+        loop = asyncio.new_event_loop()
+        try:
+            stats = loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(batches, [("7", ["a", "b"])])
+        self.assertEqual(stats["recovered"], 2)
+
+if __name__ == "__main__":
+    unittest.main()
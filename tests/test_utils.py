@@ -1,5 +1,6 @@
 import unittest
-from utils import format_size, get_display_width, pad_string, format_book_list_item
+import unicodedata
+from utils import format_size, get_display_width, pad_string, format_book_list_item, truncate_display, list_item_cache
 
 class TestUtils(unittest.TestCase):
     def test_format_size(self):
@@ -17,11 +18,44 @@ class TestUtils(unittest.TestCase):
         padded = pad_string(text, width + 2)
         self.assertEqual(get_display_width(padded), width + 2)
 
+    def test_display_width_matches_unicodedata(self):
+        def reference(text):
+            return sum(2 if unicodedata.east_asian_width(ch) in ("F", "W", "A") else 1 for ch in text)
+
+        samples = ["", "abc", "三体", "三体Ⅲ：死神永生（典藏版）", "Harry 哈利·波特 1", "📚 读书 2024", "ｆｕｌｌ", "é̀"]
+        for text in samples:
+            self.assertEqual(get_display_width(text), reference(text), text)
+
+    def test_truncate_display(self):
+        self.assertEqual(truncate_display("三体", 10), "三体")
+        self.assertEqual(truncate_display("abcdefghij", 8), "abcde...")
+        self.assertEqual(truncate_display("中国古典文学名著", 9), "中国古...")
+        self.assertEqual(truncate_display("ab中国古典文学", 9), "ab中国...")
+        self.assertEqual(truncate_display("📚读书笔记笔记", 8), "📚读...")
+        for text in ["中国古典文学名著全集", "Harry 哈利·波特与魔法石", "abc" * 10]:
+            for max_width in range(0, 30):
+                result = truncate_display(text, max_width)
+                if get_display_width(text) <= max_width:
+                    self.assertEqual(result, text)
+                else:
+                    self.assertTrue(result.endswith("..."))
+                    self.assertLessEqual(get_display_width(result), max(max_width, 3))
+
     def test_format_book_list_item_link(self):
         item_with_id = format_book_list_item(1, {"id": 123, "title": "书名", "file_name": "a.pdf", "file_size": 100})
         self.assertIn("https://t.me/", item_with_id)
         item_without_id = format_book_list_item(2, {"title": "书名", "file_name": "a.pdf", "file_size": 100})
         self.assertNotIn("https://t.me/", item_without_id)
 
+    def test_list_item_fragments_are_cached_per_stamp(self):
+        list_item_cache.clear()
+        book = {"id": 7, "title": "三体", "file_name": "a.epub", "file_size": 2048, "downloads": 3, "collections": 1}
+        first = format_book_list_item(1, book, bot_username="bot")
+        self.assertEqual(format_book_list_item(5, dict(book), bot_username="bot"), "05" + first[2:])
+        self.assertEqual(list_item_cache.hits, 1)
+        updated = format_book_list_item(1, dict(book, downloads=4), bot_username="bot")
+        self.assertIn("1/4", updated)
+        self.assertIn("start=book_7", format_book_list_item(1, book, bot_username="other"))
+
 if __name__ == "__main__":
     unittest.main()
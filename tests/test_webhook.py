@@ -0,0 +1,89 @@
+import unittest
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+
+from webhook import WebhookServer, SECRET_HEADER, run_webhook
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "t"},
+        "text": "三体",
+    },
+}
+
+class TestWebhookServer(unittest.TestCase):
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_synthetic_update_reaches_handler(self):
+        async def scenario():
+            dp = Dispatcher()
+            seen = []
+
+            @dp.message()
+            async def on_message(message: Message):
+                seen.append(message.text)
+
+            bot = Bot(token="42:TEST")
+            server = WebhookServer(dp, bot, secret="s3cret", workers=2)
+            async with TestClient(TestServer(server.build_app())) as client:
+                resp = await client.post(server.path, json=UPDATE)
+                self.assertEqual(resp.status, 401)
+                resp = await client.post(server.path, json=UPDATE, headers={SECRET_HEADER: "s3cret"})
+                self.assertEqual(resp.status, 200)
+                resp = await client.post(server.path, data="nope", headers={SECRET_HEADER: "s3cret"})
+                self.assertEqual(resp.status, 400)
+                await server.queue.join()
+            await bot.session.close()
+            return seen, server.stats()
+
+        seen, stats = self.run_async(scenario())
+        self.assertEqual(seen, ["三体"])
+        self.assertEqual(stats["processed"], 1)
+        self.assertEqual(stats["unauthorized"], 1)
+
+    def test_full_queue_is_rejected(self):
+        async def scenario():
+            bot = Bot(token="42:TEST")
+            server = WebhookServer(Dispatcher(), bot, queue_size=1, workers=0)
+            async with TestClient(TestServer(server.build_app())) as client:
+                headers = {SECRET_HEADER: server.secret}
+                first = await client.post(server.path, json=UPDATE, headers=headers)
+                second = await client.post(server.path, json=UPDATE, headers=headers)
+                server.queue.get_nowait()
+                server.queue.task_done()
+            await bot.session.close()
+            return first.status, second.status
+
+        self.assertEqual(self.run_async(scenario()), (200, 503))
+
+    def test_missing_secret_is_generated_not_skipped(self):
+        async def scenario():
+            bot = Bot(token="42:TEST")
+            server = WebhookServer(Dispatcher(), bot, workers=0)
+            async with TestClient(TestServer(server.build_app())) as client:
+                forged = await client.post(server.path, json=UPDATE)
+                empty = await client.post(server.path, json=UPDATE, headers={SECRET_HEADER: ""})
+            with self.assertRaises(RuntimeError):
+                await run_webhook(server, "", "127.0.0.1", 0)
+            await bot.session.close()
+            return server.secret, forged.status, empty.status
+
+        secret, forged, empty = self.run_async(scenario())
+        self.assertTrue(secret)
+        self.assertEqual((forged, empty), (401, 401))
+
+if __name__ == "__main__":
+    unittest.main()
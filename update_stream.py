@@ -0,0 +1,423 @@
+"""
+Multi-process update processing over Redis Streams.
+
+The receiver (bot.py with UPDATE_STREAM=true, polling or webhook) does no
+handler work: it appends each raw update to one of UPDATE_STREAM_SHARDS
+streams, chosen by the sender's user id. Worker processes run the regular
+``dp`` handlers and consume the streams through a consumer group.
+
+Each shard is owned by exactly one worker at a time (a Redis lease renewed
+by heartbeat). Within a shard, updates of different users are handled
+concurrently (bounded per worker), while each user's updates are chained so
+they keep their order (except inline queries, which the inline debounce
+supersedes); every entry is acknowledged once its own handler
+finished. Shards are spread evenly over the live workers; when a worker dies
+its leases expire, another worker takes the shard over and reclaims the
+entries left unacknowledged for longer than the lease (XAUTOCLAIM). A worker
+that fails to renew a lease stops reading the shard and drops the entries it
+had not started, leaving them to the new owner.
+
+    python update_stream.py --processes 4
+
+Per-worker throughput is kept in the ``stream:workers`` hash and shown in /stats.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import os
+import socket
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+
+from config import config
+
+logger = logging.getLogger("update_stream")
+
+GROUP = "bot-workers"
+WORKERS_KEY = "stream:workers"
+
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def stream_key(shard: int) -> str:
+    return f"updates:{shard}"
+
+def lease_key(shard: int) -> str:
+    return f"stream:lease:{shard}"
+
+def update_key(update: Dict[str, Any]) -> int:
+    """Whose update this is: the sender, then the chat, then the update itself."""
+    payload = next((v for k, v in update.items() if k != "update_id" and isinstance(v, dict)), {})
+    sender = payload.get("from") or payload.get("user") or {}
+    chat = payload.get("chat") or (payload.get("message") or {}).get("chat") or {}
+    return int(sender.get("id") or chat.get("id") or update.get("update_id") or 0)
+
+def shard_for(update: Dict[str, Any], shards: int) -> int:
+    """Pick the shard of a raw update; one user's updates share a shard."""
+    return abs(update_key(update)) % shards
+
+class UpdateStreamProducer:
+    def __init__(self, redis_client, shards: int = 64, maxlen: int = 100000):
+        self.redis = redis_client
+        self.shards = shards
+        self.maxlen = maxlen
+        self.published = 0
+
+    async def ensure_groups(self):
+        for shard in range(self.shards):
+            try:
+                await self.redis.xgroup_create(stream_key(shard), GROUP, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def publish(self, update: Dict[str, Any]):
+        shard = shard_for(update, self.shards)
+        await self.redis.xadd(
+            stream_key(shard),
+            {"u": json.dumps(update, ensure_ascii=False, separators=(",", ":"))},
+            maxlen=self.maxlen,
+            approximate=True,
+        )
+        self.published += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"shards": self.shards, "published": self.published}
+
+async def run_polling_receiver(bot: Bot, producer: UpdateStreamProducer, allowed_updates: List[str]):
+    """Long-poll Telegram and forward updates to the streams.
+
+    The offset only advances past updates that were written, so a Redis
+    outage makes Telegram redeliver instead of losing updates.
+    """
+    await bot.delete_webhook(drop_pending_updates=False)
+    offset: Optional[int] = None
+    logger.info(f"Polling receiver started, {producer.shards} shards")
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            for update in updates:
+                await producer.publish(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+                offset = update.update_id + 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Update receiver error: {e}")
+            await asyncio.sleep(1)
+
+class UpdateStreamWorker:
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        redis_client,
+        worker_id: str,
+        shards: int = 64,
+        lease_ttl: int = 15,
+        batch: int = 10,
+        concurrency: int = 64,
+        claim_idle: Optional[float] = None,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.redis = redis_client
+        self.worker_id = worker_id
+        self.shards = shards
+        self.lease_ttl = lease_ttl
+        self.batch = batch
+        # Entries pending this long were read by an owner that lost the shard
+        self.claim_idle = lease_ttl if claim_idle is None else claim_idle
+        self._renew = self.redis.register_script(_RENEW_SCRIPT)
+        self._release = self.redis.register_script(_RELEASE_SCRIPT)
+        self._shard_tasks: Dict[int, asyncio.Task] = {}
+        self._stopping: Set[int] = set()
+        # Shards whose lease expired: entries not yet started are left alone
+        self._lost: Set[int] = set()
+        # Handlers in flight across all shards of this worker
+        self._slots = asyncio.Semaphore(concurrency)
+        self.processed = 0
+        self.failed = 0
+        self.reclaimed = 0
+        self.started = time.time()
+        self._last_report = (time.monotonic(), 0)
+        self.rate = 0.0
+
+    async def run(self):
+        await UpdateStreamProducer(self.redis, self.shards).ensure_groups()
+        logger.info(f"Worker {self.worker_id} started")
+        while True:
+            try:
+                await self._heartbeat()
+                await self._rebalance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker {self.worker_id} heartbeat failed: {e}")
+            await asyncio.sleep(self.lease_ttl / 3)
+
+    async def stop(self):
+        self._stopping.update(self._shard_tasks)
+        tasks = list(self._shard_tasks.values())
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=5)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await self.redis.hdel(WORKERS_KEY, self.worker_id)
+        except Exception as e:
+            logger.warning(f"Failed to deregister worker {self.worker_id}: {e}")
+
+    async def _heartbeat(self):
+        now = time.monotonic()
+        last_at, last_processed = self._last_report
+        if now > last_at:
+            self.rate = (self.processed - last_processed) / (now - last_at)
+        self._last_report = (now, self.processed)
+        await self.redis.hset(WORKERS_KEY, self.worker_id, json.dumps(self.stats()))
+
+    async def _live_workers(self) -> int:
+        entries = await self.redis.hgetall(WORKERS_KEY)
+        cutoff = time.time() - self.lease_ttl
+        alive, dead = 0, []
+        for worker_id, raw in entries.items():
+            try:
+                seen = json.loads(raw).get("heartbeat", 0)
+            except ValueError:
+                seen = 0
+            if seen >= cutoff:
+                alive += 1
+            else:
+                dead.append(worker_id)
+        if dead:
+            await self.redis.hdel(WORKERS_KEY, *dead)
+        return max(alive, 1)
+
+    async def _rebalance(self):
+        # Keep (or lose) the leases already held
+        for shard, task in list(self._shard_tasks.items()):
+            if task.done():
+                self._shard_tasks.pop(shard)
+                self._stopping.discard(shard)
+                self._lost.discard(shard)
+                continue
+            if shard in self._lost:
+                continue
+            if not await self._renew(keys=[lease_key(shard)], args=[self.worker_id, self.lease_ttl]):
+                logger.warning(f"Worker {self.worker_id} lost shard {shard}")
+                self._stopping.add(shard)
+                self._lost.add(shard)
+
+        target = math.ceil(self.shards / await self._live_workers())
+        active = [s for s in self._shard_tasks if s not in self._stopping]
+        # Hand extra shards back after their current message
+        for shard in active[target:]:
+            self._stopping.add(shard)
+        free = target - len(active)
+        for shard in range(self.shards):
+            if free <= 0:
+                break
+            if shard in self._shard_tasks:
+                continue
+            if await self.redis.set(lease_key(shard), self.worker_id, nx=True, ex=self.lease_ttl):
+                self._shard_tasks[shard] = asyncio.create_task(self._consume(shard))
+                free -= 1
+
+    async def _consume(self, shard: int):
+        key = stream_key(shard)
+        # msg id -> handler task; user key -> that user's latest handler task
+        inflight: Dict[str, asyncio.Task] = {}
+        chains: Dict[int, asyncio.Task] = {}
+        last_claim = None
+        try:
+            while shard not in self._stopping:
+                # Entries a previous owner read but never acknowledged
+                if last_claim is None or time.monotonic() - last_claim >= self.claim_idle / 2:
+                    await self._reclaim(shard, key, inflight, chains)
+                    last_claim = time.monotonic()
+                response = await self.redis.xreadgroup(GROUP, self.worker_id, {key: ">"}, count=self.batch, block=1000)
+                for _, messages in response or []:
+                    for msg_id, fields in messages:
+                        await self._dispatch(shard, key, msg_id, fields, inflight, chains)
+            # Handing the shard back: what was read finishes first
+            if inflight:
+                await asyncio.gather(*inflight.values(), return_exceptions=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Shard {shard} consumer failed: {e}")
+        finally:
+            # Unacknowledged entries are reclaimed by the next owner
+            tasks = list(inflight.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                await self._release(keys=[lease_key(shard)], args=[self.worker_id])
+            except Exception as e:
+                logger.warning(f"Failed to release shard {shard}: {e}")
+
+    async def _reclaim(self, shard: int, key: str, inflight: Dict[str, asyncio.Task], chains: Dict[int, asyncio.Task]):
+        start = "0-0"
+        while shard not in self._stopping:
+            start, messages = (await self.redis.xautoclaim(
+                key, GROUP, self.worker_id, int(self.claim_idle * 1000), start_id=start, count=100
+            ))[:2]
+            for msg_id, fields in messages:
+                # Our own slow handlers show up as idle too
+                if msg_id in inflight:
+                    continue
+                self.reclaimed += 1
+                await self._dispatch(shard, key, msg_id, fields, inflight, chains)
+            if start == "0-0":
+                break
+
+    async def _dispatch(
+        self,
+        shard: int,
+        key: str,
+        msg_id: str,
+        fields: Optional[Dict[str, str]],
+        inflight: Dict[str, asyncio.Task],
+        chains: Dict[int, asyncio.Task],
+    ):
+        await self._slots.acquire()
+        update = None
+        # Trimmed entries come back from XAUTOCLAIM without fields
+        if fields and "u" in fields:
+            try:
+                update = json.loads(fields["u"])
+            except ValueError:
+                logger.error(f"Unreadable update {key} {msg_id}")
+        # Inline queries are not chained: a newer keystroke has to be able to
+        # supersede the one still debouncing (see inline_search)
+        chained = isinstance(update, dict) and "inline_query" not in update
+        user = update_key(update) if chained else None
+        previous = chains.get(user) if user is not None else None
+        task = asyncio.create_task(self._handle(shard, key, msg_id, update, previous))
+        inflight[msg_id] = task
+        if user is not None:
+            chains[user] = task
+
+        def _done(t: asyncio.Task):
+            self._slots.release()
+            if inflight.get(msg_id) is t:
+                del inflight[msg_id]
+            if user is not None and chains.get(user) is t:
+                del chains[user]
+
+        task.add_done_callback(_done)
+
+    async def _handle(
+        self, shard: int, key: str, msg_id: str, update: Optional[Dict[str, Any]], previous: Optional[asyncio.Task]
+    ):
+        if previous is not None:
+            # The same user's earlier update goes first
+            await asyncio.wait([previous])
+        if shard in self._lost:
+            return
+        if update is not None:
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+                self.processed += 1
+            except Exception as e:
+                # Poison updates are acknowledged so they don't block the shard
+                self.failed += 1
+                logger.error(f"Failed to handle {key} {msg_id}: {e}")
+        try:
+            await self.redis.xack(key, GROUP, msg_id)
+        except Exception as e:
+            logger.warning(f"Failed to acknowledge {key} {msg_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "heartbeat": time.time(),
+            "shards": sorted(s for s in self._shard_tasks if s not in self._stopping),
+            "processed": self.processed,
+            "failed": self.failed,
+            "reclaimed": self.reclaimed,
+            "rate_per_s": round(self.rate, 2),
+            "uptime_s": round(time.time() - self.started),
+        }
+
+async def read_worker_stats(redis_client) -> Dict[str, Any]:
+    entries = await redis_client.hgetall(WORKERS_KEY)
+    return {worker_id: json.loads(raw) for worker_id, raw in entries.items()}
+
+async def _worker_main():
+    import bot as app
+    from services import redis_service
+
+    worker = UpdateStreamWorker(
+        app.dp,
+        app.bot,
+        redis_service.redis,
+        worker_id=f"{socket.gethostname()}-{os.getpid()}",
+        shards=config.UPDATE_STREAM_SHARDS,
+        lease_ttl=config.UPDATE_STREAM_LEASE_TTL,
+        concurrency=config.UPDATE_STREAM_CONCURRENCY,
+    )
+    app.dp.startup.register(app.on_startup)
+    app.dp.shutdown.register(app.on_shutdown)
+    await app.dp.emit_startup(bot=app.bot)
+    try:
+        await worker.run()
+    finally:
+        await worker.stop()
+        await app.dp.emit_shutdown(bot=app.bot)
+
+def _worker_process():
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_worker_main())
+    except KeyboardInterrupt:
+        pass
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run bot handler workers fed by the Redis update stream.")
+    parser.add_argument("--processes", type=int, default=config.UPDATE_STREAM_WORKERS, help="Worker processes to run")
+    args = parser.parse_args(argv)
+
+    ctx = multiprocessing.get_context("spawn")
+    procs: List[multiprocessing.Process] = []
+    try:
+        for _ in range(args.processes):
+            proc = ctx.Process(target=_worker_process)
+            proc.start()
+            procs.append(proc)
+        # Restart workers that die; their shards are reclaimed by the others meanwhile
+        while True:
+            time.sleep(1)
+            for i, proc in enumerate(procs):
+                if not proc.is_alive():
+                    logger.warning(f"Worker pid {proc.pid} exited with {proc.exitcode}, restarting")
+                    procs[i] = ctx.Process(target=_worker_process)
+                    procs[i].start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join(timeout=10)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
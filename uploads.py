@@ -0,0 +1,146 @@
+"""
+Upload batching.
+
+Documents sent in quick succession (an album shares a media_group_id, a
+forwarded batch arrives as separate messages) are collected per user and
+handed to one handler call, so dedup, session creation and moderation
+messages happen once per batch instead of once per file.
+
+The update carrying a file is acknowledged as soon as its handler returns,
+long before the batch flushes. With ``persist`` every item is journalled
+first and ``release`` drops it after the flush; ``recover`` hands back the
+journalled batches of a process that died in between, polled every
+``recover_interval`` seconds once ``start()`` was called.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BatchHandler = Callable[[Hashable, List[Any]], Awaitable[Any]]
+PersistFunc = Callable[[Hashable, Any], Awaitable[Any]]
+ReleaseFunc = Callable[[Hashable, int], Awaitable[Any]]
+RecoverFunc = Callable[[], Awaitable[List[Tuple[Hashable, List[Any]]]]]
+
+class UploadBatcher:
+    def __init__(
+        self,
+        handler: BatchHandler,
+        window: float = 1.5,
+        max_wait: float = 10.0,
+        max_items: int = 100,
+        persist: Optional[PersistFunc] = None,
+        release: Optional[ReleaseFunc] = None,
+        recover: Optional[RecoverFunc] = None,
+        recover_interval: float = 30.0,
+    ):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        self.max_items = max_items
+        self.persist = persist
+        self.release = release
+        self.recover = recover
+        self.recover_interval = recover_interval
+        # key -> (items, first arrival)
+        self._batches: Dict[Hashable, Tuple[List[Any], float]] = {}
+        self._timers: Dict[Hashable, asyncio.Task] = {}
+        self._recover_task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.recovered = 0
+
+    def start(self):
+        if self.recover is not None and (self._recover_task is None or self._recover_task.done()):
+            self._recover_task = asyncio.create_task(self._recover_loop())
+
+    async def add(self, key: Hashable, item: Any):
+        """Queue ``item``; the batch is flushed once ``key`` stays quiet for ``window`` seconds."""
+        if self.persist is not None:
+            try:
+                await self.persist(key, item)
+            except Exception as e:
+                logger.error(f"Failed to journal upload for {key}: {e}")
+        now = time.monotonic()
+        items, started = self._batches.setdefault(key, ([], now))
+        items.append(item)
+        self.received += 1
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if len(items) >= self.max_items:
+            delay = 0.0
+        else:
+            delay = max(0.0, min(self.window, started + self.max_wait - now))
+        self._timers[key] = asyncio.create_task(self._flush_later(key, delay))
+
+    async def _flush_later(self, key: Hashable, delay: float):
+        await asyncio.sleep(delay)
+        self._timers.pop(key, None)
+        await self._flush(key)
+
+    async def _flush(self, key: Hashable):
+        entry = self._batches.pop(key, None)
+        if entry is None:
+            return
+        items = entry[0]
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(items))
+        try:
+            await self.handler(key, items)
+        except Exception as e:
+            logger.error(f"Upload batch of {len(items)} for {key} failed: {e}")
+        if self.release is not None:
+            try:
+                await self.release(key, len(items))
+            except Exception as e:
+                logger.error(f"Failed to release journalled uploads for {key}: {e}")
+
+    async def recover_once(self) -> int:
+        """Handle the batches ``recover`` returns; returns the number of items."""
+        count = 0
+        for key, items in await self.recover():
+            count += len(items)
+            try:
+                await self.handler(key, items)
+            except Exception as e:
+                logger.error(f"Recovered upload batch of {len(items)} for {key} failed: {e}")
+        self.recovered += count
+        return count
+
+    async def _recover_loop(self):
+        while True:
+            try:
+                count = await self.recover_once()
+                if count:
+                    logger.info(f"Recovered {count} journalled uploads")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Upload recovery failed: {e}")
+            await asyncio.sleep(self.recover_interval)
+
+    async def close(self):
+        """Flush everything still waiting for its window."""
+        if self._recover_task is not None:
+            self._recover_task.cancel()
+            await asyncio.gather(self._recover_task, return_exceptions=True)
+            self._recover_task = None
+        timers, self._timers = self._timers, {}
+        for timer in timers.values():
+            timer.cancel()
+        await asyncio.gather(*timers.values(), return_exceptions=True)
+        await asyncio.gather(*(self._flush(key) for key in list(self._batches)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_users": len(self._batches),
+            "pending_items": sum(len(items) for items, _ in self._batches.values()),
+            "received": self.received,
+            "batches": self.batches,
+            "largest_batch": self.largest_batch,
+            "recovered": self.recovered,
+        }
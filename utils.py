@@ -1,15 +1,55 @@
 import unicodedata
 import html
-from typing import List, Dict, Any
+import re
+from typing import List, Dict, Any, Tuple
+
+from cache import LRUCache
+from query_planner import SIZE_RANGES, WORD_RANGES, bucket_of
+
+_WIDE_CLASSES = frozenset(("F", "W", "A"))
+
+def _build_bmp_widths() -> bytes:
+    eaw = unicodedata.east_asian_width
+    return bytes(2 if eaw(chr(cp)) in _WIDE_CLASSES else 1 for cp in range(0x10000))
+
+def _wide_char_class(widths: bytes) -> str:
+    ranges = []
+    start = None
+    for cp, w in enumerate(widths):
+        if w == 2 and start is None:
+            start = cp
+        elif w != 2 and start is not None:
+            ranges.append(f"\\u{start:04x}-\\u{cp - 1:04x}")
+            start = None
+    if start is not None:
+        ranges.append(f"\\u{start:04x}-\\u{len(widths) - 1:04x}")
+    return "[" + "".join(ranges) + "]"
+
+# Display width of every BMP code point, computed once at import
+_BMP_WIDTHS = _build_bmp_widths()
+_WIDE_CLASS = _wide_char_class(_BMP_WIDTHS)
+_WIDE_RE = re.compile(_WIDE_CLASS)
+_ALL_WIDE_RE = re.compile(_WIDE_CLASS + "+")
+_ASTRAL_RE = re.compile("[\U00010000-\U0010FFFF]")
+
+def _char_width(ch: str) -> int:
+    cp = ord(ch)
+    if cp < 0x10000:
+        return _BMP_WIDTHS[cp]
+    return 2 if unicodedata.east_asian_width(ch) in _WIDE_CLASSES else 1
 
 def get_display_width(text: str) -> int:
     """Calculate the display width of a string (East Asian Width)."""
-    width = 0
-    for char in text:
-        if unicodedata.east_asian_width(char) in ('F', 'W', 'A'):
-            width += 2
-        else:
-            width += 1
+    if text.isascii():
+        return len(text)
+    if _ALL_WIDE_RE.fullmatch(text):
+        return 2 * len(text)
+    # Every wide BMP char adds one column on top of len()
+    narrow = _WIDE_RE.sub("", text)
+    width = 2 * len(text) - len(narrow)
+    if not narrow.isascii():
+        for ch in _ASTRAL_RE.findall(narrow):
+            width += _char_width(ch) - 1
     return width
 
 def pad_string(text: str, width: int) -> str:
@@ -37,17 +77,27 @@ def format_size(size_bytes: int) -> str:
         return f"{size_bytes/(1024*1024*1024):.1f}GB"
 
 def truncate_display(text: str, max_width: int) -> str:
-    if get_display_width(text) <= max_width:
+    """Cut ``text`` to ``max_width`` columns, ending in "..." when shortened."""
+    n = len(text)
+    # No char is wider than 2 columns
+    if 2 * n <= max_width:
         return text
-    result = ""
+    limit = max(max_width - 3, 0)
+    if text.isascii():
+        return text if n <= max_width else text[:limit] + "..."
+    if _ALL_WIDE_RE.fullmatch(text):
+        return text[:limit // 2] + "..."
+    # Single pass: remember where the "..." cut goes, stop once over the limit
     width = 0
-    for ch in text:
-        w = 2 if unicodedata.east_asian_width(ch) in ("F", "W", "A") else 1
-        if width + w > max_width - 3:
-            break
-        result += ch
-        width += w
-    return result + "..."
+    cut = -1
+    for i, ch in enumerate(text):
+        cp = ord(ch)
+        width += _BMP_WIDTHS[cp] if cp < 0x10000 else _char_width(ch)
+        if cut < 0 and width > limit:
+            cut = i
+        if width > max_width:
+            return text[:cut] + "..."
+    return text
 
 def format_word_count(word_count: int) -> str:
     if word_count < 10000:
@@ -56,8 +106,12 @@ def format_word_count(word_count: int) -> str:
         return f"{word_count/10000:.1f}万字"
     return f"{word_count/100000000:.2f}亿字"
 
-def format_book_list_item(index: int, book: Dict[str, Any], bot_username: str = "bookbot") -> str:
-    """Format a single book item for the list view."""
+# Rendered list-item fragments per (book id, bot username), tagged with the
+# counters they were rendered from; a changed stamp forces a re-render.
+list_item_cache = LRUCache(maxsize=4096, ttl=600)
+
+def _render_list_item(book: Dict[str, Any], bot_username: str) -> Tuple[str, str]:
+    """Render the index-independent parts of a list item: title HTML and meta line."""
     raw_title = book.get("title") or book.get("file_name", "Unknown")
     title = truncate_display(str(raw_title), 30)
     file_name = str(book.get("file_name", "") or "")
@@ -90,12 +144,26 @@ def format_book_list_item(index: int, book: Dict[str, Any], bot_username: str =
     book_id = book.get("id")
     safe_title = html.escape(title)
     if book_id is None:
-        line1 = f"{index:02d}. {safe_title}"
+        title_html = safe_title
     else:
-        line1 = f"{index:02d}. <a href=\"https://t.me/{bot_username}?start=book_{book_id}\">{safe_title}</a>"
-    line2 = "   · " + " · ".join(fields)
-    
-    return f"{line1}\n<code>{line2}</code>"
+        title_html = f"<a href=\"https://t.me/{bot_username}?start=book_{book_id}\">{safe_title}</a>"
+    return title_html, "   · " + " · ".join(fields)
+
+def format_book_list_item(index: int, book: Dict[str, Any], bot_username: str = "bookbot") -> str:
+    """Format a single book item for the list view."""
+    book_id = book.get("id")
+    if book_id is None:
+        title_html, line2 = _render_list_item(book, bot_username)
+    else:
+        stamp = (book.get("downloads"), book.get("collections"), book.get("updated_at"))
+        key = (book_id, bot_username)
+        cached = list_item_cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            title_html, line2 = cached[1]
+        else:
+            title_html, line2 = _render_list_item(book, bot_username)
+            list_item_cache.set(key, (stamp, (title_html, line2)))
+    return f"{index:02d}. {title_html}\n<code>{line2}</code>"
 
 def format_book_list(
     books: List[Dict[str, Any]],
@@ -117,6 +185,22 @@ def format_book_list(
     footer = "\n\n💎 捐赠会员: 提升等级获得书币，等级权限翻倍，优先体验新功能"
     return header + "\n".join(items) + footer
 
+def build_meili_document(book: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a `books` row into the document shape stored in Meilisearch."""
+    doc = dict(book)
+    file_name = str(doc.get("file_name") or "")
+    doc["ext"] = (file_name.split(".")[-1].upper() if "." in file_name else "FILE")
+    doc["word_count"] = int(doc.get("word_count") or 0)
+    doc["content_rating"] = int(doc.get("content_rating") or 0)
+    # Range menus are counted from a facet distribution over these
+    doc["size_bucket"] = bucket_of(doc.get("file_size"), SIZE_RANGES)
+    doc["words_bucket"] = bucket_of(doc["word_count"], WORD_RANGES)
+    for field in ("created_at", "updated_at", "content_updated_at"):
+        value = doc.get(field)
+        if value is not None and hasattr(value, "isoformat"):
+            doc[field] = value.isoformat()
+    return doc
+
 def format_book_detail(book: Dict[str, Any]) -> str:
     """Format book details for the detail view."""
     title = html.escape(str(book.get("title") or book.get("file_name") or "Unknown"))
@@ -0,0 +1,157 @@
+"""
+Webhook ingestion.
+
+An aiohttp server receives Telegram updates, checks the secret token and
+puts them on a bounded queue drained by a fixed pool of workers. When the
+queue is full the request is refused with 503 so Telegram retries later,
+instead of piling up unbounded handler tasks. The secret check is never
+skipped: without a configured secret a random one is generated and passed
+to setWebhook.
+
+Updates can be POSTed locally for testing:
+
+    curl -X POST localhost:8080/telegram/webhook \
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+         -d '{"update_id": 1, "message": {...}}'
+"""
+import asyncio
+import hmac
+import logging
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+UpdateSink = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+class WebhookServer:
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str = "/telegram/webhook",
+        secret: str = "",
+        queue_size: int = 1000,
+        workers: int = 32,
+        sink: Optional[UpdateSink] = None,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        # Without a secret anyone who finds the URL could inject updates
+        self.secret_generated = not secret
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.workers = workers
+        # Where accepted updates go; defaults to the local dispatcher
+        self.sink = sink or self._feed_dispatcher
+        self.queue: "asyncio.Queue[Tuple[float, Dict[str, Any]]]" = asyncio.Queue(maxsize=queue_size)
+        self._worker_tasks: List[asyncio.Task] = []
+        self.received = 0
+        self.rejected = 0
+        self.unauthorized = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_wait = 0.0
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        app.on_startup.append(self._start_workers)
+        app.on_cleanup.append(self._stop_workers)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.unauthorized += 1
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+        except Exception:
+            return web.Response(status=400)
+        if not isinstance(data, dict) or "update_id" not in data:
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait((time.monotonic(), data))
+        except asyncio.QueueFull:
+            # Telegram redelivers on non-2xx responses
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response(status=200)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def _feed_dispatcher(self, data: Dict[str, Any]):
+        await self.dp.feed_raw_update(self.bot, data)
+
+    async def _worker(self):
+        while True:
+            queued_at, data = await self.queue.get()
+            self.max_wait = max(self.max_wait, time.monotonic() - queued_at)
+            try:
+                await self.sink(data)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Failed to handle update {data.get('update_id')}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _start_workers(self, app: web.Application):
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _stop_workers(self, app: web.Application):
+        # Let queued updates finish before stopping
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook queue not drained, dropping {self.queue.qsize()} updates")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "received": self.received,
+            "rejected": self.rejected,
+            "unauthorized": self.unauthorized,
+            "processed": self.processed,
+            "failed": self.failed,
+            "max_wait_s": round(self.max_wait, 3),
+        }
+
+async def run_webhook(server: WebhookServer, url: str, host: str, port: int):
+    """Register the webhook with Telegram and serve until cancelled."""
+    dp, bot = server.dp, server.bot
+    if server.secret_generated and not url:
+        # Telegram only learns a generated secret through setWebhook
+        raise RuntimeError("WEBHOOK_SECRET must be set when WEBHOOK_URL is empty")
+    await dp.emit_startup(bot=bot)
+    runner = web.AppRunner(server.build_app(), keepalive_timeout=75)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        if url:
+            await bot.set_webhook(
+                url=f"{url.rstrip('/')}{server.path}",
+                secret_token=server.secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=100,
+            )
+            logger.info(f"Webhook set to {url.rstrip('/')}{server.path}")
+        logger.info(f"Webhook server listening on {host}:{port}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)